@@ -4,6 +4,7 @@ import aiohttp
 from discord.utils import setup_logging
 
 from snsimagedl_bot import SnsImageDlBot
+from snsimagedl_bot.api import JobServer
 from snsimagedl_bot.config import AppConfig, set_global_session
 
 
@@ -17,8 +18,18 @@ async def main():
 
         config = AppConfig.from_config(config_path)
         bot = SnsImageDlBot(config=config)
-
-        await bot.start(config.bot.token)
+        # same downloader, saver and session as the bot
+        server = JobServer.from_config(bot.saver, config.api) if config.api else None
+
+        try:
+            if server is not None:
+                await server.start()
+            await bot.start(config.bot.token)
+        finally:
+            if server is not None:
+                await server.close()
+            await bot.downloader.close()
+            bot.saver.close()
 
 
 if __name__ == '__main__':
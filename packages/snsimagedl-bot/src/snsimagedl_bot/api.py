@@ -0,0 +1,206 @@
+import asyncio
+import hmac
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Literal, Self
+
+import msgspec
+from aiohttp import web
+from msgspec import Struct
+
+from snsimagedl_bot.cli import BatchDownloader, BatchResult
+from snsimagedl_bot.config import ApiConfig
+from snsimagedl_bot.saver import MediaSaver
+
+__all__ = (
+    "Job",
+    "JobRequest",
+    "JobServer",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class JobRequest(Struct, kw_only=True, forbid_unknown_fields=True):
+    url: str | None = None
+    urls: list[str] = []
+
+
+class Job(Struct, kw_only=True):
+    id: str
+    urls: list[str]
+    status: Literal["queued", "running", "done"] = "queued"
+    results: list[BatchResult] = []  # in completion order
+    created_at: float
+    finished_at: float | None = None
+
+
+class JobServer:
+    """Local HTTP API to submit urls to the downloader without going through discord.
+
+    `POST /jobs` with `{"url": ...}` or `{"urls": [...]}` queues a job and returns it, `GET /jobs/{id}` returns its
+    status and results, and `GET /jobs/{id}/events` streams a server-sent event per url done until the job is.
+    Urls of every job share `concurrency`, and only the latest `max_jobs` are kept.
+    """
+
+    def __init__(
+            self,
+            saver: MediaSaver,
+            *,
+            host: str = "127.0.0.1",
+            port: int = 8080,
+            token: str | None = None,
+            concurrency: int = 4,
+            max_jobs: int = 1000,
+            heartbeat_interval: float = 15.0
+    ):
+        self.batch = BatchDownloader(saver, concurrency=concurrency)
+        self.host = host
+        self.port = port
+        self.token = token
+        self.max_jobs = max_jobs
+        self.heartbeat_interval = heartbeat_interval  # keeps idle event streams open through proxies
+
+        self.limit = asyncio.Semaphore(concurrency)
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self.subscribers: dict[str, set[asyncio.Queue[bytes | None]]] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder(JobRequest)
+
+        self.app = web.Application(middlewares=[self._authenticate])
+        self.app.add_routes([
+            web.post("/jobs", self.submit),
+            web.get("/jobs/{id}", self.status),
+            web.get("/jobs/{id}/events", self.events),
+        ])
+        self.runner: web.AppRunner | None = None
+
+    @classmethod
+    def from_config(cls, saver: MediaSaver, config: ApiConfig) -> Self:
+        return cls(
+            saver,
+            host=config.host,
+            port=config.port,
+            token=config.token,
+            concurrency=config.concurrency,
+            max_jobs=config.max_jobs
+        )
+
+    @web.middleware
+    async def _authenticate(self, request: web.Request, handler) -> web.StreamResponse:
+        # in constant time, so the token cannot be guessed from how long a rejection takes
+        if self.token is not None and not hmac.compare_digest(
+                request.headers.get("Authorization", "").encode(),
+                f"Bearer {self.token}".encode()
+        ):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    def _json(self, value: Struct, *, status: int = 200) -> web.Response:
+        return web.Response(body=self.encoder.encode(value), status=status, content_type="application/json")
+
+    def _get_job(self, request: web.Request) -> Job:
+        job = self.jobs.get(request.match_info["id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        return job
+
+    def _event(self, event: str, value: Struct) -> bytes:
+        return f"event: {event}\ndata: ".encode() + self.encoder.encode(value) + b"\n\n"
+
+    def _publish(self, job: Job, event: str, value: Struct) -> None:
+        message = self._event(event, value)
+        for queue in self.subscribers.get(job.id, ()):
+            queue.put_nowait(message)
+
+    def _evict(self) -> None:
+        # oldest first, running jobs are kept
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.status == "done"]:
+            if len(self.jobs) <= self.max_jobs:
+                break
+            del self.jobs[job_id]
+
+    async def _process(self, job: Job, url: str) -> None:
+        async with self.limit:
+            result = await self.batch.process(url)
+        job.results.append(result)
+        self._publish(job, "result", result)
+
+    async def _run(self, job: Job) -> None:
+        job.status = "running"
+        self._publish(job, "status", job)
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for url in job.urls:
+                    tg.create_task(self._process(job, url))
+        finally:
+            job.status = "done"
+            job.finished_at = time.time()
+            self._publish(job, "status", job)
+            for queue in self.subscribers.pop(job.id, ()):
+                queue.put_nowait(None)
+
+    async def submit(self, request: web.Request) -> web.Response:
+        try:
+            body = self.decoder.decode(await request.read())
+        except msgspec.DecodeError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        urls = list(dict.fromkeys([*([body.url] if body.url else []), *body.urls]))  # unique, in order
+        if not urls:
+            raise web.HTTPBadRequest(text="No url given.")
+
+        job = Job(id=uuid.uuid4().hex, urls=urls, created_at=time.time())
+        self.jobs[job.id] = job
+        self._evict()
+
+        task = asyncio.create_task(self._run(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        logger.info(f"Queued job {job.id} with {len(urls)} urls")
+        return self._json(job, status=202)
+
+    async def status(self, request: web.Request) -> web.Response:
+        return self._json(self._get_job(request))
+
+    async def events(self, request: web.Request) -> web.StreamResponse:
+        job = self._get_job(request)
+
+        # the state so far and the subscription are taken together, no event is missed or sent twice
+        snapshot = self._event("status", job)
+        queue: asyncio.Queue[bytes | None] = asyncio.Queue()
+        if job.status != "done":
+            self.subscribers.setdefault(job.id, set()).add(queue)
+        else:
+            queue.put_nowait(None)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        try:
+            await response.prepare(request)
+            await response.write(snapshot)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.heartbeat_interval)
+                except TimeoutError:
+                    message = b": heartbeat\n\n"
+                if message is None:
+                    break
+                await response.write(message)
+        finally:
+            self.subscribers.get(job.id, set()).discard(queue)
+        return response
+
+    async def start(self) -> None:
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"Job API listening on http://{self.host}:{self.port}")
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
@@ -3,6 +3,8 @@ from discord.ext.commands import Bot
 
 from snsimagedl_bot import commands
 from snsimagedl_bot.config import AppConfig
+from snsimagedl_bot.profiling import SamplingProfiler, Tracer
+from snsimagedl_bot.saver import MediaSaver
 
 __all__ = (
     "SnsImageDlBot",
@@ -17,6 +19,9 @@ class SnsImageDlBot(Bot):
         )
         self.config = config
         self.downloader = config.create_downloader()
+        self.saver = MediaSaver(config, self.downloader)
+        self.profiler = SamplingProfiler()
+        self.tracer = Tracer()
 
     async def setup_hook(self) -> None:
         await self.add_cog(commands.General(self))
@@ -0,0 +1,49 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+__all__ = (
+    "CheckpointStore",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """The id of the last message processed in each watched channel, so messages sent while offline can be caught up.
+
+    Advancing only marks the store dirty, `save` writes it out and is called on an interval rather than per message.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.checkpoints: dict[int, int] = {}
+        self.dirty = False
+
+        try:
+            self.checkpoints = {int(channel_id): message_id for channel_id, message_id in
+                                json.loads(self.path.read_bytes()).items()}
+        except FileNotFoundError:
+            pass
+        except ValueError, AttributeError:
+            logger.warning(f"Ignoring unreadable checkpoints in {self.path}")
+
+    def get(self, channel_id: int) -> int | None:
+        return self.checkpoints.get(channel_id)
+
+    def advance(self, channel_id: int, message_id: int) -> None:
+        # handlers finish out of order, never move back
+        if message_id > self.checkpoints.get(channel_id, 0):
+            self.checkpoints[channel_id] = message_id
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+
+        # written aside and renamed, so a crash mid-write keeps the previous checkpoints
+        temp = self.path.with_name(f"{self.path.name}.tmp")
+        temp.write_text(json.dumps({str(channel_id): message_id for channel_id, message_id in self.checkpoints.items()}))
+        os.replace(temp, self.path)
+        self.dirty = False
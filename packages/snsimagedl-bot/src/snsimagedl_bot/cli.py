@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Literal, Iterable, TYPE_CHECKING
+
+import aiohttp
+import msgspec
+from discord.utils import setup_logging
+from msgspec import Struct
+
+from snsimagedl_bot.config import AppConfig, set_global_session
+from snsimagedl_bot.saver import MediaSaver
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsWrite
+
+__all__ = (
+    "BatchResult",
+    "BatchDownloader",
+    "main",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BatchResult(Struct, kw_only=True):
+    url: str
+    status: Literal["ok", "empty", "error"]
+    files: list[str] = []
+    error: str | None = None
+    elapsed: float = 0.0
+
+
+class BatchDownloader:
+    COMPLETED_STATUSES = ("ok", "empty")
+
+    def __init__(self, saver: MediaSaver, *, concurrency: int = 4, progress_interval: float = 5.0):
+        self.saver = saver
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.files = 0
+        self.bytes = 0
+        self.started_at = time.monotonic()
+
+    @classmethod
+    def read_completed(cls, log_path: Path) -> set[str]:
+        """Returns the urls already recorded as completed in a previous run's result log."""
+        if not log_path.exists():
+            return set()
+
+        decoder = msgspec.json.Decoder(BatchResult)
+        completed = set()
+        with log_path.open("rb") as f:
+            for line in f:
+                try:
+                    result = decoder.decode(line)
+                except msgspec.DecodeError:
+                    continue  # a run killed mid-write leaves a truncated last line
+                if result.status in cls.COMPLETED_STATUSES:
+                    completed.add(result.url)
+        return completed
+
+    async def process(self, url: str) -> BatchResult:
+        """Saves the media of a url, never raises, failures are reported in the result."""
+        start = time.monotonic()
+        try:
+            results = await self.saver.downloader.query(url)
+            paths = await self.saver.save_all(results)
+        except Exception as e:
+            logger.exception(f"Failed to save {url}")
+            return BatchResult(url=url, status="error", error=repr(e), elapsed=time.monotonic() - start)
+
+        self.files += len(paths)
+        self.bytes += sum(self.saver.storage.size(path.as_posix()) for path in paths)
+        return BatchResult(
+            url=url,
+            status="ok" if paths else "empty",
+            files=[str(path) for path in paths],
+            elapsed=time.monotonic() - start
+        )
+
+    async def _worker(self, queue: asyncio.Queue[str], log: SupportsWrite[bytes]) -> None:
+        encoder = msgspec.json.Encoder()
+        while True:
+            url = await queue.get()
+            try:
+                result = await self.process(url)
+
+                self.processed += 1
+                if result.status == "error":
+                    self.failed += 1
+
+                log.write(encoder.encode(result) + b"\n")
+                log.flush()
+            finally:
+                queue.task_done()
+
+    def report_progress(self) -> None:
+        elapsed = time.monotonic() - self.started_at
+        logger.info(
+            f"{self.processed}/{self.total} urls ({self.failed} failed), {self.files} files, "
+            f"{self.bytes / 2 ** 20:.1f} MiB | "
+            f"{self.processed / elapsed:.2f} urls/s, {self.bytes / 2 ** 20 / elapsed:.2f} MiB/s"
+        )
+        if (budget := self.saver.downloader.budget) is not None:
+            logger.info(f"Memory: {budget.report()}")
+
+    async def _reporter(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.report_progress()
+
+    async def run(self, urls: Iterable[str], log_path: Path) -> None:
+        completed = self.read_completed(log_path)
+
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        seen = set()
+        skipped = duplicates = 0
+        for url in urls:
+            if url in completed:
+                skipped += 1
+                continue
+            if url in seen:
+                duplicates += 1
+                continue
+            seen.add(url)
+            queue.put_nowait(url)
+
+        self.total = queue.qsize()
+        logger.info(f"Queued {self.total} urls, skipped {skipped} already completed and {duplicates} duplicates.")
+
+        self.started_at = time.monotonic()
+        with log_path.open("ab") as log:
+            async with asyncio.TaskGroup() as tg:
+                workers = [tg.create_task(self._worker(queue, log)) for _ in range(self.concurrency)]
+                reporter = tg.create_task(self._reporter())
+
+                await queue.join()
+                for task in (*workers, reporter):
+                    task.cancel()
+
+        self.report_progress()
+        if self.saver.recompressor is not None:
+            logger.info(f"Recompression:\n{self.saver.recompressor.report()}")
+
+
+def read_urls(fp: Iterable[str]) -> list[str]:
+    return [
+        line for line in (line.strip() for line in fp)
+        if line and not line.startswith("#")
+    ]
+
+
+async def run(args: argparse.Namespace) -> None:
+    if args.input == "-":
+        urls = read_urls(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            urls = read_urls(f)
+
+    async with aiohttp.ClientSession() as session:
+        set_global_session(session)
+
+        config = AppConfig.from_config(args.config)
+        downloader = config.create_downloader()
+        saver = MediaSaver(config, downloader)
+
+        batch = BatchDownloader(saver, concurrency=args.concurrency, progress_interval=args.progress_interval)
+        try:
+            await batch.run(urls, Path(args.log))
+        finally:
+            await downloader.close()
+            saver.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Download every url listed in a file without the discord bot.")
+    parser.add_argument("input", nargs="?", default="-", help="file with one url per line, or - for stdin")
+    parser.add_argument("-c", "--config", default="./config.json", help="path to the app config")
+    parser.add_argument("-l", "--log", default="./batch.jsonl", help="JSON lines result log, also used to resume")
+    parser.add_argument("-j", "--concurrency", type=int, default=4, help="number of urls processed at once")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between progress reports")
+    args = parser.parse_args()
+
+    setup_logging()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import re
+from contextlib import aclosing
 from typing import TYPE_CHECKING, Collection, ClassVar
 
-from discord import Message, VoiceChannel, TextChannel, Embed
+from discord import Message, VoiceChannel, TextChannel, Embed, Object
+from discord.utils import time_snowflake, utcnow
 from discord.ext import commands
 from discord.ext.commands import Cog, Context
 
-from snsimagedl_bot.formatter import FilePathFormatter, FilePathContext
+from snsimagedl_bot.profiling import span
 from snsimagedl_lib import QueryResult
+from snsimagedl_lib.exceptions import UnsupportedLink
 
 if TYPE_CHECKING:
     from snsimagedl_bot.bot import SnsImageDlBot
@@ -17,6 +22,8 @@ __all__ = (
     "Downloader",
 )
 
+logger = logging.getLogger(__name__)
+
 
 class Downloader(Cog):
     URL_PATTERN: ClassVar[re.Pattern] = re.compile(
@@ -28,28 +35,80 @@ class Downloader(Cog):
             bot: SnsImageDlBot,
     ):
         self.bot = bot
-        self.path_formatter = FilePathFormatter()
+
+        catch_up = bot.config.catch_up
+        self.checkpoints = catch_up.instance if catch_up else None
+        self.catch_up_limit = asyncio.Semaphore(catch_up.concurrency if catch_up else 1)
+        self.catching_up: set[int] = set()
+        self.deferred_checkpoints: dict[int, int] = {}  # live messages in channels still catching up
+        self.checkpoint_saver: asyncio.Task | None = None
+
+    async def cog_load(self) -> None:
+        if self.checkpoints is not None:
+            self.checkpoint_saver = asyncio.create_task(self._save_checkpoints())
+
+    async def cog_unload(self) -> None:
+        if self.checkpoint_saver is not None:
+            self.checkpoint_saver.cancel()
+        if self.checkpoints is not None:
+            self.checkpoints.save()
+
+    async def _save_checkpoints(self) -> None:
+        while True:
+            await asyncio.sleep(self.bot.config.catch_up.save_interval)
+            try:
+                self.checkpoints.save()
+            except OSError:
+                logger.exception("Failed to save the checkpoints")
 
     async def _query(self, message: Message, /) -> Collection[QueryResult]:
         urls = self.URL_PATTERN.findall(message.content)
 
         results = []
+        seen = set()
         for url in urls:
-            for result in await self.bot.downloader.query(url):
-                results.append(result)
+            with span("query"):
+                queried = await self.bot.downloader.query(url)
+            for result in queried:
+                # a tweet linked along with the one quoting it is expanded from both
+                if result.metadata.source_url not in seen:
+                    seen.add(result.metadata.source_url)
+                    results.append(result)
         return results
 
     async def _save(self, results: Collection[QueryResult]) -> None:
-        for result in results:
-            path = self.path_formatter.compile_path(
-                self.bot.config.output_directory,
-                context=FilePathContext.from_query(result)
-            )
-            path.parent.mkdir(exist_ok=True, parents=True)
-
-            (await result.download()) \
-                .tag() \
-                .save_to(path)
+        await self.bot.saver.save_all(results)
+
+    async def _crawl(self, url: str) -> int | None:
+        """Saves the posts of a listing, like an artist's works, until one already saved or `crawl.max_posts`.
+
+        Returns how many were saved, `None` if `url` is not a listing.
+        """
+        try:
+            posts = self.bot.downloader.crawl(url, self.bot.saver.is_archived)
+        except UnsupportedLink:
+            return None
+
+        max_posts = self.bot.config.crawl.max_posts
+        saved = 0
+        # the crawler loads the next page of the listing while a post is being saved
+        async with aclosing(posts):
+            async for results in posts:
+                await self._save(results)
+                saved += 1
+                if saved >= max_posts:
+                    logger.info(f"Stopped crawling {url} at the limit of {max_posts} posts")
+                    break
+        logger.info(f"Saved {saved} posts from {url}")
+        return saved
+
+    async def _crawl_all(self, message: Message, /) -> int:
+        """Crawls the listings linked in the message, returns how many there were."""
+        listings = 0
+        for url in self.URL_PATTERN.findall(message.content):
+            if await self._crawl(url) is not None:
+                listings += 1
+        return listings
 
     @staticmethod
     def _get_success_embed(results: Collection[QueryResult]) -> Embed:
@@ -59,6 +118,17 @@ class Downloader(Cog):
 
         return embed
 
+    def _advance_checkpoint(self, message: Message, /) -> None:
+        if self.checkpoints is None:
+            return
+
+        channel_id = message.channel.id
+        if channel_id in self.catching_up:
+            # the older messages are not all saved yet, moving past them now would lose them on a restart
+            self.deferred_checkpoints[channel_id] = max(self.deferred_checkpoints.get(channel_id, 0), message.id)
+        else:
+            self.checkpoints.advance(channel_id, message.id)
+
     @Cog.listener("on_message")
     async def autosave(self, message: Message, /) -> None:
         if message.author == self.bot.user:
@@ -67,12 +137,81 @@ class Downloader(Cog):
         if message.channel.id not in self.bot.config.watch_channel_ids:
             return
 
-        results = await self._query(message)
-        if results:
-            await self._save(results)
-            await message.add_reaction("✅")
-        else:
-            await message.add_reaction("❌")
+        try:
+            await self._autosave(message)
+        finally:
+            self._advance_checkpoint(message)
+
+    async def _catch_up_message(self, message: Message, /) -> None:
+        try:
+            if message.author != self.bot.user:
+                await self._autosave(message)
+        except Exception:
+            logger.exception(f"Failed to catch up on message {message.jump_url}")
+        finally:
+            self.catch_up_limit.release()
+
+    async def _catch_up_channel(self, channel_id: int) -> None:
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            logger.warning(f"Cannot catch up on channel {channel_id}, it is not visible to the bot.")
+            return
+
+        checkpoint = self.checkpoints.get(channel_id)
+        if checkpoint is None:
+            # first run, start tracking from now instead of the whole history
+            if channel.last_message_id is not None:
+                self.checkpoints.advance(channel_id, channel.last_message_id)
+            return
+
+        self.catching_up.add(channel_id)
+        now = Object(id=time_snowflake(utcnow()))  # newer messages arrive through on_message
+        last_message_id = checkpoint
+        caught_up = 0
+        try:
+            async with asyncio.TaskGroup() as tg:
+                async for message in channel.history(
+                        limit=None,
+                        after=Object(id=checkpoint),
+                        before=now,
+                        oldest_first=True
+                ):
+                    # stops reading history while the catch up budget is used up
+                    await self.catch_up_limit.acquire()
+                    tg.create_task(self._catch_up_message(message))
+                    last_message_id = message.id
+                    caught_up += 1
+        except Exception:
+            # the checkpoint stays, the next catch up starts over and revalidation makes the repeats cheap
+            self.deferred_checkpoints.pop(channel_id, None)
+            logger.exception(f"Failed to catch up on {channel.mention}")
+            return
+        finally:
+            self.catching_up.discard(channel_id)
+
+        self.checkpoints.advance(channel_id, max(last_message_id, self.deferred_checkpoints.pop(channel_id, 0)))
+        if caught_up:
+            logger.info(f"Caught up on {caught_up} messages in {channel.mention}")
+
+    @Cog.listener("on_ready")
+    async def catch_up(self) -> None:
+        """Saves the messages sent to the watched channels while the bot was offline, oldest first."""
+        if self.checkpoints is None:
+            return
+
+        # on_ready fires again on reconnects, channels still catching up are skipped
+        channel_ids = set(self.bot.config.watch_channel_ids) - self.catching_up
+        await asyncio.gather(*(self._catch_up_channel(channel_id) for channel_id in channel_ids))
+        self.checkpoints.save()
+
+    async def _autosave(self, message: Message, /) -> None:
+        with self.bot.tracer.job(f"message {message.jump_url}"):
+            results = await self._query(message)
+            if results:
+                await self._save(results)
+            # a whole listing is a bulk download, only crawled from a message when enabled
+            listings = await self._crawl_all(message) if self.bot.config.crawl.autosave else 0
+        await message.add_reaction("✅" if results or listings else "❌")
 
     @commands.hybrid_group()
     async def save(self, ctx: Context, message: Message | None = None) -> None:
@@ -81,12 +220,20 @@ class Downloader(Cog):
 
     @save.command(name="url")
     async def save_url(self, ctx: Context, url: str) -> None:
-        results = await self.bot.downloader.query(url)
-        if results:
-            await self._save(results)
+        with self.bot.tracer.job(f"url {url}"):
+            with span("query"):
+                results = await self.bot.downloader.query(url)
+            if results:
+                await self._save(results)
+                crawled = None
+            else:
+                crawled = await self._crawl(url)
 
+        if results:
             embed = self._get_success_embed(results)
             await ctx.reply(embed=embed, ephemeral=True)
+        elif crawled is not None:
+            await ctx.reply(f"Saved {crawled} new posts.", ephemeral=True)
         else:
             await ctx.reply("No media found.", ephemeral=True)
 
@@ -159,3 +306,86 @@ class Downloader(Cog):
 
         self.bot.config.watch_channel_ids.remove(channel.id)
         await ctx.reply(f"{channel.mention} is removed from the watch channel list.", ephemeral=True)
+
+    @commands.hybrid_command()
+    async def search(
+            self,
+            ctx: Context,
+            text: str | None = None,
+            artist: str | None = None,
+            keyword: str | None = None,
+            limit: commands.Range[int, 1, 25] = 10
+    ) -> None:
+        catalog = self.bot.saver.catalog
+        if catalog is None:
+            await ctx.reply("The catalog is disabled.", ephemeral=True)
+            return
+
+        entries = catalog.search(text, artist=artist, keywords=[keyword] if keyword else (), limit=limit)
+        if not entries:
+            await ctx.reply("Nothing found.", ephemeral=True)
+            return
+
+        embed = Embed(title="Search results")
+        embed.description = "\n".join(
+            f"[{entry.metadata.filename}]({entry.metadata.webpage_url or entry.metadata.source_url})"
+            + (f" by {entry.metadata.artist.display_name}" if entry.metadata.artist else "")
+            for entry in entries
+        )[:4096]
+        await ctx.reply(embed=embed, ephemeral=True)
+
+    @commands.hybrid_command()
+    @commands.is_owner()
+    async def recompression(self, ctx: Context) -> None:
+        recompressor = self.bot.saver.recompressor
+        if recompressor is None:
+            await ctx.reply("Recompression is disabled.", ephemeral=True)
+            return
+
+        await ctx.reply(recompressor.report(), ephemeral=True)
+
+    @commands.hybrid_command()
+    @commands.is_owner()
+    async def memory(self, ctx: Context) -> None:
+        budget = self.bot.downloader.budget
+        if budget is None:
+            await ctx.reply("Memory budget is disabled.", ephemeral=True)
+            return
+
+        await ctx.reply(budget.report(), ephemeral=True)
+
+    @commands.hybrid_group()
+    @commands.is_owner()
+    async def cache(self, ctx: Context) -> None:
+        if not ctx.invoked_subcommand:
+            await ctx.send_help(ctx.command)
+
+    @cache.command(name="invalidate")
+    @commands.is_owner()
+    async def invalidate_cache(self, ctx: Context, url: str) -> None:
+        negative_cache = self.bot.downloader.negative_cache
+        if negative_cache is None:
+            await ctx.reply("Negative cache is disabled.", ephemeral=True)
+            return
+
+        invalidated = 0
+        for extractor in self.bot.downloader.extractors:
+            key = negative_cache.key_for(extractor, url)
+            if key is not None and negative_cache.invalidate(key):
+                invalidated += 1
+
+        if invalidated:
+            await ctx.reply(f"Invalidated cached failure for <{url}>.", ephemeral=True)
+        else:
+            await ctx.reply(f"No cached failure for <{url}>.", ephemeral=True)
+
+    @cache.command(name="clear")
+    @commands.is_owner()
+    async def clear_cache(self, ctx: Context, reason: str | None = None) -> None:
+        negative_cache = self.bot.downloader.negative_cache
+        if negative_cache is None:
+            await ctx.reply("Negative cache is disabled.", ephemeral=True)
+            return
+
+        cleared = negative_cache.clear(reason)
+        await ctx.reply(f"Cleared {cleared} cached failures.", ephemeral=True)
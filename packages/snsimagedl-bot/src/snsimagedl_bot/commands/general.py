@@ -1,5 +1,18 @@
+from __future__ import annotations
+
+import asyncio
+import io
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from discord import File
 from discord.ext import commands
-from discord.ext.commands import Cog, Context, Bot
+from discord.ext.commands import Cog, Context
+
+from snsimagedl_bot.profiling import SamplingProfiler
+
+if TYPE_CHECKING:
+    from snsimagedl_bot.bot import SnsImageDlBot
 
 __all__ = (
     "General",
@@ -7,9 +20,12 @@ __all__ = (
 
 
 class General(Cog):
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: SnsImageDlBot):
         self.bot = bot
 
+    async def cog_unload(self) -> None:
+        self.bot.tracer.stop()
+
     @commands.command()
     @commands.is_owner()
     async def sync(self, ctx: Context, globally: bool = False):
@@ -19,3 +35,56 @@ class General(Cog):
             await self.bot.tree.sync(guild=ctx.guild)
 
         await ctx.reply("Syncing...", ephemeral=True)
+
+    @commands.hybrid_command()
+    @commands.is_owner()
+    async def profile(self, ctx: Context, seconds: commands.Range[float, 1, 300] = 30) -> None:
+        """Samples what the bot is doing for a while and uploads the collapsed stacks, for a flame graph."""
+        profiler = self.bot.profiler
+        if profiler.lock.locked():
+            await ctx.reply("A profile is already running.", ephemeral=True)
+            return
+
+        await ctx.defer(ephemeral=True)
+        # sampled from a thread, the event loop keeps running and shows up in the profile
+        stacks = await asyncio.to_thread(profiler.sample, seconds)
+        filename = f"profile-{datetime.now():%Y%m%d-%H%M%S}.collapsed"
+        await ctx.reply(
+            f"{stacks.total()} samples over {seconds:g}s.",
+            file=File(io.BytesIO(SamplingProfiler.format(stacks).encode()), filename=filename),
+            ephemeral=True
+        )
+
+    @commands.hybrid_group()
+    @commands.is_owner()
+    async def trace(self, ctx: Context) -> None:
+        if not ctx.invoked_subcommand:
+            await self.trace_status(ctx)
+
+    @trace.command(name="start")
+    @commands.is_owner()
+    async def trace_start(self, ctx: Context, threshold: float = 5.0) -> None:
+        """Times the stages of every job, logging the ones slower than `threshold` seconds."""
+        self.bot.tracer.start(threshold)
+        await ctx.reply(f"Tracing jobs, logging those over {threshold:g}s.", ephemeral=True)
+
+    @trace.command(name="stop")
+    @commands.is_owner()
+    async def trace_stop(self, ctx: Context) -> None:
+        self.bot.tracer.stop()
+        await ctx.reply("Tracing stopped.", ephemeral=True)
+
+    @trace.command(name="status")
+    @commands.is_owner()
+    async def trace_status(self, ctx: Context) -> None:
+        tracer = self.bot.tracer
+        if not tracer.enabled:
+            await ctx.reply("Tracing is off.", ephemeral=True)
+            return
+
+        lines = [
+            f"Tracing jobs over {tracer.threshold:g}s, {len(tracer.active)} running, "
+            f"loop lag {tracer.loop_lag * 1000:.0f}ms.",
+            *(trace.format() for trace in reversed(tracer.slow_jobs))
+        ]
+        await ctx.reply("\n".join(lines)[:2000], ephemeral=True)
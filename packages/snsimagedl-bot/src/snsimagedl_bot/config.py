@@ -1,13 +1,16 @@
 from pathlib import Path
-from typing import Collection, Self, TYPE_CHECKING
+from typing import Collection, Literal, Self, TYPE_CHECKING
 
 import aiohttp
 import msgspec
 from msgspec import Struct
 
-from snsimagedl_lib import Extractor, FileTagger, ExifTagger, XmpTagger, JpegCommentTagger, MediaDownloader
+from snsimagedl_lib import Extractor, FileTagger, ExifTagger, XmpTagger, JpegCommentTagger, Mp4Tagger, MediaDownloader, \
+    NegativeCache, DuplicateIndex, StorageBackend, LooseFileStorage, ArchiveStorage, Recompressor, Catalog, MemoryBudget
+from snsimagedl_dcinside import DcinsideExtractor
 from snsimagedl_pixiv import PixivExtractor
 from snsimagedl_twitter import TwitterExtractor
+from snsimagedl_bot.checkpoint import CheckpointStore
 
 if TYPE_CHECKING:
     from _typeshed import SupportsWrite, SupportsRead
@@ -38,18 +41,54 @@ class ExtractorConfig[T: Extractor](Struct, tag_field="type", tag=config_namer):
 
 class TwitterConfig(ExtractorConfig[TwitterExtractor], kw_only=True):
     token: str | None = None
+    full_models: bool = False  # decode the full API schema, for debugging
+    max_video_bitrate: int | None = None  # bits per second
+    max_video_size: int | None = None  # bytes, estimated from the bitrate and duration
+    hls_concurrency: int = 8  # concurrent segment downloads for HLS only videos
+    expand_quotes: bool = False  # also save the media of quoted tweets
+    expand_threads: bool = False  # also save the media of the earlier tweets of the author's thread
+    expansion_concurrency: int = 4  # related tweets fetched at once
+    max_expanded: int = 20  # related tweets fetched per link
+    crawl_concurrency: int = 4  # tweets looked up at once when crawling a profile
 
     @property
     def instance(self) -> TwitterExtractor:
-        return TwitterExtractor(session)
+        return TwitterExtractor(
+            session,
+            full_models=self.full_models,
+            max_video_bitrate=self.max_video_bitrate,
+            max_video_size=self.max_video_size,
+            hls_concurrency=self.hls_concurrency,
+            expand_quotes=self.expand_quotes,
+            expand_threads=self.expand_threads,
+            expansion_concurrency=self.expansion_concurrency,
+            max_expanded=self.max_expanded,
+            crawl_concurrency=self.crawl_concurrency
+        )
 
 
 class PixivConfig(ExtractorConfig[PixivExtractor], kw_only=True):
     refresh_token: str
+    full_models: bool = False  # decode the full API schema, for debugging
+    max_connections: int = 8  # concurrent image downloads from i.pximg.net
+    ugoira_format: Literal["webp", "apng"] = "webp"
 
     @property
     def instance(self) -> PixivExtractor:
-        return PixivExtractor(self.refresh_token)
+        return PixivExtractor(
+            self.refresh_token,
+            full_models=self.full_models,
+            max_connections=self.max_connections,
+            ugoira_format=self.ugoira_format
+        )
+
+
+class DcinsideConfig(ExtractorConfig[DcinsideExtractor], kw_only=True):
+    max_connections: int = 8  # concurrent image downloads per post
+
+    @property
+    def instance(self) -> DcinsideExtractor:
+        return DcinsideExtractor(session, max_connections=self.max_connections)
 
 
 class TaggerConfig[T: FileTagger](Struct, tag_field="type", tag=config_namer):
@@ -76,6 +115,123 @@ class JpegConfig(TaggerConfig[JpegCommentTagger], kw_only=True):
         return JpegCommentTagger()
 
 
+class Mp4Config(TaggerConfig[Mp4Tagger], kw_only=True):
+    @property
+    def instance(self) -> Mp4Tagger:
+        return Mp4Tagger()
+
+
+class NegativeCacheConfig(Struct, kw_only=True):
+    path: str = "./negative_cache.sqlite3"
+    ttls: dict[str, float] = {}  # seconds, keyed by reason: "deleted", "age_restricted", "unsupported"
+
+    @property
+    def instance(self) -> NegativeCache:
+        return NegativeCache(self.path, self.ttls)
+
+
+class StorageConfig[T: StorageBackend](Struct, tag_field="type", tag=config_namer):
+    @property
+    def instance(self) -> T:
+        raise NotImplementedError
+
+
+class LooseConfig(StorageConfig[LooseFileStorage], kw_only=True):
+    @property
+    def instance(self) -> LooseFileStorage:
+        return LooseFileStorage()
+
+
+class ArchiveConfig(StorageConfig[ArchiveStorage], kw_only=True):
+    directory: str = "./archive"
+    shard_size: int = 1024 * 1024 * 1024  # bytes
+    batch_size: int = 64  # items buffered before they are appended
+    batch_bytes: int = 64 * 1024 * 1024
+    flush_interval: float = 30.0  # seconds an item may stay buffered
+
+    @property
+    def instance(self) -> ArchiveStorage:
+        return ArchiveStorage(
+            self.directory,
+            shard_size=self.shard_size,
+            batch_size=self.batch_size,
+            batch_bytes=self.batch_bytes,
+            flush_interval=self.flush_interval
+        )
+
+
+type DuplicatePolicy = Literal["keep_highest", "link", "skip"]
+
+
+class DeduplicationConfig(Struct, kw_only=True):
+    path: str = "./duplicates.sqlite3"
+    # keep_highest: replace the saved copy if the new one has a higher resolution, skip it otherwise
+    # link: hard link the new path to the saved copy
+    # skip: do not save the new copy
+    policy: DuplicatePolicy = "keep_highest"
+    max_distance: int = 6  # bits differing between two hashes of the same image
+    max_workers: int = 1
+
+    @property
+    def instance(self) -> DuplicateIndex:
+        return DuplicateIndex(self.path, max_distance=self.max_distance, max_workers=self.max_workers)
+
+
+class RecompressionConfig(Struct, kw_only=True):
+    max_workers: int = 1  # cpu cores given to re-encoding
+    niceness: int = 10  # added to the workers' scheduling priority
+    min_size: int = 64 * 1024  # bytes, smaller files are kept as-is
+
+    @property
+    def instance(self) -> Recompressor:
+        return Recompressor(max_workers=self.max_workers, niceness=self.niceness, min_size=self.min_size)
+
+
+class MemoryConfig(Struct, kw_only=True):
+    limit: int = 512 * 1024 * 1024  # bytes of media held in memory at once, across all downloads
+    spill_size: int | None = None  # bytes, larger media are streamed to disk, a quarter of `limit` if not set
+    spill_directory: str | None = None  # the system temporary directory if not set
+
+    @property
+    def instance(self) -> MemoryBudget:
+        return MemoryBudget(self.limit, spill_size=self.spill_size, spill_directory=self.spill_directory)
+
+
+class TaggingConfig(Struct, kw_only=True):
+    max_workers: int = 1  # processes tagging files off the event loop
+
+
+class CatalogConfig(Struct, kw_only=True):
+    path: str = "./catalog.sqlite3"
+
+    @property
+    def instance(self) -> Catalog:
+        return Catalog(self.path)
+
+
+class CatchUpConfig(Struct, kw_only=True):
+    path: str = "./checkpoints.json"
+    concurrency: int = 2  # messages caught up at once, live messages are not limited
+    save_interval: float = 30.0  # seconds between writing the checkpoints out
+
+    @property
+    def instance(self) -> CheckpointStore:
+        return CheckpointStore(self.path)
+
+
+class CrawlConfig(Struct, kw_only=True):
+    autosave: bool = False  # also crawl listings linked in the watched channels, not only those given to `save url`
+    max_posts: int = 100  # newest posts saved per listing, older ones are not crawled
+
+
+class ApiConfig(Struct, kw_only=True):
+    host: str = "127.0.0.1"  # local tools only, put it behind a proxy to expose it
+    port: int = 8080
+    token: str | None = None  # required as `Authorization: Bearer <token>` if set
+    concurrency: int = 4  # urls processed at once, across all jobs
+    max_jobs: int = 1000  # finished jobs kept for status queries
+
+
 class BotConfig(Struct, kw_only=True):
     token: str
     command_prefix: str
@@ -85,13 +241,25 @@ class AppConfig(Struct, kw_only=True):
     bot: BotConfig
     watch_channel_ids: set[int]
     output_directory: str
-    extractors: Collection[TwitterConfig | PixivConfig] = []
-    taggers: Collection[ExifConfig | XmpConfig | JpegConfig] = []
+    extractors: Collection[TwitterConfig | PixivConfig | DcinsideConfig] = []
+    taggers: Collection[ExifConfig | XmpConfig | JpegConfig | Mp4Config] = []
+    tagging: TaggingConfig | None = None  # tag on the event loop if not set
+    memory: MemoryConfig | None = None  # downloads are not bounded if not set
+    negative_cache: NegativeCacheConfig | None = None
+    deduplication: DeduplicationConfig | None = None
+    recompression: RecompressionConfig | None = None
+    catalog: CatalogConfig | None = None
+    catch_up: CatchUpConfig | None = None
+    crawl: CrawlConfig = msgspec.field(default_factory=CrawlConfig)
+    api: ApiConfig | None = None
+    storage: LooseConfig | ArchiveConfig = msgspec.field(default_factory=LooseConfig)
 
     def create_downloader(self) -> MediaDownloader:
         return MediaDownloader(
             [config.instance for config in self.extractors],
-            [config.instance for config in self.taggers]
+            [config.instance for config in self.taggers],
+            negative_cache=self.negative_cache.instance if self.negative_cache else None,
+            budget=self.memory.instance if self.memory else None
         )
 
     def save(self, fp: str | Path | SupportsWrite[bytes]) -> None:
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+__all__ = (
+    "SamplingProfiler",
+    "JobTrace",
+    "Tracer",
+    "span",
+    "record",
+)
+
+logger = logging.getLogger(__name__)
+
+_current_trace: ContextVar[JobTrace | None] = ContextVar("current_trace", default=None)
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread of the running process, without restarting it under a profiler.
+
+    The result is in the collapsed stack format, one `frame;frame;frame count` line per stack, read by
+    flamegraph.pl and speedscope. Worker processes are not sampled.
+    """
+
+    def __init__(self, *, interval: float = 0.005):
+        self.interval = interval
+        self.lock = threading.Lock()  # one profile at a time
+
+    @staticmethod
+    def _collapse(frame, thread_name: str) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ";".join(reversed(frames))
+
+    def sample(self, duration: float) -> Counter[str]:
+        """Blocks sampling for `duration` seconds, run it in a thread."""
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running.")
+
+        stacks: Counter[str] = Counter()
+        own_id = threading.get_ident()
+        try:
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != own_id:
+                        stacks[self._collapse(frame, names.get(thread_id, str(thread_id)))] += 1
+                time.sleep(self.interval)
+        finally:
+            self.lock.release()
+        return stacks
+
+    @staticmethod
+    def format(stacks: Counter[str]) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+@dataclass(slots=True, eq=False)
+class JobTrace:
+    name: str
+    started: float = field(default_factory=time.perf_counter)
+    spans: list[tuple[str, float]] = field(default_factory=list)  # stage, seconds
+    loop_lag: float = 0.0  # the worst seen while the job ran, seconds
+    elapsed: float | None = None
+
+    def format(self) -> str:
+        stages = ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.spans)
+        return (
+            f"{self.name} took {(self.elapsed or 0) * 1000:.0f}ms ({stages or "no stages"}), "
+            f"loop lag up to {self.loop_lag * 1000:.0f}ms"
+        )
+
+
+def record(stage: str, seconds: float) -> None:
+    """Adds a stage timing to the job traced in this context, if any."""
+    if (trace := _current_trace.get()) is not None:
+        trace.spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Times the block as a stage of the job traced in this context, does nothing if none is."""
+    if _current_trace.get() is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+class Tracer:
+    """Captures per job stage timings and the event loop lag while enabled, logging jobs slower than `threshold`.
+
+    Traces follow the job through the context, so tasks started by it, like concurrent downloads, add to its trace.
+    """
+
+    def __init__(self, *, lag_interval: float = 0.1, history: int = 20):
+        self.lag_interval = lag_interval
+        self.threshold = 5.0  # seconds
+        self.enabled = False
+        self.loop_lag = 0.0  # the latest measured, seconds
+        self.wake_at: float | None = None  # when the monitor is due to wake up
+        self.active: set[JobTrace] = set()
+        self.slow_jobs: deque[JobTrace] = deque(maxlen=history)
+        self.monitor: asyncio.Task | None = None
+
+    def start(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.enabled = True
+        if self.monitor is None:
+            self.monitor = asyncio.create_task(self._monitor_loop_lag())
+
+    def stop(self) -> None:
+        self.enabled = False
+        self.loop_lag = 0.0
+        if self.monitor is not None:
+            self.monitor.cancel()
+            self.monitor = None
+            self.wake_at = None
+
+    async def _monitor_loop_lag(self) -> None:
+        while True:
+            self.wake_at = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            # the sleep overshoots by as long as callbacks kept the loop busy
+            self.loop_lag = self._overdue()
+            for trace in self.active:
+                trace.loop_lag = max(trace.loop_lag, self.loop_lag)
+
+    def _overdue(self) -> float:
+        return max(time.perf_counter() - self.wake_at, 0.0) if self.wake_at is not None else 0.0
+
+    @contextmanager
+    def job(self, name: str) -> Iterator[JobTrace | None]:
+        if not self.enabled:
+            yield None
+            return
+
+        trace = JobTrace(name)
+        self.active.add(trace)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            self.active.discard(trace)
+            # a job blocking the loop until it ends is gone before the monitor wakes up to see it
+            trace.loop_lag = max(trace.loop_lag, self._overdue())
+            trace.elapsed = time.perf_counter() - trace.started
+            if trace.elapsed >= self.threshold:
+                self.slow_jobs.append(trace)
+                logger.warning(f"Slow job: {trace.format()}")
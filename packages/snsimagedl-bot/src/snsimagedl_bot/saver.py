@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from pathlib import Path
+from typing import ClassVar, Collection
+
+from snsimagedl_bot.config import AppConfig
+from snsimagedl_bot.formatter import FilePathFormatter, FilePathContext
+from snsimagedl_bot.profiling import span, record
+from snsimagedl_lib import QueryResult, DownloadResult, MediaDownloader, Validators, DuplicateIndex, ImageHash, \
+    StorageBackend, Recompressor, Catalog, PreparedTags
+from snsimagedl_lib.exceptions import NotModified
+
+__all__ = (
+    "MediaSaver",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MediaSaver:
+    FLUSH_CHECK_INTERVAL: ClassVar[float] = 5.0  # seconds between checks for a storage flush due by time
+
+    def __init__(self, config: AppConfig, downloader: MediaDownloader):
+        self.config = config
+        self.downloader = downloader
+        self.path_formatter = FilePathFormatter()
+        self.storage: StorageBackend = config.storage.instance
+        self.duplicates: DuplicateIndex | None = config.deduplication.instance if config.deduplication else None
+        self.recompressor: Recompressor | None = config.recompression.instance if config.recompression else None
+        self.catalog: Catalog | None = config.catalog.instance if config.catalog else None
+        self.tagging_pool: ProcessPoolExecutor | None = None  # started on the first file, if tagging is configured
+        self.flush_task: asyncio.Task | None = None
+        self.flush_timer: asyncio.Task | None = None  # started on the first file
+
+    def get_path(self, result: QueryResult) -> Path:
+        return self.path_formatter.compile_path(
+            self.config.output_directory,
+            context=FilePathContext.from_query(result)
+        )
+
+    def get_validators(self, result: QueryResult) -> Validators:
+        """The validators of the file already saved for `result`, or empty ones to be filled by the download."""
+        return self.storage.load_validators(self.get_path(result).as_posix()) or Validators()
+
+    def is_archived(self, result: QueryResult) -> bool:
+        return self.storage.exists(self.get_path(result).as_posix())
+
+    def _catalog(self, path: Path, result: QueryResult) -> None:
+        if self.catalog is not None:
+            self.catalog.add(path.as_posix(), result.metadata, FilePathContext.from_query(result).extractor)
+
+    def _remove(self, path: Path) -> None:
+        self.storage.delete(path.as_posix())
+        self.duplicates.remove(path)
+        if self.catalog is not None:
+            self.catalog.remove(path.as_posix())
+
+    def _resolve_duplicate(self, path: Path, image: ImageHash, result: QueryResult) -> Path | None:
+        """Applies the deduplication policy, returns where the image already lives if it should not be written."""
+        duplicate = self.duplicates.find(image)
+        if duplicate is None or duplicate.path == path:
+            return None
+        if not self.storage.exists(duplicate.path.as_posix()):  # deleted by hand
+            self.duplicates.remove(duplicate.path)
+            return None
+
+        logger.info(f"{path} is a duplicate of {duplicate.path} (distance {duplicate.distance}).")
+        match self.config.deduplication.policy:
+            case "skip":
+                return duplicate.path
+            case "link":
+                self.storage.link(path.as_posix(), duplicate.path.as_posix())
+                self._catalog(path, result)
+                return path
+            case "keep_highest":
+                if image.resolution <= duplicate.image.resolution:
+                    return duplicate.path
+                self._remove(duplicate.path)
+                return None
+
+    async def _tag(self, downloaded: DownloadResult, prepared: PreparedTags | None) -> DownloadResult:
+        if prepared is None:
+            prepared = PreparedTags.prepare(self.downloader.taggers, downloaded.query.metadata)
+        if self.config.tagging is None:
+            return downloaded.tag(prepared=prepared)
+
+        if self.tagging_pool is None:
+            self.tagging_pool = ProcessPoolExecutor(max_workers=self.config.tagging.max_workers)
+        loop = asyncio.get_running_loop()
+        extension = downloaded.query.metadata.file_extension
+        if downloaded.file is not None:
+            # streamed to disk, tagged in place by the worker
+            await loop.run_in_executor(self.tagging_pool, prepared.tag_file, downloaded.file, extension)
+            return downloaded
+        data = await loop.run_in_executor(self.tagging_pool, prepared.tag, downloaded.data, extension)
+        return replace(downloaded, data=data)
+
+    async def _write(self, downloaded: DownloadResult, prepared: PreparedTags | None = None) -> Path:
+        path = self.get_path(downloaded.query)
+
+        # only images are hashed, media streamed to disk are too large to be hashed in memory
+        image = None
+        if self.duplicates is not None and downloaded.file is None \
+                and self.duplicates.supports(downloaded.query.metadata.file_extension):
+            image = await self.duplicates.hash(downloaded.data)
+        if image is not None and (existing := self._resolve_duplicate(path, image, downloaded.query)) is not None:
+            return existing
+
+        if self.recompressor is not None:
+            # before tagging, so the tags written are kept
+            with span("recompress"):
+                downloaded = await self.recompressor.recompress(downloaded)
+
+        with span("tag"):
+            downloaded = await self._tag(downloaded, prepared)
+        with span("save"):
+            downloaded.store(self.storage, path.as_posix())
+
+        if image is not None:
+            self.duplicates.add(path, image)
+        self._catalog(path, downloaded.query)
+        return path
+
+    async def _flush(self) -> None:
+        try:
+            await asyncio.to_thread(self.storage.flush)  # fsyncs, off the event loop
+        except Exception:
+            logger.exception("Failed to flush the storage")
+
+    def _flush_if_due(self) -> None:
+        """Flushes the storage in a worker thread once it asks to, one flush at a time."""
+        if self.flush_timer is None:
+            self.flush_timer = asyncio.create_task(self._flush_periodically())
+        if (self.flush_task is None or self.flush_task.done()) and self.storage.flush_due():
+            self.flush_task = asyncio.create_task(self._flush())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.FLUSH_CHECK_INTERVAL)
+            self._flush_if_due()
+
+    async def save(self, result: QueryResult) -> Path:
+        try:
+            with span("download"):
+                downloaded = await result.download(self.get_validators(result))
+            try:
+                path = await self._write(downloaded)
+            finally:
+                downloaded.release()
+            self._flush_if_due()
+            return path
+        except NotModified:
+            return self.get_path(result)
+
+    async def save_all(self, results: Collection[QueryResult]) -> list[Path]:
+        # tag payloads are built once per post, pages are written as they arrive rather than after the slowest one
+        prepared = {id(result): tags for result, tags in zip(results, self.downloader.prepare_tags(results))}
+        written = {}
+        started = time.perf_counter()
+        async for downloaded in self.downloader.download_all(results, self.get_validators):
+            record("download", time.perf_counter() - started)  # downloads run concurrently, timed from the start
+            try:
+                written[id(downloaded.query)] = await self._write(downloaded, prepared[id(downloaded.query)])
+            finally:
+                downloaded.release()
+        self._flush_if_due()
+        return [written.get(id(result)) or self.get_path(result) for result in results]
+
+    def close(self) -> None:
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+        self.storage.close()  # flushes what is left, after a flush still running
+        if self.duplicates is not None:
+            self.duplicates.close()
+        if self.recompressor is not None:
+            self.recompressor.close()
+        if self.catalog is not None:
+            self.catalog.close()
+        if self.tagging_pool is not None:
+            self.tagging_pool.shutdown(wait=False, cancel_futures=True)
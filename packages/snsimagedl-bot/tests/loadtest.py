@@ -0,0 +1,572 @@
+"""Drives the `Downloader` cog with synthetic Discord messages against local stub sites,
+reporting end-to-end latency, in-flight handlers, memory and event loop lag.
+
+    uv run python packages/snsimagedl-bot/tests/loadtest.py --rate 50 --duration 30
+    uv run python packages/snsimagedl-bot/tests/loadtest.py --mode save_from --messages 2000
+    uv run python packages/snsimagedl-bot/tests/loadtest.py --mode catch_up --messages 500 --rate 20 --duration 5
+    uv run python packages/snsimagedl-bot/tests/loadtest.py --sites pixiv dcinside --urls-per-message 3
+    uv run python packages/snsimagedl-bot/tests/loadtest.py --config config.json --latency 0.2 --error-rate 0.05
+
+Messages are sent open loop, on a fixed schedule regardless of how far behind the bot is, and latency is measured
+from the scheduled time, so a slow handler shows up as latency instead of silently lowering the rate.
+`catch_up` fills the channel history while the bot is "offline", then catches up on it with live messages arriving
+at the same time, and checks that the checkpoint ends on the newest message.
+`--config` loads the pipeline stages (taggers, storage, deduplication, ...) from a real config, the extractors,
+output directory and watch channels are always replaced with the stubbed ones.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from typing import ClassVar, Collection, override
+
+import aiohttp
+import msgspec
+from aiohttp import web
+from PIL import Image
+from yarl import URL
+
+from snsimagedl_bot.commands import Downloader
+from snsimagedl_bot.config import AppConfig, set_global_session
+from snsimagedl_bot.profiling import Tracer
+from snsimagedl_bot.saver import MediaSaver
+from snsimagedl_dcinside import DcinsideExtractor
+from snsimagedl_dcinside.parser import PostParser
+from snsimagedl_pixiv import PixivExtractor
+from snsimagedl_twitter import TwitterExtractor
+
+PACKAGES = Path(__file__).parents[2]
+TWITTER_FIXTURES = PACKAGES / "snsimagedl-twitter" / "tests"
+PIXIV_FIXTURES = PACKAGES / "snsimagedl-pixiv" / "tests" / "illust"
+DCINSIDE_FIXTURES = PACKAGES / "snsimagedl-dcinside" / "tests"
+SITES = ("twitter", "pixiv", "dcinside")
+CHANNEL_ID = 1
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss() -> int:
+    """Current resident memory in bytes, the peak where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024  # bytes on macOS, KiB elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class StubSites:
+    """Serves the syndication API, pixiv app API and gallery page fixtures and synthetic images,
+    with injected latency and errors.
+
+    The stubbed gallery is a minor one, so mobile links to it miss the major board first like they would on DCInside.
+    """
+
+    # image hosts of the gallery pages, pointed at the stub
+    DCINSIDE_IMAGE_PATTERN: ClassVar[re.Pattern] = re.compile(r"https://[a-z0-9]+\.dcinside\.co(?:m|\.kr)/")
+    DCINSIDE_MISSING: ClassVar[str] = "<html><head><title>디시인사이드</title></head><body></body></html>"
+
+    def __init__(
+            self,
+            *,
+            latency: float = 0.05,
+            jitter: float = 0.5,
+            error_rate: float = 0.0,
+            tombstone_rate: float = 0.0,
+            media_size: int = 512
+    ):
+        self.latency = latency
+        self.jitter = jitter  # fraction of `latency` added or removed at random
+        self.error_rate = error_rate
+        self.tombstone_rate = tombstone_rate
+        self.jpeg, self.png = self._make_images(media_size)
+
+        self.tweets: list[str] = []
+        self.tombstones: list[str] = []
+        for fixture in sorted(TWITTER_FIXTURES.glob("*.json")):
+            text = fixture.read_text(encoding="utf-8")
+            (self.tombstones if '"TweetTombstone"' in text else self.tweets).append(text)
+
+        # the illust id of each fixture, replaced with the requested one
+        self.illusts: list[tuple[str, str]] = []
+        for fixture in sorted(PIXIV_FIXTURES.glob("*.json")):
+            text = fixture.read_text(encoding="utf-8")
+            self.illusts.append((str(json.loads(text)["illust"]["id"]), text))
+
+        # attachments are served as JPEGs, named so they are tagged as one
+        self.posts = [
+            re.sub(r'(f_no=\d+">[^<]*?)\.\w+</a>', r"\1.jpg</a>", fixture.read_text(encoding="utf-8"))
+            for fixture in sorted(DCINSIDE_FIXTURES.glob("*.html"))
+        ]
+
+        self.requests = 0
+        self.runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    @staticmethod
+    def _make_images(size: int) -> tuple[bytes, bytes]:
+        image = Image.effect_noise((size, size), 64).convert("RGB")
+        jpeg, png = io.BytesIO(), io.BytesIO()
+        image.save(jpeg, "JPEG", quality=90)
+        image.save(png, "PNG")
+        return jpeg.getvalue(), png.getvalue()
+
+    async def _delay(self) -> None:
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter))))
+
+    async def tweet_result(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if random.random() < self.error_rate:
+            return web.Response(status=500)
+
+        tweet_id = request.query["id"]
+        if self.tombstones and random.random() < self.tombstone_rate:
+            return web.Response(text=self.tombstones[0], content_type="application/json")
+
+        text = self.tweets[int(tweet_id) % len(self.tweets)]
+        # a unique file per tweet, served by this stub
+        text = text.replace("https://pbs.twimg.com/media/", f"{self.base_url}/media/{tweet_id}_")
+        return web.Response(text=text, content_type="application/json")
+
+    async def illust_detail(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if random.random() < self.error_rate:
+            return web.Response(status=500)
+
+        illust_id = request.query["illust_id"]
+        fixture_id, text = self.illusts[int(illust_id) % len(self.illusts)]
+        text = text.replace(fixture_id, illust_id).replace("https://i.pximg.net/", f"{self.base_url}/media/")
+        return web.Response(text=text, content_type="application/json")
+
+    async def gallery_post(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if random.random() < self.error_rate:
+            return web.Response(status=500)
+
+        if request.path != "/mgallery/board/view/":
+            return web.Response(text=self.DCINSIDE_MISSING, content_type="text/html")
+        page = self.posts[int(request.query["no"]) % len(self.posts)]
+        page = self.DCINSIDE_IMAGE_PATTERN.sub(f"{self.base_url}/media/", page)
+        return web.Response(text=page, content_type="text/html")
+
+    async def media_file(self, request: web.Request) -> web.Response:
+        await self._delay()
+        if random.random() < self.error_rate:
+            return web.Response(status=500)
+        if request.match_info["name"].endswith(".png"):
+            return web.Response(body=self.png, content_type="image/png")
+        return web.Response(body=self.jpeg, content_type="image/jpeg")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/tweet-result", self.tweet_result)
+        app.router.add_get("/pixiv/v1/illust/detail", self.illust_detail)
+        for board in ("/board/view/", "/mgallery/board/view/", "/mini/board/view/"):
+            app.router.add_get(board, self.gallery_post)
+        app.router.add_get("/media/{name:.+}", self.media_file)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]  # noqa
+        self.base_url = f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+class StubPixivExtractor(PixivExtractor):
+    """`PixivExtractor` reading the app API from the stub, without logging in to pixiv."""
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str):
+        # the pixivpy client authenticates on creation, only its `hosts` is read outside of `_request`
+        self.loop = asyncio.get_running_loop()
+        self.decoder = self.DECODER
+        self.list_decoder = self.LIST_DECODER
+        self.ugoira_format = "webp"
+        self.process_pool = None
+        self.session = SimpleNamespace(hosts=f"{base_url}/pixiv")
+        self.image_session = aiohttp.ClientSession(headers=self.IMAGE_HEADERS)
+        self.api_session = session
+
+    @override
+    async def _request[T](self, url: str, params: dict[str, str] | None, decoder: msgspec.json.Decoder[T]) -> T | None:
+        async with self.api_session.get(url, params=params) as res:
+            res.raise_for_status()
+            return decoder.decode(await res.read())
+
+
+class StubDcinsideExtractor(DcinsideExtractor):
+    """`DcinsideExtractor` reading the gallery pages from the stub."""
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str):
+        super().__init__(session)
+        self.base_url = URL(base_url)
+
+    @override
+    async def _fetch(self, url: URL) -> PostParser:
+        return await super()._fetch(self.base_url.with_path(url.path).with_query(url.query))
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return self.id
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, content: str, channel: FakeChannel, author: FakeUser):
+        self.id = message_id
+        self.content = content
+        self.channel = channel
+        self.author = author
+        self.jump_url = f"https://discord.com/channels/0/{channel.id}/{message_id}"
+        self.reactions: list[str] = []
+
+    async def add_reaction(self, emoji: str) -> None:
+        self.reactions.append(emoji)
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.messages: list[FakeMessage] = []  # oldest first
+
+    @property
+    def last_message_id(self) -> int | None:
+        return self.messages[-1].id if self.messages else None
+
+    async def history(self, *, limit: int | None = 100, before=None, after=None, oldest_first: bool | None = None, **_):
+        """Messages strictly between `before` and `after` (anything with an `id`), like discord.
+
+        Newest first unless `after` is given, `limit` counts from `after` when it is, else from `before`.
+        """
+        if oldest_first is None:
+            oldest_first = after is not None
+
+        messages = [
+            message for message in self.messages
+            if (before is None or message.id < before.id) and (after is None or message.id > after.id)
+        ]
+        if after is None:
+            messages.reverse()
+        if limit is not None:
+            messages = messages[:limit]
+        if oldest_first == (after is None):
+            messages.reverse()
+
+        for message in messages:
+            await asyncio.sleep(0)
+            yield message
+
+
+class FakeContext:
+    def __init__(self, channel: FakeChannel):
+        self.channel = channel
+        self.replies = 0
+        self.invoked_subcommand = None
+
+    async def reply(self, content: str | None = None, **_) -> None:
+        self.replies += 1
+
+
+class FakeBot:
+    """The attributes of `SnsImageDlBot` the cog reads, without a gateway connection."""
+
+    def __init__(self, config: AppConfig, channel: FakeChannel):
+        self.user = FakeUser(0)
+        self.config = config
+        self.downloader = config.create_downloader()
+        self.saver = MediaSaver(config, self.downloader)
+        self.tracer = Tracer()
+        self.channels = {channel.id: channel}
+
+    def get_channel(self, channel_id: int) -> FakeChannel | None:
+        return self.channels.get(channel_id)
+
+
+class LoadTest:
+    def __init__(
+            self,
+            cog: Downloader,
+            sites: StubSites,
+            channel: FakeChannel,
+            *,
+            site_names: Collection[str] = SITES,
+            urls_per_message: int = 1,
+            sample_interval: float = 0.1
+    ):
+        self.cog = cog
+        self.sites = sites
+        self.channel = channel
+        self.site_names = list(site_names)
+        self.urls_per_message = urls_per_message
+        self.sample_interval = sample_interval
+        self.author = FakeUser(42)
+
+        self.next_id = 1_000_000_000_000_000_000
+        self.latencies: list[float] = []
+        self.errors: dict[str, int] = {}
+        self.in_flight = 0
+        self.loop_lag: list[float] = []
+        self.in_flight_samples: list[int] = []
+        self.rss_samples: list[int] = []
+
+    def make_url(self, post_id: int) -> str:
+        match self.site_names[post_id % len(self.site_names)]:
+            case "pixiv":
+                return f"https://www.pixiv.net/artworks/{post_id}"
+            case "dcinside" if post_id % 2:
+                return f"https://m.dcinside.com/board/stub/{post_id}"
+            case "dcinside":
+                return f"https://gall.dcinside.com/mgallery/board/view/?id=stub&no={post_id}"
+            case _:
+                return f"https://x.com/user/status/{post_id}"
+
+    def make_message(self) -> FakeMessage:
+        urls = []
+        for _ in range(self.urls_per_message):
+            self.next_id += 1
+            urls.append(self.make_url(self.next_id))
+        message = FakeMessage(self.next_id, "look " + " ".join(urls), self.channel, self.author)
+        self.channel.messages.append(message)
+        return message
+
+    async def _monitor(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.sample_interval)
+            self.loop_lag.append(max(0.0, loop.time() - start - self.sample_interval))
+            self.in_flight_samples.append(self.in_flight)
+            self.rss_samples.append(rss())
+
+    async def _timed(self, coro, scheduled: float) -> None:
+        self.in_flight += 1
+        try:
+            await coro
+        except Exception as e:
+            name = type(e).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+        finally:
+            self.in_flight -= 1
+            self.latencies.append(asyncio.get_running_loop().time() - scheduled)
+
+    async def firehose(self, mode: str, rate: float, duration: float) -> float:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = []
+        for i in range(int(rate * duration)):
+            scheduled = start + i / rate
+            await asyncio.sleep(max(0.0, scheduled - loop.time()))
+
+            message = self.make_message()
+            if mode == "autosave":
+                coro = self.cog.autosave(message)
+            else:
+                url = message.content.split()[1]
+                coro = Downloader.save_url.callback(self.cog, FakeContext(self.channel), url)
+            # discord dispatches every event in its own task
+            tasks.append(asyncio.create_task(self._timed(coro, scheduled)))
+
+        await asyncio.gather(*tasks)
+        return loop.time() - start
+
+    async def backfill(self, messages: int) -> float:
+        for _ in range(messages):
+            self.make_message()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        ctx = FakeContext(self.channel)
+        await self._timed(
+            Downloader.save_from.callback(self.cog, ctx, self.channel, None, None),
+            start
+        )
+        return loop.time() - start
+
+    async def catch_up(self, messages: int, rate: float, duration: float) -> float:
+        for _ in range(messages):
+            self.make_message()
+        # the bot last saw the first message, the rest were sent while it was offline
+        self.cog.checkpoints.advance(self.channel.id, self.channel.messages[0].id)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        catching_up = asyncio.create_task(self._timed(self.cog.catch_up(), start))
+        await self.firehose("autosave", rate, duration)  # live messages arrive during the catch up
+        await catching_up
+
+        if self.cog.checkpoints.get(self.channel.id) != self.channel.last_message_id:
+            self.errors["CheckpointBehind"] = self.errors.get("CheckpointBehind", 0) + 1
+        return loop.time() - start
+
+    async def run(self, args: argparse.Namespace) -> dict:
+        monitor = asyncio.create_task(self._monitor())
+        rss_before = rss()
+        try:
+            if args.mode == "save_from":
+                elapsed = await self.backfill(args.messages)
+                handled = sum(1 for message in self.channel.messages if message.reactions)
+            elif args.mode == "catch_up":
+                elapsed = await self.catch_up(args.messages, args.rate, args.duration)
+                handled = sum(1 for message in self.channel.messages if message.reactions)
+            else:
+                elapsed = await self.firehose(args.mode, args.rate, args.duration)
+                handled = len(self.latencies)
+        finally:
+            monitor.cancel()
+
+        return {
+            "mode": args.mode,
+            "messages": handled,
+            "elapsed": elapsed,
+            "throughput": handled / elapsed if elapsed else 0.0,
+            "requests": self.sites.requests,
+            "errors": self.errors,
+            "latency": {
+                "p50": percentile(self.latencies, 0.50),
+                "p95": percentile(self.latencies, 0.95),
+                "p99": percentile(self.latencies, 0.99),
+                "max": max(self.latencies, default=0.0),
+                "mean": statistics.fmean(self.latencies) if self.latencies else 0.0,
+            },
+            "in_flight": {
+                "mean": statistics.fmean(self.in_flight_samples) if self.in_flight_samples else 0.0,
+                "max": max(self.in_flight_samples, default=0),
+            },
+            "loop_lag": {
+                "p99": percentile(self.loop_lag, 0.99),
+                "max": max(self.loop_lag, default=0.0),
+            },
+            "rss": {
+                "before": rss_before,
+                "peak": max(self.rss_samples, default=rss_before),
+                "after": rss(),
+            },
+        }
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency"]
+    mib = 2 ** 20
+    print(
+        f"{report['mode']}: {report['messages']} messages in {report['elapsed']:.2f}s "
+        f"({report['throughput']:.1f}/s), {report['requests']} stub requests\n"
+        f"  latency   p50 {latency['p50'] * 1000:.1f}ms  p95 {latency['p95'] * 1000:.1f}ms  "
+        f"p99 {latency['p99'] * 1000:.1f}ms  max {latency['max'] * 1000:.1f}ms\n"
+        f"  in flight mean {report['in_flight']['mean']:.1f}  max {report['in_flight']['max']}\n"
+        f"  loop lag  p99 {report['loop_lag']['p99'] * 1000:.1f}ms  max {report['loop_lag']['max'] * 1000:.1f}ms\n"
+        f"  rss       before {report['rss']['before'] / mib:.1f}MiB  peak {report['rss']['peak'] / mib:.1f}MiB  "
+        f"after {report['rss']['after'] / mib:.1f}MiB\n"
+        f"  errors    {report['errors'] or 'none'}"
+    )
+
+
+def load_config(path: str | None, output: str, *, catch_up: bool = False) -> AppConfig:
+    base = json.loads(Path(path).read_bytes()) if path else {"bot": {"token": "", "command_prefix": "!"}}
+    base.update(
+        watch_channel_ids=[CHANNEL_ID],
+        output_directory=f"{output}/{{extractor}}/{{filename}}.{{ext}}",
+        extractors=[{"type": "twitter"}],  # the others log in or are hard-wired to their site, see `stub_extractors`
+    )
+    if catch_up:
+        base["catch_up"] = {**(base.get("catch_up") or {}), "path": f"{output}/checkpoints.json"}
+    base.setdefault("taggers", [])
+    return msgspec.convert(base, AppConfig)
+
+
+def stub_extractors(bot: FakeBot, session: aiohttp.ClientSession, sites: StubSites, names: Collection[str]) -> None:
+    """Points the extractors of `names` at the stub sites."""
+    extractors = []
+    for extractor in bot.downloader.extractors:
+        if isinstance(extractor, TwitterExtractor) and "twitter" in names:
+            extractor.API_URL = f"{sites.base_url}/tweet-result"
+            extractors.append(extractor)
+    if "pixiv" in names:
+        extractors.append(StubPixivExtractor(session, sites.base_url))
+    if "dcinside" in names:
+        extractors.append(StubDcinsideExtractor(session, sites.base_url))
+    bot.downloader.extractors = extractors
+
+
+async def main(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    sites = StubSites(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        tombstone_rate=args.tombstone_rate,
+        media_size=args.media_size
+    )
+    await sites.start()
+
+    with tempfile.TemporaryDirectory() as output:
+        async with aiohttp.ClientSession() as session:
+            set_global_session(session)
+
+            config = load_config(args.config, output, catch_up=args.mode == "catch_up")
+            channel = FakeChannel(CHANNEL_ID)
+            bot = FakeBot(config, channel)
+            stub_extractors(bot, session, sites, args.sites)
+
+            test = LoadTest(
+                Downloader(bot),
+                sites,
+                channel,
+                site_names=args.sites,
+                urls_per_message=args.urls_per_message
+            )
+            try:
+                report = await test.run(args)
+            finally:
+                await bot.downloader.close()
+                bot.saver.close()
+                await sites.close()
+
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mode", choices=("autosave", "save_url", "save_from", "catch_up"), default="autosave")
+    parser.add_argument("--sites", nargs="+", choices=SITES, default=list(SITES), help="sites linked, in turn")
+    parser.add_argument("--rate", type=float, default=20.0, help="messages per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of messages to send")
+    parser.add_argument("--messages", type=int, default=500, help="channel history size for save_from and catch_up")
+    parser.add_argument("--urls-per-message", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub response time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub responses that are 500s")
+    parser.add_argument("--tombstone-rate", type=float, default=0.0, help="fraction of tweets age restricted")
+    parser.add_argument("--media-size", type=int, default=512, help="synthetic image width and height")
+    parser.add_argument("--config", help="config.json to take the pipeline stages from")
+    parser.add_argument("--json", help="also write the report to this file, to compare runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
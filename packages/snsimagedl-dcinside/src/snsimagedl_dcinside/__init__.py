@@ -0,0 +1 @@
+from .extractor import *
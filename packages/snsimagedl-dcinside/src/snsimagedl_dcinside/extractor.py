@@ -1,23 +1,177 @@
+import asyncio
+import codecs
+import logging
 import re
-from typing import override, Collection, ClassVar
+from contextlib import asynccontextmanager, AbstractAsyncContextManager
+from datetime import datetime, timezone, timedelta
+from pathlib import PurePath
+from typing import override, Collection, ClassVar, AsyncIterator
 
 import aiohttp
+from yarl import URL
 
-from snsimagedl_lib import Extractor, Metadata
+from snsimagedl_lib import Extractor, Metadata, ArtistMetadata, Validators, MediaStream
+from snsimagedl_lib.exceptions import UnsupportedLink, MediaDeleted, NotModified
+from snsimagedl_dcinside.parser import PostParser
+
+__all__ = (
+    "DcinsideExtractor",
+)
+
+logger = logging.getLogger(__name__)
+
+KST = timezone(timedelta(hours=9))
 
 
 class DcinsideExtractor(Extractor):
     URL_PATTERN: ClassVar[re.Pattern] = re.compile(
-        r"https://(?:gall|m).dcinside.com/[a-zA-Z/]*(?:\?id=|(?:board|m)/)(\w+)(?:&no=|/)(\d+)"
+        r"https://(?:gall|m).dcinside.com/[a-zA-Z/]*(?:\?id=|(?:board|mini|m)/)(\w+)(?:&no=|/)(\d+)"
     )
 
-    def __init__(self, session: aiohttp.ClientSession):
+    # the image hosts refuse requests not coming from the gallery
+    HEADERS: ClassVar[dict[str, str]] = {
+        "Referer": "https://gall.dcinside.com/",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/131.0.0.0 Safari/537.36"
+    }
+    CHUNK_SIZE: ClassVar[int] = 16 * 1024
+    # desktop boards of the gallery types, the mobile site links major and minor galleries the same way
+    BOARDS: ClassVar[tuple[str, ...]] = ("board/view/", "mgallery/board/view/")
+    MINI_BOARD: ClassVar[str] = "mini/board/view/"
+
+    def __init__(self, session: aiohttp.ClientSession, *, max_connections: int = 8):
         self.session = session
+        self.download_limit = asyncio.Semaphore(max_connections)
+        # gallery id -> board the posts were found on
+        self.boards: dict[str, str] = {}
+
+    def _get_post_id(self, url: str) -> tuple[str, str]:
+        """Extracts the gallery id and the post number from the url.
+
+        https://gall.dcinside.com/board/view/?id=<gallery id>&no=<post no>  ->  <gallery id>, <post no>
+        https://m.dcinside.com/board/<gallery id>/<post no>  ->  <gallery id>, <post no>
+        https://m.dcinside.com/mini/<gallery id>/<post no>  ->  <gallery id>, <post no>
+        """
+        res = self.URL_PATTERN.search(url)
+        if not res:
+            raise UnsupportedLink(f"{url} is not a dcinside link.")
+        return res[1], res[2]
+
+    def _get_page_urls(self, url: str, gallery_id: str, post_no: str) -> list[URL]:
+        """Returns the desktop pages the post may be on, in the order they should be tried."""
+        page = URL(url)
+        # the mobile site has a different layout, always parse the desktop one
+        if page.host == "gall.dcinside.com":
+            return [page]
+
+        if page.path.startswith("/mini/"):
+            boards = [self.MINI_BOARD]
+        elif gallery_id in self.boards:
+            boards = [self.boards[gallery_id]]
+        else:
+            boards = list(self.BOARDS)
+        return [URL(f"https://gall.dcinside.com/{board}").with_query(id=gallery_id, no=post_no)
+                for board in boards]
+
+    async def _find(self, query: str, gallery_id: str, post_no: str) -> PostParser:
+        urls = self._get_page_urls(query, gallery_id, post_no)
+        for url in urls:
+            try:
+                post = await self._fetch(url)
+            except MediaDeleted:
+                if url is urls[-1]:
+                    raise
+                continue
+            if post.title is not None:
+                if len(urls) > 1:
+                    self.boards[gallery_id] = url.path.removeprefix("/")
+                return post
+            logger.debug(f"{url} is not the post, trying the next gallery type")
+
+        logger.error(f"Failed to find the post in {query}")
+        raise Exception(f"Failed to parse {query}")
+
+    async def _fetch(self, url: URL) -> PostParser:
+        parser = PostParser()
+
+        async with self.session.get(url, headers=self.HEADERS) as res:
+            if res.status == 404:
+                raise MediaDeleted
+            res.raise_for_status()
+
+            decoder = codecs.getincrementaldecoder(res.charset or "utf-8")(errors="replace")
+            async for chunk in res.content.iter_chunked(self.CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+                if parser.done:
+                    break  # skip downloading the comments and the rest of the page
+            else:
+                parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        return parser
+
+    @staticmethod
+    def _get_artist(post: PostParser) -> ArtistMetadata:
+        if post.uid:
+            return ArtistMetadata(
+                handle=post.uid,
+                display_name=post.nickname,
+                webpage_url=f"https://gallog.dcinside.com/{post.uid}"
+            )
+        # anonymous posters are only identified by the start of their ip
+        return ArtistMetadata(
+            handle=f"{post.nickname}({post.ip})" if post.ip else post.nickname,
+            display_name=post.nickname,
+            webpage_url=""
+        )
 
     @override
     async def query(self, query: str) -> Collection[Metadata] | None:
-        ...
+        gallery_id, post_no = self._get_post_id(query)
+
+        post = await self._find(query, gallery_id, post_no)
+        # attachments are the original uploads, inline images are only used when there are none
+        sources = post.attachments or [(url, "") for url in post.images]
+
+        created_at = datetime.strptime(post.date, "%Y-%m-%d %H:%M:%S").replace(tzinfo=KST) if post.date else None
+        artist = self._get_artist(post)
+
+        results = []
+        for index, (source_url, name) in enumerate(sources):
+            results.append(Metadata(
+                filename=f"{gallery_id}_{post_no}_{index}{PurePath(name).suffix.lower() or ".jpg"}",
+                source_url=source_url,
+                webpage_url=query,
+                title=post.title,
+                description=post.description,
+                created_at=created_at,
+                artist=artist,
+                keywords=[gallery_id]
+            ))
+        return results
+
+    @asynccontextmanager
+    async def _open(self, url: str, validators: Validators | None) -> AsyncIterator[aiohttp.ClientResponse]:
+        headers = self.HEADERS | validators.to_headers() if validators else self.HEADERS
+
+        async with self.download_limit:
+            async with self.session.get(url, headers=headers) as res:
+                if res.status == 304:
+                    raise NotModified
+                res.raise_for_status()
+                if validators is not None:
+                    validators.update(res.headers)
+                yield res
+
+    @override
+    async def download(self, media: Metadata, validators: Validators | None = None) -> bytes:
+        async with self._open(media.source_url, validators) as res:
+            return await res.content.read()
+
+    @asynccontextmanager
+    async def _stream(self, url: str, validators: Validators | None) -> AsyncIterator[MediaStream]:
+        async with self._open(url, validators) as res:
+            yield MediaStream(res.content_length, res.content.iter_any())
 
     @override
-    async def download(self, media: Metadata) -> bytes:
-        ...
\ No newline at end of file
+    def stream(self, media: Metadata, validators: Validators | None = None) -> AbstractAsyncContextManager[MediaStream]:
+        return self._stream(media.source_url, validators)
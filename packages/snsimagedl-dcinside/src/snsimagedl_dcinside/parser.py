@@ -0,0 +1,125 @@
+from html.parser import HTMLParser
+from typing import override
+
+__all__ = (
+    "Attachment",
+    "PostParser",
+)
+
+type Attrs = list[tuple[str, str | None]]
+type Attachment = tuple[str, str]  # url, file name
+
+
+def _has_class(attrs: Attrs, name: str) -> bool:
+    for key, value in attrs:
+        if key == "class" and value is not None and name in value.split():
+            return True
+    return False
+
+
+def _get_attr(attrs: Attrs, name: str) -> str | None:
+    for key, value in attrs:
+        if key == name:
+            return value
+    return None
+
+
+class PostParser(HTMLParser):
+    """Picks the post details out of a gallery post page as it is fed, without building a DOM.
+
+    `done` is set once the attachment list, the last part of the post we care about, has been read,
+    so the caller can stop reading the rest of the page (comments, recommended posts, ...).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title: str | None = None
+        self.nickname: str | None = None
+        self.uid: str | None = None
+        self.ip: str | None = None
+        self.date: str | None = None
+        self.images: list[str] = []  # inline images in the post body
+        self.attachments: list[Attachment] = []  # original uploads
+        self.done = False
+
+        self._title: list[str] | None = None
+        self._body: list[str] = []
+        self._body_depth = 0  # nested <div>s inside the post body
+        self._in_attachments = False
+        self._attachment_url: str | None = None
+        self._attachment_name: list[str] = []
+
+    @property
+    def description(self) -> str:
+        return "\n".join(line for line in (line.strip() for line in "".join(self._body).splitlines()) if line)
+
+    @override
+    def handle_starttag(self, tag: str, attrs: Attrs) -> None:
+        if self.done:
+            return
+
+        if self._body_depth:
+            match tag:
+                case "div":
+                    self._body_depth += 1
+                case "img":
+                    src = _get_attr(attrs, "data-original") or _get_attr(attrs, "src")
+                    if src:
+                        self.images.append(src)
+                case "br" | "p":
+                    self._body.append("\n")
+            return
+
+        match tag:
+            case "span" if self.title is None and _has_class(attrs, "title_subject"):
+                self._title = []
+            case "div" if self.nickname is None and _has_class(attrs, "gall_writer"):
+                self.nickname = _get_attr(attrs, "data-nick")
+                self.uid = _get_attr(attrs, "data-uid") or None
+                self.ip = _get_attr(attrs, "data-ip") or None
+            case "span" if self.date is None and _has_class(attrs, "gall_date"):
+                self.date = _get_attr(attrs, "title")
+            case "div" if _has_class(attrs, "write_div"):
+                self._body_depth = 1
+            case "ul" if _has_class(attrs, "appending_file"):
+                self._in_attachments = True
+            case "div" if _has_class(attrs, "view_comment"):
+                self.done = True  # posts without attachments, the comments come right after the post
+            case "a" if self._in_attachments:
+                self._attachment_url = _get_attr(attrs, "href")
+                self._attachment_name = []
+
+    @override
+    def handle_endtag(self, tag: str) -> None:
+        if self.done:
+            return
+
+        if self._body_depth:
+            if tag == "div":
+                self._body_depth -= 1
+            elif tag == "p":
+                self._body.append("\n")
+            return
+
+        match tag:
+            case "span" if self._title is not None:
+                self.title = "".join(self._title).strip()
+                self._title = None
+            case "a" if self._attachment_url is not None:
+                self.attachments.append((self._attachment_url, "".join(self._attachment_name).strip()))
+                self._attachment_url = None
+            case "ul" if self._in_attachments:
+                self._in_attachments = False
+                self.done = True
+
+    @override
+    def handle_data(self, data: str) -> None:
+        if self.done:
+            return
+
+        if self._body_depth:
+            self._body.append(data)
+        elif self._title is not None:
+            self._title.append(data)
+        elif self._attachment_url is not None:
+            self._attachment_name.append(data)
@@ -0,0 +1,55 @@
+"""Runs the streaming post parser over the saved DCInside pages and times it.
+
+    uv run python packages/snsimagedl-dcinside/tests/bench_parse.py
+"""
+import codecs
+import timeit
+from pathlib import Path
+
+from snsimagedl_dcinside.extractor import DcinsideExtractor
+from snsimagedl_dcinside.parser import PostParser
+
+FIXTURES = sorted(Path(__file__).parent.glob("*.html"))
+NUMBER = 2_000
+
+
+def parse(data: bytes, chunk_size: int) -> tuple[PostParser, int]:
+    """Feeds the page like `DcinsideExtractor._fetch` does, returns the parser and the bytes it read."""
+    parser = PostParser()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    read = 0
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            break
+    else:
+        parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    return parser, read
+
+
+def main() -> None:
+    cases = {
+        "whole page": lambda data: parse(data, len(data)),
+        "extractor chunks": lambda data: parse(data, DcinsideExtractor.CHUNK_SIZE),
+        "1 KiB chunks": lambda data: parse(data, 1024),
+    }
+
+    for fixture in FIXTURES:
+        data = fixture.read_bytes()
+        post, read = parse(data, 1024)
+        assert post.title is not None, f"failed to parse {fixture.name}"
+
+        print(f"{fixture.name} ({len(data)} bytes, done={post.done} after {read} bytes)")
+        print(f"    title={post.title!r} nickname={post.nickname!r} uid={post.uid!r} ip={post.ip!r} date={post.date!r}")
+        print(f"    images={post.images}")
+        print(f"    attachments={post.attachments}")
+        for name, case in cases.items():
+            seconds = min(timeit.repeat(lambda: case(data), number=NUMBER, repeat=5))
+            print(f"    {name:<28} {seconds / NUMBER * 1e6:8.2f} us")
+
+
+if __name__ == '__main__':
+    main()
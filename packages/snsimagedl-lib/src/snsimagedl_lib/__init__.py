@@ -1,11 +1,21 @@
+from .validators import *
 from .extractor import *
 from .metadata import *
 from .tagger import *
+from .mp4 import *
+from .cache import *
+from .storage import *
+from .archive import *
+from .catalog import *
+from .dedup import *
+from .budget import *
 from .downloader import *
+from .recompress import *
 
 
 DEFAULT_TAGGERS: list[type[FileTagger]] = [
     ExifTagger,
     XmpTagger,
-    JpegCommentTagger
+    JpegCommentTagger,
+    Mp4Tagger
 ]
\ No newline at end of file
@@ -0,0 +1,456 @@
+import argparse
+import itertools
+import os
+import shutil
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, ClassVar, Iterator, override
+
+from snsimagedl_lib.storage import StorageBackend
+from snsimagedl_lib.validators import Validators
+
+__all__ = (
+    "ArchiveStorage",
+)
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+END_OF_ARCHIVE = b"\0" * (BLOCK_SIZE * 2)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(slots=True, frozen=True)
+class _Pending:
+    key: str
+    data: bytes
+    validators: Validators | None
+    size: int
+    file: Path | None = None  # a file moved into the staging directory, streamed into the shard instead of `data`
+
+    def read(self) -> bytes:
+        return self.file.read_bytes() if self.file is not None else self.data
+
+    def discard(self) -> None:
+        if self.file is not None:
+            self.file.unlink(missing_ok=True)
+
+
+def _padding(size: int) -> bytes:
+    return b"\0" * (-size % BLOCK_SIZE)
+
+
+def _copy(source: BinaryIO, destination: BinaryIO, size: int) -> int:
+    """Copies `size` bytes a chunk at a time, returns their CRC-32."""
+    crc32 = 0
+    remaining = size
+    while remaining > 0:
+        chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise ValueError(f"{source.name} is shorter than the {size} bytes it was staged with")
+        destination.write(chunk)
+        crc32 = zlib.crc32(chunk, crc32)
+        remaining -= len(chunk)
+    return crc32
+
+
+class ArchiveStorage(StorageBackend):
+    """Appends media into size capped tar shards, instead of one file each.
+
+    `index.sqlite3` maps every key to its shard and data offset, so reads seek straight to it.
+    Writes are buffered and appended in batches, with the index committed after the data, so a crash mid-batch
+    only loses the unfinished batch, whose bytes are overwritten by the next one. A batch is due once it holds
+    `batch_size` items or `batch_bytes`, or its oldest item waited `flush_interval` seconds, and `flush` can run in
+    a worker thread while the storage is used, buffered items staying readable until indexed.
+    Files given to `write_file` are moved into a staging directory of this instance and streamed into the shard,
+    never read whole. A `staging-*` directory left by a crash holds only unindexed files and can be deleted.
+    `link` to a buffered item is queued and indexed by the flush writing the item, rather than flushing right away,
+    and like a hard link keeps the data if the item is replaced or deleted before then.
+    Shards are plain tar files, readable with `tar` even without the index.
+    """
+
+    INDEX_NAME: ClassVar[str] = "index.sqlite3"
+
+    def __init__(
+            self,
+            directory: str | Path,
+            *,
+            shard_size: int = 1024 * 1024 * 1024,
+            batch_size: int = 64,
+            batch_bytes: int = 64 * 1024 * 1024,
+            flush_interval: float = 30.0
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+
+        self.staging: Path | None = None  # created on the first `write_file`
+        self.pending: dict[str, _Pending] = {}
+        self.links: dict[str, _Pending] = {}  # keys linked to a buffered item, indexed once it is written
+        self.orphans: list[_Pending] = []  # replaced or deleted items still linked to, written only for the links
+        self.pending_bytes = 0  # held in memory, staged files are not counted
+        self.staged_ids = itertools.count()
+        self.oldest_pending: float | None = None  # monotonic time the oldest buffered item was written at
+        self.pending_lock = threading.Lock()  # held only to change `pending`, never across I/O
+        self.flush_lock = threading.Lock()
+
+        self.db = sqlite3.connect(self.directory / self.INDEX_NAME, isolation_level=None)
+        # batches are committed from another connection, readers do not wait on it
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            "    id INTEGER PRIMARY KEY,"
+            "    end_offset INTEGER NOT NULL"  # where the next member goes, the end of archive marker is after it
+            ");"
+            "CREATE TABLE IF NOT EXISTS items ("
+            "    key TEXT PRIMARY KEY,"
+            "    shard INTEGER NOT NULL,"
+            "    offset INTEGER NOT NULL,"  # of the data, past the tar header
+            "    size INTEGER NOT NULL,"
+            "    crc32 INTEGER NOT NULL,"
+            "    etag TEXT,"
+            "    last_modified TEXT"
+            ");"
+        )
+
+    def shard_path(self, shard: int) -> Path:
+        return self.directory / f"{shard:05}.tar"
+
+    def _locate(self, key: str) -> tuple[int, int, int, int] | None:
+        return self.db.execute("SELECT shard, offset, size, crc32 FROM items WHERE key = ?", (key,)).fetchone()
+
+    def _read_at(self, shard: int, offset: int, size: int) -> bytes:
+        with self.shard_path(shard).open("rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def _buffered(self, key: str) -> _Pending | None:
+        return self.pending.get(key) or self.links.get(key)
+
+    @override
+    def exists(self, key: str) -> bool:
+        return key in self.pending or key in self.links or self._locate(key) is not None
+
+    @override
+    def read(self, key: str) -> bytes:
+        if (item := self._buffered(key)) is not None:  # may be indexed by a flush at any point
+            try:
+                return item.read()
+            except FileNotFoundError:  # staged file indexed and removed meanwhile
+                pass
+
+        location = self._locate(key)
+        if location is None:
+            raise FileNotFoundError(key)
+        shard, offset, size, _ = location
+        return self._read_at(shard, offset, size)
+
+    @override
+    def size(self, key: str) -> int:
+        if (item := self._buffered(key)) is not None:
+            return item.size
+
+        location = self._locate(key)
+        if location is None:
+            raise FileNotFoundError(key)
+        return location[2]
+
+    def _pop_pending(self, key: str) -> bool:
+        """Drops what is buffered for `key`, returns whether there was anything. Called with `pending_lock` held."""
+        link = self.links.pop(key, None)
+        previous = self.pending.pop(key, None)
+        if previous is None:
+            return link is not None
+
+        if any(item is previous for item in self.links.values()):
+            self.orphans.append(previous)  # still counted in `pending_bytes` until written
+        else:
+            self.pending_bytes -= len(previous.data)
+            previous.discard()
+        return True
+
+    def _add_pending(self, item: _Pending) -> None:
+        with self.pending_lock:
+            self._pop_pending(item.key)
+            self.pending[item.key] = item
+            self.pending_bytes += len(item.data)
+            if self.oldest_pending is None:
+                self.oldest_pending = time.monotonic()
+
+    @override
+    def write(self, key: str, data: bytes, validators: Validators | None = None) -> None:
+        self._add_pending(_Pending(key, data, validators, len(data)))
+
+    @override
+    def write_file(self, key: str, path: Path, validators: Validators | None = None) -> None:
+        if self.staging is None:
+            self.staging = Path(tempfile.mkdtemp(prefix="staging-", dir=self.directory))
+        staged = self.staging / f"{next(self.staged_ids)}{path.suffix}"
+        shutil.move(path, staged)  # a rename, unless the temporary directory is on another file system
+        self._add_pending(_Pending(key, b"", validators, staged.stat().st_size, staged))
+
+    @override
+    def link(self, key: str, target: str) -> None:
+        with self.pending_lock:
+            self._pop_pending(key)
+            if (item := self._buffered(target)) is not None:
+                self.links[key] = item  # indexed by the flush writing it, never flushed here on the event loop
+                return
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO items (key, shard, offset, size, crc32, etag, last_modified) "
+            "SELECT ?, shard, offset, size, crc32, NULL, NULL FROM items WHERE key = ?",
+            (key, target)
+        )
+
+    @override
+    def delete(self, key: str) -> bool:
+        # the bytes stay in the shard, only unreferenced
+        with self.pending_lock:
+            buffered = self._pop_pending(key)
+        return self.db.execute("DELETE FROM items WHERE key = ?", (key,)).rowcount > 0 or buffered
+
+    @override
+    def load_validators(self, key: str) -> Validators | None:
+        if (item := self.pending.get(key)) is not None:
+            return item.validators
+        if key in self.links:
+            return None
+
+        row = self.db.execute("SELECT etag, last_modified, size FROM items WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None and row[1] is None:
+            return None
+        return Validators(*row)
+
+    @staticmethod
+    def _current_shard(db: sqlite3.Connection) -> tuple[int, int]:
+        row = db.execute("SELECT id, end_offset FROM shards ORDER BY id DESC LIMIT 1").fetchone()
+        return row if row is not None else (0, 0)
+
+    @override
+    def flush_due(self) -> bool:
+        if not self.pending and not self.orphans:
+            return False
+        return len(self.pending) + len(self.orphans) >= self.batch_size or self.pending_bytes >= self.batch_bytes \
+            or time.monotonic() - self.oldest_pending >= self.flush_interval
+
+    @override
+    def flush(self) -> None:
+        with self.flush_lock:
+            with self.pending_lock:
+                batch = [*self.pending.values(), *self.orphans]
+            if not batch:
+                return
+
+            # a connection of its own, as this may run in a worker thread
+            db = sqlite3.connect(self.directory / self.INDEX_NAME, isolation_level=None)
+            try:
+                written = self._flush_batch(db, batch)
+                indexed: set[tuple[str, int]] = set()
+                while True:
+                    with self.pending_lock:
+                        links = [
+                            (key, id(item)) for key, item in self.links.items()
+                            if id(item) in written and (key, id(item)) not in indexed
+                        ]
+                        if not links:
+                            # in the same hold of the lock as the last check, so no link is left behind
+                            self._remove_flushed(batch, written)
+                            break
+                    self._index_links(db, links, written)
+                    indexed.update(links)
+            finally:
+                db.close()
+
+    def _remove_flushed(self, batch: list[_Pending], written: dict[int, tuple[int, int, int, int]]) -> None:
+        """Drops the flushed items and the links to them from the buffers. Called with `pending_lock` held."""
+        self.links = {key: item for key, item in self.links.items() if id(item) not in written}
+        orphans = {id(item) for item in self.orphans}
+        self.orphans = [item for item in self.orphans if id(item) not in written]
+        for item in batch:
+            if self.pending.get(item.key) is item:
+                del self.pending[item.key]
+                self.pending_bytes -= len(item.data)
+            elif id(item) in orphans:
+                self.pending_bytes -= len(item.data)
+            item.discard()
+        self.oldest_pending = time.monotonic() if self.pending or self.orphans else None
+
+    @staticmethod
+    def _index_links(
+            db: sqlite3.Connection,
+            links: list[tuple[str, int]],
+            written: dict[int, tuple[int, int, int, int]]
+    ) -> None:
+        with db:
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT OR REPLACE INTO items (key, shard, offset, size, crc32, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, NULL, NULL)",
+                [(key, *written[item]) for key, item in links]
+            )
+
+    def _flush_batch(self, db: sqlite3.Connection, batch: list[_Pending]) -> dict[int, tuple[int, int, int, int]]:
+        """Appends the batch to the shards and indexes the items still current.
+
+        Returns where each item written went, `(shard, offset, size, crc32)` by its `id`, for the links to it.
+        """
+        shard, end = self._current_shard(db)
+        ends: dict[int, int] = {}
+        rows = []
+        f = None
+        try:
+            for item in batch:
+                try:
+                    source = item.file.open("rb") if item.file is not None else None
+                except FileNotFoundError:  # replaced or deleted since the batch was taken
+                    continue
+
+                info = tarfile.TarInfo(item.key.lstrip("/"))
+                info.size = item.size
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+                member_size = len(header) + item.size + len(_padding(item.size))
+
+                if end > 0 and end + member_size + len(END_OF_ARCHIVE) > self.shard_size:
+                    if f is not None:
+                        self._close_shard(f, end)
+                        f = None
+                    shard, end = shard + 1, 0
+                if f is None:
+                    path = self.shard_path(shard)
+                    f = path.open("r+b" if path.exists() else "wb")
+                    f.seek(end)
+
+                f.write(header)
+                if source is not None:
+                    with source:
+                        crc32 = _copy(source, f, item.size)
+                else:
+                    f.write(item.data)
+                    crc32 = zlib.crc32(item.data)
+                f.write(_padding(item.size))
+
+                validators = item.validators if item.validators is not None else Validators()
+                rows.append((item, (
+                    item.key, shard, end + len(header), item.size, crc32,
+                    validators.etag, validators.last_modified
+                )))
+                end += member_size
+                ends[shard] = end
+        finally:
+            if f is not None:
+                self._close_shard(f, end)
+
+        # only point the index at the data once it is on disk, and not for items deleted or replaced meanwhile
+        with db:
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT OR REPLACE INTO items (key, shard, offset, size, crc32, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [row for item, row in rows if self.pending.get(item.key) is item]
+            )
+            db.executemany("INSERT OR REPLACE INTO shards (id, end_offset) VALUES (?, ?)", ends.items())
+        return {id(item): row[1:5] for item, row in rows}
+
+    @staticmethod
+    def _close_shard(f, end: int) -> None:
+        f.write(END_OF_ARCHIVE)
+        f.truncate(end + len(END_OF_ARCHIVE))  # drop whatever a crashed batch left past it
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    @override
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+        if self.staging is not None:
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+    def items(self, prefix: str = "") -> Iterator[tuple[str, int, int, int, int]]:
+        """Yields `(key, shard, offset, size, crc32)` of the keys starting with `prefix`, in shard order."""
+        yield from self.db.execute(
+            "SELECT key, shard, offset, size, crc32 FROM items WHERE key >= ? AND key < ? ORDER BY shard, offset",
+            (prefix, prefix + "\U0010ffff")
+        )
+
+    def verify(self) -> Iterator[str]:
+        """Checks every indexed item against its checksum, and every shard against the tar format.
+
+        Yields a message for each problem found.
+        """
+        for key, shard, offset, size, crc32 in self.items():
+            try:
+                data = self._read_at(shard, offset, size)
+            except OSError as e:
+                yield f"{key}: cannot read {self.shard_path(shard)}: {e}"
+                continue
+            if len(data) != size:
+                yield f"{key}: truncated, {len(data)} of {size} bytes in {self.shard_path(shard)}"
+            elif zlib.crc32(data) != crc32:
+                yield f"{key}: checksum mismatch in {self.shard_path(shard)}"
+
+        for shard, _ in self.db.execute("SELECT id, end_offset FROM shards ORDER BY id").fetchall():
+            try:
+                with tarfile.open(self.shard_path(shard), "r:") as tar:
+                    for _ in tar:
+                        pass
+            except (OSError, tarfile.TarError) as e:
+                yield f"{self.shard_path(shard)}: not a valid tar file: {e}"
+
+    def extract(self, output: str | Path, prefix: str = "") -> int:
+        """Writes the items starting with `prefix` out as loose files under `output`, returns how many."""
+        output = Path(output)
+        count = 0
+        for key, shard, offset, size, _ in self.items(prefix):
+            path = output / key.lstrip("/")
+            path.parent.mkdir(exist_ok=True, parents=True)
+            path.write_bytes(self._read_at(shard, offset, size))
+            count += 1
+        return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect archive storage shards.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    verify = subparsers.add_parser("verify", help="check every item's checksum and every shard's tar structure")
+    verify.add_argument("directory", help="archive storage directory")
+
+    extract = subparsers.add_parser("extract", help="write items out as loose files")
+    extract.add_argument("directory", help="archive storage directory")
+    extract.add_argument("output", help="directory to extract into")
+    extract.add_argument("-p", "--prefix", default="", help="only extract keys starting with this")
+
+    args = parser.parse_args()
+
+    if not (Path(args.directory) / ArchiveStorage.INDEX_NAME).exists():
+        sys.exit(f"{args.directory} is not an archive storage directory")
+    storage = ArchiveStorage(args.directory)
+    try:
+        match args.command:
+            case "verify":
+                problems = 0
+                for problem in storage.verify():
+                    print(problem)
+                    problems += 1
+                print(f"{problems} problem(s) found")
+                sys.exit(1 if problems else 0)
+            case "extract":
+                print(f"Extracted {storage.extract(args.output, args.prefix)} item(s) to {args.output}")
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import tempfile
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, ClassVar, Iterable
+
+from snsimagedl_lib.metadata import Metadata
+
+__all__ = (
+    "MemoryBudget",
+    "Reservation",
+)
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+
+@dataclass(slots=True, eq=False)
+class Reservation:
+    """Bytes of a `MemoryBudget` held by one download, until released."""
+    budget: MemoryBudget
+    size: int
+
+    def resize(self, size: int) -> bool:
+        """Changes the reserved size right away, returns `False` if growing to it would go over the limit.
+
+        Growing never waits, as downloads waiting while holding their reservations could wait on each other forever,
+        a body that does not fit is streamed to disk instead.
+        """
+        delta = size - self.size
+        if delta > 0 and self.budget.usage + delta > self.budget.limit:
+            return False
+        self.budget._adjust(delta)
+        self.size = size
+        return True
+
+    def release(self) -> None:
+        """Returns the bytes to the budget, safe to call more than once."""
+        self.resize(0)
+
+
+class MemoryBudget:
+    """Bounds the bytes of downloaded media held in memory at once, across every download.
+
+    A download reserves its expected size before the request, from an estimate by file type, and is queued while
+    the reservations would go over `limit`. Its reservation is then resized to the `Content-Length` of the response,
+    and bodies larger than `spill_size`, or than what is left of the budget, are streamed to a temporary file
+    in `spill_directory` instead of memory.
+    Reservations are held until the media is written, downloads are admitted in order so large ones are not starved.
+    """
+
+    ESTIMATES: ClassVar[dict[str, int]] = {
+        ".jpg": 4 * MiB,
+        ".jpeg": 4 * MiB,
+        ".webp": 4 * MiB,
+        ".png": 16 * MiB,
+        ".gif": 16 * MiB,
+        ".zip": 32 * MiB,  # ugoira frames
+        ".mp4": 64 * MiB,
+        ".m4v": 64 * MiB,
+        ".mov": 64 * MiB,
+    }
+    DEFAULT_ESTIMATE: ClassVar[int] = 8 * MiB
+
+    def __init__(
+            self,
+            limit: int,
+            *,
+            spill_size: int | None = None,
+            spill_directory: str | Path | None = None
+    ):
+        self.limit = limit
+        self.spill_size = min(spill_size or limit // 4, limit)
+        self.spill_directory = Path(spill_directory) if spill_directory is not None else None
+
+        self.usage = 0  # bytes reserved, never over `limit` as reservations only grow within it
+        self.peak = 0
+        self.spilled = 0  # downloads streamed to disk
+        self.waiters: deque[tuple[int, asyncio.Future[None]]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self.waiters)
+
+    def estimate(self, metadata: Metadata) -> int:
+        """The size expected of a media before its response says, capped to what is held in memory."""
+        return min(self.ESTIMATES.get(metadata.file_extension.lower(), self.DEFAULT_ESTIMATE), self.spill_size)
+
+    def _fits(self, size: int) -> bool:
+        # alone, anything is admitted, or nothing larger than the budget ever would be
+        return self.usage == 0 or self.usage + size <= self.limit
+
+    def _adjust(self, delta: int) -> None:
+        self.usage += delta
+        self.peak = max(self.peak, self.usage)
+        if delta < 0:
+            self._wake()
+
+    def _wake(self) -> None:
+        while self.waiters:
+            size, future = self.waiters[0]
+            if future.done():  # cancelled while waiting
+                self.waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self.waiters.popleft()
+            self._adjust(size)
+            future.set_result(None)
+
+    async def reserve(self, size: int) -> Reservation:
+        """Waits until `size` bytes fit in the budget, after the downloads queued before."""
+        if not self.waiters and self._fits(size):
+            self._adjust(size)
+            return Reservation(self, size)
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((size, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():  # admitted as it was cancelled
+                self._adjust(-size)
+            else:
+                self._wake()  # the downloads queued behind may fit now
+            raise
+        return Reservation(self, size)
+
+    async def spill(self, head: Iterable[bytes], chunks: AsyncIterator[bytes], suffix: str = "") -> Path:
+        """Writes the chunks read so far and the rest of the body to a temporary file, which the caller deletes."""
+        self.spilled += 1
+        with tempfile.NamedTemporaryFile(
+                dir=self.spill_directory,
+                prefix="snsimagedl-",
+                suffix=suffix,
+                delete=False
+        ) as f:
+            path = Path(f.name)
+            logger.debug(f"Streaming a download to {path}, too large to hold in memory")
+            try:
+                for chunk in head:
+                    f.write(chunk)
+                async for chunk in chunks:
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                path.unlink(missing_ok=True)
+                raise
+        return path
+
+    def report(self) -> str:
+        return (
+            f"{self.usage / MiB:.1f}/{self.limit / MiB:.0f} MiB in memory (peak {self.peak / MiB:.1f} MiB), "
+            f"{self.waiting} downloads queued, {self.spilled} streamed to disk"
+        )
@@ -0,0 +1,98 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import ClassVar, Mapping
+
+from snsimagedl_lib.extractor import Extractor
+from snsimagedl_lib.exceptions import AgeRestricted, MediaDeleted, UnsupportedLink
+
+__all__ = (
+    "NegativeCache",
+)
+
+
+class NegativeCache:
+    """Persistent cache of posts known to fail, so reposted dead links never reach the network again."""
+
+    # a plain `NotImplementedError` is a gap in the extractor, not the post, and is retried once the extractor is fixed
+    REASONS: ClassVar[Mapping[str, type[Exception]]] = {
+        "deleted": MediaDeleted,
+        "age_restricted": AgeRestricted,
+        "unsupported": UnsupportedLink,
+    }
+    DEFAULT_TTLS: ClassVar[Mapping[str, float]] = {
+        "deleted": 30 * 24 * 60 * 60,
+        "age_restricted": 7 * 24 * 60 * 60,
+        "unsupported": 24 * 60 * 60,
+    }
+
+    def __init__(self, path: str | Path, ttls: Mapping[str, float] | None = None):
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS negative_cache ("
+            "    key TEXT PRIMARY KEY,"
+            "    reason TEXT NOT NULL,"
+            "    expires_at REAL NOT NULL"
+            ")"
+        )
+
+    @staticmethod
+    def key_for(extractor: Extractor, query: str) -> str | None:
+        """Returns a cache key identifying the post `query` points to, or `None` if the extractor does not handle it.
+
+        Keys are built from the extractor's `URL_PATTERN` groups, so different links to the same post share an entry.
+        """
+        pattern = getattr(extractor, "URL_PATTERN", None)
+        if pattern is None:
+            return None
+
+        res = pattern.search(query)
+        if not res:
+            return None
+        return f"{extractor.__class__.__name__}:{"/".join(group or "" for group in res.groups())}"
+
+    @classmethod
+    def reason_of(cls, error: BaseException) -> str | None:
+        for reason, error_type in cls.REASONS.items():
+            if isinstance(error, error_type):
+                return reason
+        return None
+
+    def check(self, key: str) -> None:
+        """Raises the cached failure for `key`, if there is one that has not expired."""
+        row = self.db.execute(
+            "SELECT reason FROM negative_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+
+        if row is not None:
+            reason, = row
+            raise self.REASONS[reason](f"{key} is cached as {reason}.")
+
+    def add(self, key: str, error: BaseException) -> bool:
+        """Remembers `error` for `key`. Returns `False` if the error is not a cacheable failure."""
+        reason = self.reason_of(error)
+        if reason is None:
+            return False
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO negative_cache (key, reason, expires_at) VALUES (?, ?, ?)",
+            (key, reason, time.time() + self.ttls[reason])
+        )
+        return True
+
+    def invalidate(self, key: str) -> bool:
+        return self.db.execute("DELETE FROM negative_cache WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self, reason: str | None = None) -> int:
+        if reason is None:
+            return self.db.execute("DELETE FROM negative_cache").rowcount
+        return self.db.execute("DELETE FROM negative_cache WHERE reason = ?", (reason,)).rowcount
+
+    def purge_expired(self) -> int:
+        return self.db.execute("DELETE FROM negative_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def close(self) -> None:
+        self.db.close()
@@ -0,0 +1,326 @@
+import argparse
+import logging
+import sqlite3
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Collection, Iterable, Iterator
+
+from pyexiv2 import Image
+
+from snsimagedl_lib.metadata import Metadata, ArtistMetadata
+
+__all__ = (
+    "CatalogEntry",
+    "Catalog",
+    "read_tags",
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    extractor TEXT,
+    filename TEXT NOT NULL,
+    source_url TEXT NOT NULL,
+    webpage_url TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    created_at REAL,
+    artist_handle TEXT COLLATE NOCASE,
+    artist_name TEXT COLLATE NOCASE,
+    artist_url TEXT,
+    keywords TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS media_artist_handle ON media (artist_handle);
+CREATE INDEX IF NOT EXISTS media_artist_name ON media (artist_name);
+CREATE INDEX IF NOT EXISTS media_created_at ON media (created_at);
+
+CREATE TABLE IF NOT EXISTS media_keywords (
+    media_id INTEGER NOT NULL,
+    keyword TEXT NOT NULL COLLATE NOCASE,
+    PRIMARY KEY (keyword, media_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS media_keywords_media_id ON media_keywords (media_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+    title, description, keywords, artist_handle, artist_name,
+    content='media', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS media_fts_insert AFTER INSERT ON media BEGIN
+    INSERT INTO media_fts (rowid, title, description, keywords, artist_handle, artist_name)
+    VALUES (new.id, new.title, new.description, new.keywords, new.artist_handle, new.artist_name);
+END;
+CREATE TRIGGER IF NOT EXISTS media_fts_delete AFTER DELETE ON media BEGIN
+    INSERT INTO media_fts (media_fts, rowid, title, description, keywords, artist_handle, artist_name)
+    VALUES ('delete', old.id, old.title, old.description, old.keywords, old.artist_handle, old.artist_name);
+END;
+CREATE TRIGGER IF NOT EXISTS media_fts_update AFTER UPDATE ON media BEGIN
+    INSERT INTO media_fts (media_fts, rowid, title, description, keywords, artist_handle, artist_name)
+    VALUES ('delete', old.id, old.title, old.description, old.keywords, old.artist_handle, old.artist_name);
+    INSERT INTO media_fts (rowid, title, description, keywords, artist_handle, artist_name)
+    VALUES (new.id, new.title, new.description, new.keywords, new.artist_handle, new.artist_name);
+END;
+"""
+
+COLUMNS = (
+    "path, extractor, filename, source_url, webpage_url, title, description, created_at, "
+    "artist_handle, artist_name, artist_url, keywords"
+)
+
+
+@dataclass(slots=True, frozen=True)
+class CatalogEntry:
+    path: str
+    extractor: str | None
+    metadata: Metadata
+
+
+def _fts_query(text: str) -> str:
+    """Quotes every term, so user input is always matched as plain words, never parsed as FTS5 syntax."""
+    return " ".join(f'"{term.replace('"', '""')}"' for term in text.split())
+
+
+def _lang_alt(value: str | dict[str, str] | None) -> str | None:
+    # `{'lang="x-default"': 'title'}`
+    if isinstance(value, dict):
+        return next(iter(value.values()), None)
+    return value
+
+
+def _first(value: str | list[str] | None) -> str | None:
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _parse_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def read_tags(path: str | Path) -> Metadata | None:
+    """Rebuilds the metadata `XmpTagger` and `ExifTagger` wrote into a saved file, `None` if it has none."""
+    path = Path(path)
+    try:
+        with Image(str(path)) as img:
+            xmp = img.read_xmp()
+            artist_handle = img.read_exif().get("Exif.Image.Artist")
+    except RuntimeError, OSError:
+        return None
+
+    if not xmp and not artist_handle:
+        return None
+
+    display_name = _first(xmp.get("Xmp.dc.creator"))
+    artist = None
+    if artist_handle or display_name:
+        artist = ArtistMetadata(
+            handle=artist_handle or display_name,
+            display_name=display_name or artist_handle,
+            webpage_url=xmp.get("Xmp.iptc.CreatorContactInfo", "")
+        )
+
+    keywords = xmp.get("Xmp.dc.subject")
+    return Metadata(
+        filename=path.name,
+        source_url="",  # not tagged
+        webpage_url=xmp.get("Xmp.dc.source", ""),
+        title=_lang_alt(xmp.get("Xmp.dc.title")),
+        description=_lang_alt(xmp.get("Xmp.dc.description")),
+        created_at=_parse_date(_first(xmp.get("Xmp.dc.date"))),
+        artist=artist,
+        keywords=[keywords] if isinstance(keywords, str) else keywords
+    )
+
+
+class Catalog:
+    """Searchable index of the metadata of every saved media, kept in sqlite with FTS5.
+
+    Artist and keyword filters use plain indexes for exact matches, free text goes through the full text index,
+    so lookups stay in the milliseconds on archives of hundreds of thousands of files.
+    """
+
+    def __init__(self, path: str | Path):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def _upsert(self, path: str, metadata: Metadata, extractor: str | None) -> None:
+        artist = metadata.artist
+        keywords = metadata.keywords or []
+        media_id, = self.db.execute(
+            f"INSERT INTO media ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            f"ON CONFLICT (path) DO UPDATE SET ({COLUMNS}) = "
+            "(excluded.path, excluded.extractor, excluded.filename, excluded.source_url, excluded.webpage_url, "
+            "excluded.title, excluded.description, excluded.created_at, excluded.artist_handle, "
+            "excluded.artist_name, excluded.artist_url, excluded.keywords) "
+            "RETURNING id",
+            (
+                path, extractor, metadata.filename, metadata.source_url, metadata.webpage_url,
+                metadata.title, metadata.description,
+                metadata.created_at.timestamp() if metadata.created_at else None,
+                artist.handle if artist else None,
+                artist.display_name if artist else None,
+                artist.webpage_url if artist else None,
+                "\n".join(keywords)
+            )
+        ).fetchone()
+
+        self.db.execute("DELETE FROM media_keywords WHERE media_id = ?", (media_id,))
+        self.db.executemany(
+            "INSERT OR IGNORE INTO media_keywords (media_id, keyword) VALUES (?, ?)",
+            [(media_id, keyword) for keyword in keywords]
+        )
+
+    def add(self, path: str, metadata: Metadata, extractor: str | None = None) -> None:
+        with self.db:
+            self.db.execute("BEGIN")
+            self._upsert(path, metadata, extractor)
+
+    def remove(self, path: str) -> bool:
+        with self.db:
+            self.db.execute("BEGIN")
+            row = self.db.execute("DELETE FROM media WHERE path = ? RETURNING id", (path,)).fetchone()
+            if row is None:
+                return False
+            self.db.execute("DELETE FROM media_keywords WHERE media_id = ?", row)
+        return True
+
+    def search(
+            self,
+            text: str | None = None,
+            *,
+            artist: str | None = None,
+            keywords: Collection[str] = (),
+            extractor: str | None = None,
+            limit: int = 50
+    ) -> list[CatalogEntry]:
+        """Finds media matching all the given filters, the best text matches or the newest first.
+
+        `artist` matches the handle or the display name, `keywords` must all be tagged exactly (ignoring case),
+        and every word of `text` must appear in the title, description, keywords or artist.
+        """
+        sql = f"SELECT {", ".join(f"media.{column}" for column in COLUMNS.split(", "))} FROM media"
+        conditions = []
+        params = []
+
+        if text and text.strip():
+            sql += " JOIN media_fts ON media_fts.rowid = media.id"
+            conditions.append("media_fts MATCH ?")
+            params.append(_fts_query(text))
+        if artist:
+            conditions.append("(media.artist_handle = ? OR media.artist_name = ?)")
+            params.extend((artist, artist))
+        for keyword in keywords:
+            conditions.append("media.id IN (SELECT media_id FROM media_keywords WHERE keyword = ?)")
+            params.append(keyword)
+        if extractor:
+            conditions.append("media.extractor = ?")
+            params.append(extractor)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY " + ("media_fts.rank" if text and text.strip() else "media.created_at DESC") + " LIMIT ?"
+        params.append(limit)
+
+        return [self._to_entry(row) for row in self.db.execute(sql, params)]
+
+    @staticmethod
+    def _to_entry(row: tuple) -> CatalogEntry:
+        (
+            path, extractor, filename, source_url, webpage_url, title, description, created_at,
+            artist_handle, artist_name, artist_url, keywords
+        ) = row
+        return CatalogEntry(
+            path=path,
+            extractor=extractor,
+            metadata=Metadata(
+                filename=filename,
+                source_url=source_url,
+                webpage_url=webpage_url,
+                title=title,
+                description=description,
+                created_at=datetime.fromtimestamp(created_at, timezone.utc) if created_at is not None else None,
+                artist=ArtistMetadata(artist_handle, artist_name, artist_url or "") if artist_handle else None,
+                keywords=keywords.split("\n") if keywords else []
+            )
+        )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(*) FROM media").fetchone()[0]
+
+    def import_files(self, paths: Iterable[Path], *, batch_size: int = 1000) -> int:
+        """Adds already saved files from the tags written into them, committing every `batch_size` files.
+
+        Returns how many were imported, files without tags are skipped.
+        """
+        imported = 0
+        self.db.execute("BEGIN")
+        try:
+            for path in paths:
+                metadata = read_tags(path)
+                if metadata is None:
+                    continue
+
+                self._upsert(path.as_posix(), metadata, None)  # not tagged
+                imported += 1
+                if imported % batch_size == 0:
+                    self.db.execute("COMMIT")
+                    logger.info(f"Imported {imported} files")
+                    self.db.execute("BEGIN")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return imported
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _walk(directory: Path) -> Iterator[Path]:
+    for path in directory.rglob("*"):
+        if path.is_file() and not path.name.endswith(".validators.json"):
+            yield path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the saved media catalog.")
+    parser.add_argument("-d", "--database", default="./catalog.sqlite3", help="path to the catalog database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_ = subparsers.add_parser("import", help="add already saved files from their XMP tags")
+    import_.add_argument("directory", help="directory to scan recursively")
+
+    search = subparsers.add_parser("search", help="search the catalog")
+    search.add_argument("text", nargs="?", default=None, help="words to search for")
+    search.add_argument("-a", "--artist", help="artist handle or display name")
+    search.add_argument("-k", "--keyword", action="append", default=[], help="exact keyword, can be repeated")
+    search.add_argument("-n", "--limit", type=int, default=50)
+
+    args = parser.parse_args()
+
+    catalog = Catalog(args.database)
+    try:
+        match args.command:
+            case "import":
+                directory = Path(args.directory)
+                if not directory.is_dir():
+                    sys.exit(f"{directory} is not a directory")
+                print(f"Imported {catalog.import_files(_walk(directory))} file(s) into {args.database}")
+            case "search":
+                for entry in catalog.search(args.text, artist=args.artist, keywords=args.keyword, limit=args.limit):
+                    print(f"{entry.path}\t{entry.metadata.webpage_url}")
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
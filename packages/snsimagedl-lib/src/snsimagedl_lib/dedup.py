@@ -0,0 +1,192 @@
+import asyncio
+import io
+import logging
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import ClassVar
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:
+    Image = None
+
+__all__ = (
+    "ImageHash",
+    "Duplicate",
+    "HashIndex",
+    "DuplicateIndex",
+    "perceptual_hash",
+    "hamming_distance",
+)
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 differences, a 64 bit hash
+
+
+@dataclass(slots=True, frozen=True)
+class ImageHash:
+    hash: int
+    width: int
+    height: int
+
+    @property
+    def resolution(self) -> int:
+        return self.width * self.height
+
+
+@dataclass(slots=True, frozen=True)
+class Duplicate:
+    path: Path
+    image: ImageHash
+    distance: int
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def perceptual_hash(data: bytes) -> ImageHash | None:
+    """Difference hash (dHash) of an image, robust to re-encoding and resizing.
+
+    Returns `None` for files Pillow cannot read, such as videos.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            # let the JPEG decoder downscale while decoding, much cheaper than decoding the full image
+            image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            pixels = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).tobytes()
+    except UnidentifiedImageError, OSError:
+        return None
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + col
+            value = (value << 1) | (pixels[offset] > pixels[offset + 1])
+    return ImageHash(value, width, height)
+
+
+class HashIndex:
+    """Multi-index hashing over hamming distances, finding near hashes without comparing against every one.
+
+    Hashes are split into `max_distance + 1` bands, each indexed by value. Two hashes within `max_distance`
+    differ in at most that many bands, so at least one band is equal and only that band's bucket is compared.
+    """
+
+    def __init__(self, max_distance: int, bits: int = HASH_SIZE * HASH_SIZE):
+        self.max_distance = max_distance
+
+        bands = min(max_distance + 1, bits)
+        self.bands: list[tuple[int, int]] = []  # shift, mask
+        shift = 0
+        for band in range(bands):
+            width = bits // bands + (band < bits % bands)
+            self.bands.append((shift, (1 << width) - 1))
+            shift += width
+
+        self.tables: list[dict[int, list[tuple[int, Path]]]] = [{} for _ in self.bands]
+
+    def add(self, hash: int, path: Path) -> None:
+        entry = (hash, path)  # shared by the buckets of every band
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table.setdefault((hash >> shift) & mask, []).append(entry)
+
+    def remove(self, hash: int, path: Path) -> None:
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            key = (hash >> shift) & mask
+            bucket = [entry for entry in table.get(key, ()) if entry[1] != path]
+            if bucket:
+                table[key] = bucket
+            else:
+                table.pop(key, None)
+
+    def find(self, hash: int) -> dict[Path, int]:
+        """Returns the paths of the hashes within `max_distance`, with their distances."""
+        matches = {}
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            for other, path in table.get((hash >> shift) & mask, ()):
+                if path not in matches and (distance := hamming_distance(hash, other)) <= self.max_distance:
+                    matches[path] = distance
+        return matches
+
+
+class DuplicateIndex:
+    """Persistent perceptual hash index of saved images, to find the same artwork saved from different sites.
+
+    Hashes are stored in sqlite and loaded into a `HashIndex` on start, hashing runs in a worker process.
+    """
+
+    EXTENSIONS: ClassVar[frozenset[str]] = frozenset({".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"})
+
+    def __init__(self, path: str | Path, *, max_distance: int = 6, max_workers: int = 1):
+        if Image is None:
+            raise ImportError("Deduplication requires Pillow, install snsimagedl-lib[dedup].")
+
+        self.max_workers = max_workers
+        self.process_pool: ProcessPoolExecutor | None = None  # started on the first hash
+
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "    path TEXT PRIMARY KEY,"
+            "    hash INTEGER NOT NULL,"
+            "    width INTEGER NOT NULL,"
+            "    height INTEGER NOT NULL"
+            ")"
+        )
+
+        self.images: dict[Path, ImageHash] = {}
+        self.index = HashIndex(max_distance)
+        for path, hash, width, height in self.db.execute("SELECT path, hash, width, height FROM images"):
+            path = Path(path)
+            # sqlite integers are signed
+            image = ImageHash(hash & 0xFFFF_FFFF_FFFF_FFFF, width, height)
+            self.images[path] = image
+            self.index.add(image.hash, path)
+
+    def supports(self, extension: str) -> bool:
+        """Whether files with `extension` are images worth hashing, so videos are not sent to the worker for nothing."""
+        return extension.lower() in self.EXTENSIONS
+
+    async def hash(self, data: bytes) -> ImageHash | None:
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        # decoding is cpu bound, keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(self.process_pool, perceptual_hash, data)
+
+    def find(self, image: ImageHash) -> Duplicate | None:
+        """Returns the closest saved image within `max_distance` bits, if there is one."""
+        matches = self.index.find(image.hash)
+        if not matches:
+            return None
+
+        path = min(matches, key=matches.__getitem__)
+        return Duplicate(path, self.images[path], matches[path])
+
+    def add(self, path: Path, image: ImageHash) -> None:
+        self.remove(path)
+
+        self.db.execute(
+            "INSERT INTO images (path, hash, width, height) VALUES (?, ?, ?, ?)",
+            (str(path), image.hash - (1 << 64) if image.hash >= 1 << 63 else image.hash, image.width, image.height)
+        )
+        self.images[path] = image
+        self.index.add(image.hash, path)
+
+    def remove(self, path: Path) -> bool:
+        image = self.images.pop(path, None)
+        if image is None:
+            return False
+
+        self.db.execute("DELETE FROM images WHERE path = ?", (str(path),))
+        self.index.remove(image.hash, path)
+        return True
+
+    def close(self) -> None:
+        self.db.close()
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
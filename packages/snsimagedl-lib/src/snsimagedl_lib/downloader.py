@@ -1,9 +1,14 @@
-from dataclasses import dataclass
+import asyncio
+import functools
+import shutil
+from contextlib import aclosing
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Collection, TYPE_CHECKING
+from typing import Collection, AsyncIterator, Callable, TYPE_CHECKING
 
-from snsimagedl_lib import Extractor, FileTagger, Metadata
-from snsimagedl_lib.exceptions import UnsupportedLink
+from snsimagedl_lib import Extractor, FileTagger, PreparedTags, Metadata, NegativeCache, Validators, StorageBackend, \
+    MemoryBudget, Reservation, Mp4Tagger, pad_moov, pad_moov_data
+from snsimagedl_lib.exceptions import UnsupportedLink, NotModified
 
 if TYPE_CHECKING:
     from _typeshed import SupportsWrite
@@ -15,6 +20,11 @@ __all__ = (
 )
 
 
+async def _no_chunks() -> AsyncIterator[bytes]:
+    return
+    yield
+
+
 @dataclass(slots=True, frozen=True)
 class QueryResult:
     extractor: Extractor
@@ -22,14 +32,78 @@ class QueryResult:
 
     downloader: MediaDownloader
 
-    async def _download_data(self) -> bytes:
-        return await self.extractor.download(self.metadata)
+    def _padding(self) -> int | None:
+        """Free space to leave after `moov` of a video, so its tags are written in place and it stays fast start."""
+        for tagger in self.downloader.taggers:
+            if isinstance(tagger, Mp4Tagger) and tagger.supports(self.metadata.file_extension):
+                return tagger.padding(self.metadata)
+        return None
+
+    async def _download_data(self, validators: Validators | None = None) -> bytes:
+        data = await self.extractor.download(self.metadata, validators)
+        if (padding := self._padding()) is not None:
+            data = pad_moov_data(data, padding)
+        return data
+
+    async def _download_within(
+            self,
+            budget: MemoryBudget,
+            reservation: Reservation,
+            validators: Validators | None
+    ) -> DownloadResult:
+        try:
+            opened = self.extractor.stream(self.metadata, validators)
+        except NotImplementedError:
+            data = await self._download_data(validators)
+            if reservation.resize(len(data)):
+                return DownloadResult(data, self, validators, reservation)
+            # read whole before its size was known, moved to disk so it is not held over the budget
+            file = await budget.spill((data,), _no_chunks(), self.metadata.file_extension)
+            reservation.release()
+            return DownloadResult(b"", self, validators, reservation, file)
+
+        async with opened as stream:
+            body = stream.chunks
+            if (padding := self._padding()) is not None:
+                body = pad_moov((), body, padding)
+
+            chunks = []
+            # what does not fit in the budget left goes to disk, rather than over the budget
+            if stream.size is None or stream.size <= budget.spill_size and reservation.resize(stream.size):
+                size = 0
+                async for chunk in body:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > budget.spill_size:  # longer than announced, or not announced
+                        break
+                    if size > reservation.size and not reservation.resize(size):
+                        break
+                else:
+                    return DownloadResult(b"".join(chunks), self, validators, reservation)
+
+            file = await budget.spill(chunks, body, self.metadata.file_extension)
+            reservation.release()
+            return DownloadResult(b"", self, validators, reservation, file)
+
+    async def download(self, validators: Validators | None = None) -> DownloadResult:
+        """Downloads the media, raises `NotModified` if `validators` show the saved file is still up to date.
 
-    async def download(self) -> DownloadResult:
-        return DownloadResult(
-            await self._download_data(),
-            self
-        )
+        With a memory budget, waits for the media to fit in it first, and the result must be released once written.
+        """
+        budget = self.downloader.budget
+        if budget is None:
+            return DownloadResult(
+                await self._download_data(validators),
+                self,
+                validators
+            )
+
+        reservation = await budget.reserve(budget.estimate(self.metadata))
+        try:
+            return await self._download_within(budget, reservation, validators)
+        except BaseException:
+            reservation.release()
+            raise
 
 
 @dataclass(slots=True, frozen=True)
@@ -38,16 +112,43 @@ class DownloadResult:
 
     query: QueryResult
 
-    def tag(self, taggers: Collection[FileTagger] = None) -> DownloadResult:
-        data = self.data
-        taggers = taggers or self.query.downloader.taggers
+    validators: Validators | None = None
+
+    reservation: Reservation | None = None  # of the memory budget, held until released
+    file: Path | None = None  # a temporary file holding the data instead, when too large to hold in memory
+
+    @property
+    def size(self) -> int:
+        return self.file.stat().st_size if self.file is not None else len(self.data)
+
+    def release(self) -> None:
+        """Gives the memory back to the budget and deletes the temporary file, once the media is written."""
+        if self.reservation is not None:
+            self.reservation.release()
+        if self.file is not None:
+            self.file.unlink(missing_ok=True)
 
-        for tagger in taggers:
-            data = tagger.tag(data, self.query.metadata)
-        return DownloadResult(data, self.query)
+    def tag(self, taggers: Collection[FileTagger] = None, prepared: PreparedTags | None = None) -> DownloadResult:
+        """Tags the data, with the payloads `prepared` for its post if given. A temporary file is tagged in place."""
+        if prepared is None:
+            prepared = PreparedTags.prepare(taggers or self.query.downloader.taggers, self.query.metadata)
+        if self.file is not None:
+            prepared.tag_file(self.file, self.query.metadata.file_extension)
+            return self
+        return replace(self, data=prepared.tag(self.data, self.query.metadata.file_extension))
+
+    def store(self, storage: StorageBackend, key: str) -> None:
+        if self.file is not None:
+            storage.write_file(key, self.file, self.validators)
+        else:
+            storage.write(key, self.data, self.validators)
 
     def save(self, fp: SupportsWrite[bytes]) -> None:
-        fp.write(self.data)
+        if self.file is not None:
+            with self.file.open("rb") as f:
+                shutil.copyfileobj(f, fp)
+        else:
+            fp.write(self.data)
 
     def save_to(self, filepath: str | Path) -> None:
         if not isinstance(filepath, Path):
@@ -57,20 +158,138 @@ class DownloadResult:
             # noinspection PyTypeChecker
             self.save(f)
 
+        if self.validators is not None and not self.validators.is_empty:
+            self.validators.size = self.size
+            self.validators.save(filepath)
+
 
 class MediaDownloader:
-    def __init__(self, extractors: Collection[Extractor], taggers: Collection[FileTagger]):
+    def __init__(
+            self,
+            extractors: Collection[Extractor],
+            taggers: Collection[FileTagger],
+            negative_cache: NegativeCache | None = None,
+            budget: MemoryBudget | None = None
+    ):
         self.extractors = extractors
         self.taggers = taggers
+        self.negative_cache = negative_cache
+        self.budget = budget
+
+    async def _query_extractor(self, extractor: Extractor, query: str) -> Collection[Metadata]:
+        if self.negative_cache is None:
+            return await extractor.query(query)
+
+        key = self.negative_cache.key_for(extractor, query)
+        if key is None:
+            return await extractor.query(query)
+
+        self.negative_cache.check(key)
+        try:
+            return await extractor.query(query)
+        except Exception as e:
+            self.negative_cache.add(key, e)
+            raise
 
     async def query(self, query: str) -> Collection[QueryResult]:
         results = []
 
         for extractor in self.extractors:
             try:
-                for metadata in await extractor.query(query):
+                for metadata in await self._query_extractor(extractor, query):
                     results.append(QueryResult(extractor, metadata, self))
             except NotImplementedError, UnsupportedLink:
                 pass
 
         return results
+
+    def _is_archived(
+            self,
+            is_archived: Callable[[QueryResult], bool],
+            extractor: Extractor,
+            metadata: Metadata
+    ) -> bool:
+        return is_archived(QueryResult(extractor, metadata, self))
+
+    async def _crawl_results(
+            self,
+            extractor: Extractor,
+            posts: AsyncIterator[Collection[Metadata]]
+    ) -> AsyncIterator[Collection[QueryResult]]:
+        # closes the extractor's crawl with this one, so a crawl stopped early cancels its page prefetch right away
+        async with aclosing(posts):
+            async for post in posts:
+                yield [QueryResult(extractor, metadata, self) for metadata in post]
+
+    def crawl(
+            self,
+            query: str,
+            is_archived: Callable[[QueryResult], bool] | None = None
+    ) -> AsyncIterator[Collection[QueryResult]]:
+        """Crawls a listing with the first extractor supporting it, yielding the results of each post.
+
+        Raises `UnsupportedLink` if no extractor crawls `query`.
+        """
+        for extractor in self.extractors:
+            archived = functools.partial(self._is_archived, is_archived, extractor) if is_archived else None
+            try:
+                posts = extractor.crawl(query, archived=archived)
+            except NotImplementedError, UnsupportedLink:
+                continue
+            return self._crawl_results(extractor, posts)
+        raise UnsupportedLink(f"{query} is not a listing any extractor can crawl.")
+
+    def prepare_tags(self, results: Collection[QueryResult]) -> list[PreparedTags]:
+        """Prepares the tags of every result, once per post.
+
+        Files of a post, like the pages of a manga, share their metadata but for the file name and url,
+        which taggers do not write, so they share the same payloads.
+        """
+        posts: list[tuple[Metadata, PreparedTags]] = []
+        prepared = []
+        for result in results:
+            post = replace(result.metadata, filename="", source_url="")
+            tags = next((tags for metadata, tags in posts if metadata == post), None)
+            if tags is None:
+                tags = PreparedTags.prepare(self.taggers, result.metadata)
+                posts.append((post, tags))
+            prepared.append(tags)
+        return prepared
+
+    @staticmethod
+    async def _download_modified(result: QueryResult, validators: Validators | None) -> DownloadResult | None:
+        try:
+            return await result.download(validators)
+        except NotModified:
+            return None
+
+    @staticmethod
+    async def download_all(
+            results: Collection[QueryResult],
+            validators: Callable[[QueryResult], Validators | None] | None = None
+    ) -> AsyncIterator[DownloadResult]:
+        """Downloads all results concurrently, yielding each one as soon as it completes.
+
+        Results that `validators` show to be already saved and up to date are skipped.
+        """
+        tasks = [
+            asyncio.ensure_future(MediaDownloader._download_modified(result, validators and validators(result)))
+            for result in results
+        ]
+        yielded = set()
+        try:
+            for task in asyncio.as_completed(tasks):
+                if (downloaded := await task) is not None:
+                    yielded.add(id(downloaded))
+                    yield downloaded
+        finally:
+            for task in tasks:
+                task.cancel()
+                # done but never yielded, nobody else will release them
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    if (downloaded := task.result()) is not None and id(downloaded) not in yielded:
+                        downloaded.release()
+
+    async def close(self) -> None:
+        for extractor in self.extractors:
+            await extractor.close()
@@ -1,7 +1,8 @@
 __all__ = (
     "UnsupportedLink",
     "AgeRestricted",
-    "MediaDeleted"
+    "MediaDeleted",
+    "NotModified"
 )
 
 
@@ -14,4 +15,9 @@ class AgeRestricted(Exception):
 
 
 class MediaDeleted(Exception):
+    pass
+
+
+class NotModified(Exception):
+    """The file already saved is still up to date, raised on a 304 for a conditional download."""
     pass
\ No newline at end of file
@@ -1,15 +1,48 @@
-from typing import Protocol, Collection
+from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass
+from typing import Protocol, Collection, AsyncIterator, Callable
 
 from snsimagedl_lib.metadata import Metadata
+from snsimagedl_lib.validators import Validators
 
 __all__ = (
+    "MediaStream",
     "Extractor",
 )
 
 
+@dataclass(slots=True, frozen=True)
+class MediaStream:
+    size: int | None  # from `Content-Length`, if the server sent it
+    chunks: AsyncIterator[bytes]
+
+
 class Extractor[T: Metadata](Protocol):
     async def query(self, query: str) -> Collection[T] | None:
         raise NotImplemented
 
-    async def download(self, media: T) -> bytes:
+    def crawl(
+            self,
+            query: str,
+            *,
+            archived: Callable[[T], bool] | None = None
+    ) -> AsyncIterator[Collection[T]]:
+        """Pages through a listing, like the works of an artist, yielding the media of each post as it goes.
+
+        Stops at the first post whose first media is `archived`, as listings are newest first.
+        Raises `UnsupportedLink` right away if `query` is not a listing this extractor crawls.
+        """
+        raise NotImplementedError
+
+    async def download(self, media: T, validators: Validators | None = None) -> bytes:
         raise NotImplemented
+
+    def stream(self, media: T, validators: Validators | None = None) -> AbstractAsyncContextManager[MediaStream]:
+        """Opens the media to be read a chunk at a time, so its size is known before its body is held in memory.
+
+        Raises `NotImplementedError` right away for media built rather than downloaded, which are downloaded whole.
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,594 @@
+import io
+import logging
+import os
+import struct
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from itertools import zip_longest
+from typing import AsyncIterator, BinaryIO, ClassVar, Iterable, Iterator, Sequence, override
+from xml.sax.saxutils import escape
+
+from snsimagedl_lib.metadata import Metadata
+from snsimagedl_lib.tagger import FileTagger
+
+__all__ = (
+    "Mp4Tagger",
+    "mux_fragments",
+    "pad_moov",
+    "pad_moov_data",
+)
+
+logger = logging.getLogger(__name__)
+
+XMP_UUID = bytes.fromhex("BE7ACFCB97A942E89C71999491E3AFAC")
+# boxes holding other boxes, walked to find the chunk offset tables
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex"}
+# of fragmented files, walked to find the absolute offsets of `tfhd` and `tfra`
+FRAGMENT_CONTAINERS = {b"moof", b"traf", b"mfra"}
+PADDING = 1024  # free space left after the metadata, so retagging fits in place
+COPY_CHUNK_SIZE = 1024 * 1024
+HEAD_LIMIT = 32 * 1024 * 1024  # of the boxes up to and including moov held to pad it, past it the body is left as is
+
+
+@dataclass(slots=True, frozen=True)
+class _Box:
+    type: bytes
+    offset: int
+    size: int
+    usertype: bytes | None = None  # of `uuid` boxes
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    @property
+    def is_xmp(self) -> bool:
+        return self.type == b"uuid" and self.usertype == XMP_UUID
+
+
+def _box(type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), type) + payload
+
+
+def _full_box(type: bytes, payload: bytes) -> bytes:
+    return _box(type, b"\0\0\0\0" + payload)  # version 0, no flags
+
+
+def _free_box(size: int) -> bytes:
+    return _box(b"free", bytes(size - 8))
+
+
+def _read_top_level(fp: BinaryIO) -> list[_Box]:
+    """Reads the top level box headers only, seeking over their contents."""
+    file_size = fp.seek(0, os.SEEK_END)
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        fp.seek(offset)
+        size, type = struct.unpack(">I4s", fp.read(8))
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack(">Q", fp.read(8))
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size or offset + size > file_size:
+            raise ValueError(f"Corrupt {type!r} box at {offset}")
+
+        usertype = fp.read(16) if type == b"uuid" else None
+        boxes.append(_Box(type, offset, size, usertype))
+        offset += size
+    return boxes
+
+
+def _children(data: bytes) -> Iterator[tuple[bytes, bytes, bytes]]:
+    """Yields the `(type, header, payload)` of the boxes in `data`."""
+    offset = 0
+    while offset + 8 <= len(data):
+        size, type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack_from(">Q", data, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise ValueError(f"Corrupt {type!r} box")
+
+        yield type, data[offset:offset + header_size], data[offset + header_size:offset + size]
+        offset += size
+
+
+def _parse_header(data: bytes | bytearray) -> tuple[bytes, int, int] | None:
+    """The `(type, size, header_size)` of the box at the start of `data`, `None` until its header is complete."""
+    if len(data) < 8:
+        return None
+    size, type = struct.unpack_from(">I4s", data)
+    if size != 1:
+        return type, size, 8
+    if len(data) < 16:
+        return None
+    size, = struct.unpack_from(">Q", data, 8)
+    return type, size, 16
+
+
+def _shift_offsets(payload: bytes, start: int, delta: int) -> bytes:
+    """Adds `delta` to the absolute file offsets pointing at or past `start`.
+
+    These are the `stco`/`co64` chunk offsets and, in fragmented files, the `tfhd` base data offsets
+    and the `tfra` fragment offsets. The boxes keep their size.
+    """
+    output = []
+    for type, header, child in _children(payload):
+        if type in CONTAINERS or type in FRAGMENT_CONTAINERS:
+            output.append(header + _shift_offsets(child, start, delta))
+        elif type in (b"stco", b"co64"):
+            fmt = ">I" if type == b"stco" else ">Q"
+            entry_size = struct.calcsize(fmt)
+            count, = struct.unpack_from(">I", child, 4)
+            entries = bytearray(child)
+            for i in range(count):
+                position = 8 + i * entry_size
+                offset, = struct.unpack_from(fmt, entries, position)
+                if offset >= start:
+                    struct.pack_into(fmt, entries, position, offset + delta)
+            output.append(header + bytes(entries))
+        elif type == b"tfhd" and struct.unpack_from(">I", child)[0] & 0x000001:  # base-data-offset-present
+            entries = bytearray(child)
+            offset, = struct.unpack_from(">Q", entries, 8)
+            if offset >= start:
+                struct.pack_into(">Q", entries, 8, offset + delta)
+            output.append(header + bytes(entries))
+        elif type == b"tfra":
+            wide = child[0] == 1
+            fmt = ">Q" if wide else ">I"
+            lengths, count = struct.unpack_from(">II", child, 8)
+            # time and moof offset, then the traf, trun and sample numbers of 1 to 4 bytes each
+            entry_size = 2 * struct.calcsize(fmt) + sum(((lengths >> shift) & 3) + 1 for shift in (4, 2, 0))
+            entries = bytearray(child)
+            for i in range(count):
+                position = 16 + i * entry_size + struct.calcsize(fmt)
+                offset, = struct.unpack_from(fmt, entries, position)
+                if offset >= start:
+                    struct.pack_into(fmt, entries, position, offset + delta)
+            output.append(header + bytes(entries))
+        else:
+            output.append(header + child)
+    return b"".join(output)
+
+
+def _is_fragmented(moov_payload: bytes) -> bool:
+    return any(type == b"mvex" for type, _, _ in _children(moov_payload))
+
+
+def _copy_backward(fp: BinaryIO, start: int, end: int, delta: int) -> None:
+    """Moves `[start, end)` forward by `delta` bytes, a chunk at a time from the end so nothing is overwritten."""
+    position = end
+    while position > start:
+        size = min(COPY_CHUNK_SIZE, position - start)
+        position -= size
+        fp.seek(position)
+        chunk = fp.read(size)
+        fp.seek(position + delta)
+        fp.write(chunk)
+
+
+def _track_id(trak_payload: bytes) -> int:
+    for type, _, child in _children(trak_payload):
+        if type == b"tkhd":
+            return struct.unpack_from(">I", child, 12 if child[0] == 0 else 20)[0]
+    raise ValueError("No tkhd box in trak")
+
+
+def _timescale(moov_payload: bytes) -> int:
+    for type, _, child in _children(moov_payload):
+        if type == b"mvhd":
+            return struct.unpack_from(">I", child, 12 if child[0] == 0 else 20)[0]
+    raise ValueError("No mvhd box in moov")
+
+
+def _retrack(payload: bytes, track_id: int | None, sequence: Iterator[int] | None = None) -> bytes:
+    """Sets the track id of the `tkhd`, `trex` and `tfhd` boxes in `payload`, and renumbers the `mfhd` boxes."""
+    output = []
+    for type, header, child in _children(payload):
+        child = bytearray(child)
+        if type in CONTAINERS or type in (b"moof", b"traf"):
+            output.append(_box(type, _retrack(bytes(child), track_id, sequence)))
+            continue
+        if type == b"tfhd" and struct.unpack_from(">I", child)[0] & 0x000001:
+            # an offset from the start of the file, wrong once fragments are moved
+            raise ValueError("Fragments with an explicit base data offset cannot be moved")
+        if track_id is not None:
+            if type == b"tkhd":
+                struct.pack_into(">I", child, 12 if child[0] == 0 else 20, track_id)
+            elif type in (b"trex", b"tfhd"):
+                struct.pack_into(">I", child, 4, track_id)
+        if type == b"mfhd" and sequence is not None:
+            struct.pack_into(">I", child, 4, next(sequence))
+        output.append(header + bytes(child))
+    return b"".join(output)
+
+
+def _split_init(init: bytes) -> tuple[list[bytes], bytes]:
+    """Splits an init segment into the boxes before `moov`, and the payload of `moov`."""
+    before = []
+    for type, header, child in _children(init):
+        if type == b"moov":
+            return before, child
+        before.append(header + child)
+    raise ValueError("No moov box in the init segment, not a fragmented MP4")
+
+
+def mux_fragments(video: Sequence[bytes], audio: Sequence[bytes]) -> bytes:
+    """Joins the fragmented MP4 segments of a video and of its separate audio into one file with both tracks.
+
+    Both start with their init segment. The audio track is renumbered after the video tracks
+    and the media segments of both are interleaved in order, so nothing is re-encoded.
+    """
+    boxes, video_moov = _split_init(video[0])
+    _, audio_moov = _split_init(audio[0])
+
+    children = list(_children(video_moov))
+    track_ids = [_track_id(child) for type, _, child in children if type == b"trak"]
+    if not track_ids:
+        raise ValueError("No video track in the init segment")
+    audio_id = max(track_ids) + 1
+    # edit lists are in the movie timescale, the audio ones are dropped rather than rescaled
+    keep_edits = _timescale(audio_moov) == _timescale(video_moov)
+
+    audio_traks = []
+    audio_trex = []
+    for type, header, child in _children(audio_moov):
+        if type == b"trak":
+            if not keep_edits:
+                child = b"".join(h + c for t, h, c in _children(child) if t != b"edts")
+            audio_traks.append(_retrack(_box(b"trak", child), audio_id))
+        elif type == b"mvex":
+            audio_trex.extend(_retrack(h + c, audio_id) for t, h, c in _children(child) if t == b"trex")
+    if len(audio_traks) != 1:
+        raise ValueError(f"Expected one audio track, got {len(audio_traks)}")
+
+    last_trak = max(i for i, (type, _, _) in enumerate(children) if type == b"trak")
+    moov = []
+    for i, (type, header, child) in enumerate(children):
+        if type == b"mvhd":
+            child = bytearray(child)
+            struct.pack_into(">I", child, len(child) - 4, audio_id + 1)  # next_track_ID
+            moov.append(_box(b"mvhd", bytes(child)))
+        elif type == b"mvex":
+            moov.append(_box(b"mvex", child + b"".join(audio_trex)))
+        else:
+            moov.append(header + child)
+        if i == last_trak:
+            moov.extend(audio_traks)
+    boxes.append(_box(b"moov", b"".join(moov)))
+
+    sequence = iter(range(1, len(video) + len(audio)))
+    for video_segment, audio_segment in zip_longest(video[1:], audio[1:]):
+        for segment, track_id in ((video_segment, None), (audio_segment, audio_id)):
+            if segment is None:
+                continue
+            for type, header, child in _children(segment):
+                if type == b"moof":
+                    boxes.append(_retrack(header + child, track_id, sequence))
+                elif type != b"sidx":  # indexes only the fragments of its own stream
+                    boxes.append(header + child)
+    return b"".join(boxes)
+
+
+class _MoovPadder:
+    """Adds free space after a `moov` before `mdat` to an MP4 body fed a chunk at a time, see `pad_moov`."""
+
+    def __init__(self, padding: int):
+        self.padding = padding
+        self.buffer = bytearray()
+        self.position = 0  # of the start of `buffer` in the body
+        self.moov_end: int | None = None  # once padded, the offsets pointing past it are shifted
+        self.passing = 0  # bytes left of a box passed through as is
+        self.done = False  # the rest of the body passes through as is
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.position += size
+        return data
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        if self.done or not self.buffer and self.passing >= len(chunk):
+            self.passing = max(self.passing - len(chunk), 0)
+            self.position += len(chunk)
+            yield chunk
+            return
+
+        self.buffer += chunk
+        while self.buffer and not self.done:
+            if self.passing:
+                size = min(self.passing, len(self.buffer))
+                self.passing -= size
+                yield self._take(size)
+                continue
+            if (box := _parse_header(self.buffer)) is None:
+                break
+
+            type, size, header_size = box
+            if size < header_size:  # size 0 runs to the end
+                self.done = True
+            elif self.moov_end is None:
+                if type == b"mdat" or len(self.buffer) > HEAD_LIMIT:
+                    self.done = True
+                elif len(self.buffer) < size:
+                    break  # until the rest of the box is read
+                elif type == b"moov":
+                    self.moov_end = self.position + size
+                    payload = bytes(self.buffer[header_size:size])
+                    header = self._take(size)[:header_size]
+                    yield header + _shift_offsets(payload, self.moov_end, self.padding) + _free_box(self.padding)
+                    # fragments after it may point at their data from the start of the file
+                    self.done = not _is_fragmented(payload)
+                else:
+                    yield self._take(size)
+            elif type in FRAGMENT_CONTAINERS:
+                if len(self.buffer) < size:
+                    if len(self.buffer) > HEAD_LIMIT:
+                        raise ValueError(f"{type!r} box too large to adjust its offsets")
+                    break
+                yield _shift_offsets(self._take(size), self.moov_end, self.padding)
+            else:
+                self.passing = size
+
+        if self.done and self.buffer:
+            yield self._take(len(self.buffer))
+
+    def finish(self) -> Iterator[bytes]:
+        if self.buffer:  # an incomplete box, as it is
+            yield self._take(len(self.buffer))
+
+
+async def pad_moov(
+        head: Iterable[bytes],
+        chunks: AsyncIterator[bytes],
+        padding: int = PADDING
+) -> AsyncIterator[bytes]:
+    """Passes an MP4 body through, with `padding` bytes of free space added after a `moov` before `mdat`.
+
+    Streamed to disk this way, a fast start file can be tagged in place without moving `moov` after the media data.
+    Only the boxes up to `moov` and the small `moof` boxes of fragmented files are held, files with `moov` at
+    the end or unusually large headers pass as they are.
+    """
+    padder = _MoovPadder(padding)
+    for chunk in head:
+        for output in padder.feed(chunk):
+            yield output
+    async for chunk in chunks:
+        for output in padder.feed(chunk):
+            yield output
+    for output in padder.finish():
+        yield output
+
+
+def pad_moov_data(data: bytes, padding: int = PADDING) -> bytes:
+    """`pad_moov` for a body already in memory, copied once, or returned as is when there is no `moov` to pad."""
+    view = memoryview(data)
+    parts = []
+    offset = 0
+    moov_end = None
+    while (box := _parse_header(view[offset:offset + 16])) is not None:
+        type, size, header_size = box
+        if size < header_size or offset + size > len(data):
+            break
+        if moov_end is None and type == b"mdat":
+            break
+        if moov_end is None and type == b"moov":
+            moov_end = offset + size
+            payload = bytes(view[offset + header_size:moov_end])
+            parts.append(bytes(view[offset:offset + header_size]))
+            parts.append(_shift_offsets(payload, moov_end, padding) + _free_box(padding))
+            offset = moov_end
+            if not _is_fragmented(payload):
+                break
+            continue
+        if moov_end is not None and type in FRAGMENT_CONTAINERS:
+            parts.append(_shift_offsets(bytes(view[offset:offset + size]), moov_end, padding))
+        else:
+            parts.append(view[offset:offset + size])
+        offset += size
+
+    if moov_end is None:
+        return data
+    parts.append(view[offset:])
+    return b"".join(parts)
+
+
+class Mp4Tagger(FileTagger):
+    """Writes metadata into MP4 / MOV files as iTunes style `moov/udta/meta/ilst` items and an XMP `uuid` box.
+
+    Only the `moov` box and the boxes right after it are rewritten, the media data is never read.
+    When the new metadata does not fit in the space `moov` had, a padding `free` box included, `moov` is moved
+    to the end of the file and its old place freed, so `mdat` and every chunk offset stay where they are.
+    Fragmented files need `moov` first, there the rest of the file is shifted and the chunk and fragment offsets
+    adjusted, on disk only. In memory, where that would copy the whole body, they are left untagged instead.
+    Downloads are padded by `pad_moov` as they are read, so their tags fit in place and they stay fast start.
+    """
+
+    ITEMS: ClassVar[dict[str, bytes]] = {
+        "title": b"\xa9nam",
+        "artist": b"\xa9ART",
+        "date": b"\xa9day",
+        "description": b"desc",
+        "source": b"\xa9cmt",  # no standard source url item, players show the comment
+    }
+
+    @override
+    def supports(self, extension: str) -> bool:
+        return extension in (
+            ".mp4",
+            ".m4v",
+            ".mov"
+        )
+
+    @staticmethod
+    def _build_xmp(metadata: Metadata) -> bytes:
+        def lang_alt(value: str) -> str:
+            return f'<rdf:Alt><rdf:li xml:lang="x-default">{escape(value)}</rdf:li></rdf:Alt>'
+
+        def array(kind: str, values: list[str]) -> str:
+            return f"<rdf:{kind}>{"".join(f"<rdf:li>{escape(value)}</rdf:li>" for value in values)}</rdf:{kind}>"
+
+        properties = [f"<xmp:CreateDate>{datetime.now().isoformat()}</xmp:CreateDate>"]
+        if metadata.title:
+            properties.append(f"<dc:title>{lang_alt(metadata.title)}</dc:title>")
+        if metadata.artist:
+            properties.append(f"<dc:creator>{array("Seq", [metadata.artist.display_name])}</dc:creator>")
+        if metadata.created_at:
+            properties.append(f"<dc:date>{array("Seq", [metadata.created_at.isoformat()])}</dc:date>")
+        if metadata.description:
+            properties.append(f"<dc:description>{lang_alt(metadata.description)}</dc:description>")
+        if metadata.webpage_url:
+            properties.append(f"<dc:source>{escape(metadata.webpage_url)}</dc:source>")
+        if metadata.keywords:
+            properties.append(f"<dc:subject>{array("Bag", metadata.keywords)}</dc:subject>")
+        if metadata.type:
+            properties.append(f"<dc:type>{array("Bag", metadata.type)}</dc:type>")
+
+        return (
+            '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+            '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+            '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            'xmlns:xmp="http://ns.adobe.com/xap/1.0/">'
+            f'{"".join(properties)}'
+            '</rdf:Description></rdf:RDF></x:xmpmeta>'
+            '<?xpacket end="w"?>'
+        ).encode()
+
+    def _build_meta(self, metadata: Metadata) -> bytes:
+        values = {
+            "title": metadata.title,
+            "artist": metadata.artist.display_name if metadata.artist else None,
+            "date": metadata.created_at.isoformat() if metadata.created_at else None,
+            "description": metadata.description,
+            "source": metadata.webpage_url,
+        }
+        items = b"".join(
+            _box(self.ITEMS[key], _box(b"data", struct.pack(">II", 1, 0) + value.encode()))  # 1: utf-8 text
+            for key, value in values.items() if value
+        )
+        handler = struct.pack(">I4s4sII", 0, b"mdir", b"appl", 0, 0) + b"\0"
+        return _full_box(b"meta", _full_box(b"hdlr", handler) + _box(b"ilst", items))
+
+    @staticmethod
+    def _build_moov(moov_payload: bytes, meta: bytes) -> bytes:
+        output = []
+        udta = b""
+        for type, header, child in _children(moov_payload):
+            if type == b"udta":
+                udta = child
+            else:
+                output.append(header + child)
+
+        # other user data, like location, is kept
+        kept = b"".join(header + child for type, header, child in _children(udta) if type != b"meta")
+        output.append(_box(b"udta", kept + meta))
+        return b"".join(output)
+
+    @override
+    def prepare(self, metadata: Metadata) -> tuple[bytes, bytes]:
+        return self._build_meta(metadata), _box(b"uuid", XMP_UUID + self._build_xmp(metadata))
+
+    def padding(self, metadata: Metadata) -> int:
+        """The free space after `moov` needed to write the tags of `metadata` in place, `PADDING` to spare."""
+        meta, xmp = self.prepare(metadata)
+        return 8 + len(meta) + len(xmp) + PADDING  # with the udta header
+
+    def tag_stream(self, fp: BinaryIO, metadata: Metadata, *, relocate: bool = True) -> None:
+        """Tags a seekable file opened for reading and writing in place.
+
+        With `relocate`, a `moov` that outgrew its place is moved to the end of the file, otherwise the rest
+        of the file is shifted after it.
+        """
+        self._write(fp, self.prepare(metadata), relocate)
+
+    def _write(self, fp: BinaryIO, prepared: tuple[bytes, bytes], relocate: bool, shift: bool = True) -> None:
+        meta, xmp = prepared
+        boxes = _read_top_level(fp)
+        index = next((i for i, box in enumerate(boxes) if box.type == b"moov"), None)
+        if index is None:
+            raise ValueError("No moov box, not an MP4 file")
+        moov = boxes[index]
+
+        # the region rewritten, moov and the padding and XMP following it
+        region_end = moov.end
+        for box in boxes[index + 1:]:
+            if box.type not in (b"free", b"skip") and not box.is_xmp:
+                break
+            region_end = box.end
+        file_size = boxes[-1].end
+
+        fp.seek(moov.offset)
+        header_size = 16 if struct.unpack(">I", fp.read(4))[0] == 1 else 8
+        fp.seek(moov.offset + header_size)
+        moov_payload = fp.read(moov.size - header_size)
+
+        new_moov = self._build_moov(moov_payload, meta)
+        size = 8 + len(new_moov) + len(xmp)
+        available = region_end - moov.offset
+        fits = size == available or size + 8 <= available
+        fragmented = _is_fragmented(moov_payload)
+
+        if not fits and region_end != file_size and (fragmented or not relocate) and not shift:
+            logger.warning("No room for the tags before the media data, and shifting it is not allowed, left untagged.")
+            return
+
+        # XMP elsewhere in the file would be read instead of ours
+        for box in boxes:
+            if box.is_xmp and not moov.offset <= box.offset < region_end:
+                fp.seek(box.offset + 4)
+                fp.write(b"free")
+
+        if fits:
+            fp.seek(moov.offset)
+            fp.write(_box(b"moov", new_moov) + xmp)
+            if size < available:
+                fp.write(_free_box(available - size))
+        elif region_end == file_size:
+            fp.seek(moov.offset)
+            fp.write(_box(b"moov", new_moov) + xmp + _free_box(PADDING))
+            fp.truncate()
+        elif relocate and not fragmented:
+            fp.seek(moov.offset)
+            fp.write(struct.pack(">I4s", available, b"free"))
+            fp.seek(file_size)
+            fp.write(_box(b"moov", new_moov) + xmp + _free_box(PADDING))
+        else:
+            delta = size + PADDING - available
+            _copy_backward(fp, region_end, file_size, delta)
+            new_moov = _shift_offsets(new_moov, region_end, delta)
+            fp.seek(moov.offset)
+            fp.write(_box(b"moov", new_moov) + xmp + _free_box(PADDING))
+            # fragments may point at their data from the start of the file, not only from their own start
+            for box in boxes[index + 1:]:
+                if box.offset >= region_end and box.type in (b"moof", b"mfra"):
+                    fp.seek(box.offset + delta)
+                    fragment = _shift_offsets(fp.read(box.size), region_end, delta)
+                    fp.seek(box.offset + delta)
+                    fp.write(fragment)
+
+    @override
+    def tag_file_prepared(self, path: Path, prepared: tuple[bytes, bytes]) -> None:
+        with open(path, "r+b") as f:
+            self._write(f, prepared, relocate=True)
+
+    def tag_file(self, path: str | Path, metadata: Metadata) -> None:
+        self.tag_file_prepared(Path(path), self.prepare(metadata))
+
+    @override
+    def tag_prepared(self, data: bytes, prepared: tuple[bytes, bytes]) -> bytes:
+        fp = io.BytesIO(data)
+        # only the metadata region is written, the body is never shifted in memory
+        self._write(fp, prepared, relocate=True, shift=False)
+        return fp.getvalue()
+
+    @override
+    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+        return self.tag_prepared(data, self.prepare(metadata))
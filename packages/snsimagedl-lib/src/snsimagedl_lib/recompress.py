@@ -0,0 +1,195 @@
+import asyncio
+import io
+import logging
+import os
+import struct
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import Callable, ClassVar, Mapping
+
+try:
+    from PIL import Image, PngImagePlugin
+except ImportError:
+    Image = None
+
+from snsimagedl_lib.downloader import DownloadResult
+
+__all__ = (
+    "Recompressor",
+    "optimize_png",
+)
+
+logger = logging.getLogger(__name__)
+
+
+# chunks Pillow writes again from what it decoded, checked against the original after encoding
+REENCODED_CHUNKS = {b"IHDR", b"PLTE", b"IDAT", b"IEND", b"tRNS", b"iCCP", b"pHYs", b"eXIf"}
+# chunks Pillow can copy verbatim before the image data
+COPIED_CHUNKS = {b"cHRM", b"cICP", b"gAMA", b"sBIT", b"sRGB", b"tIME", b"sPLT", b"tEXt", b"zTXt", b"iTXt"}
+
+
+def _read_chunks(data: bytes) -> list[tuple[bytes, bytes]]:
+    """Reads the `(type, data)` of every chunk of a PNG, without checking their CRC."""
+    chunks = []
+    offset = 8  # the signature
+    while offset + 8 <= len(data):
+        length, type = struct.unpack_from(">I4s", data, offset)
+        chunks.append((type, data[offset + 8:offset + 8 + length]))
+        offset += 12 + length
+        if type == b"IEND":
+            break
+    return chunks
+
+
+def _ancillary(chunks: list[tuple[bytes, bytes]]) -> list[tuple[bytes, bytes]]:
+    """The chunks which have to be the same after re-encoding, the ICC profile compared uncompressed."""
+    kept = []
+    for type, data in chunks:
+        if type == b"iCCP":
+            # the profile name and compression are Pillow's own
+            kept.append((type, zlib.decompress(data[data.index(b"\0") + 2:])))
+        elif type not in (b"IHDR", b"PLTE", b"IDAT", b"IEND"):
+            kept.append((type, data))
+    return sorted(kept)
+
+
+def optimize_png(data: bytes) -> bytes | None:
+    """Re-encodes a PNG at the highest zlib level.
+
+    Returns `None` if the result would not be pixel identical, for animated PNGs, PNGs with more than 8 bits
+    per sample, which Pillow reduces, and PNGs with chunks that cannot be carried over as they are.
+    """
+    try:
+        chunks = _read_chunks(data)
+        if not chunks or chunks[0][0] != b"IHDR":
+            return None
+        ihdr = chunks[0][1]
+        if ihdr[8] > 8:  # bit depth
+            return None
+
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format != "PNG" or getattr(image, "is_animated", False):
+                return None
+            image.load()
+
+            pnginfo = PngImagePlugin.PngInfo()
+            after_idat = False
+            for type, chunk in chunks:
+                if type == b"IDAT":
+                    after_idat = True
+                elif type in COPIED_CHUNKS:
+                    pnginfo.add(type, chunk)
+                elif type[1:2].islower():  # private, kept on its side of the image data
+                    pnginfo.add(type, chunk, after_idat=after_idat)
+                elif type not in REENCODED_CHUNKS:
+                    return None
+
+            present = {type for type, _ in chunks}
+            options = {
+                key: image.info[key]
+                for key, type in (
+                    ("icc_profile", b"iCCP"),
+                    ("transparency", b"tRNS"),
+                    ("dpi", b"pHYs"),
+                    ("exif", b"eXIf")
+                )
+                if type in present and key in image.info
+            }
+
+            output = io.BytesIO()
+            image.save(output, "PNG", optimize=True, pnginfo=pnginfo, **options)
+            optimized = output.getvalue()
+
+            # never trust a re-encode to be lossless, decode it back and compare
+            optimized_chunks = _read_chunks(optimized)
+            if _ancillary(optimized_chunks) != _ancillary(chunks):
+                return None
+            color_type = ihdr[9]
+            if color_type != 3 and optimized_chunks[0][1][8:10] != ihdr[8:10]:  # palettes may use fewer bits
+                return None
+            with Image.open(io.BytesIO(optimized)) as check:
+                if check.mode != image.mode or check.size != image.size:
+                    return None
+                if image.mode == "P":
+                    # the palette may be trimmed to the colours used, compare the colours instead of the indices
+                    if check.convert("RGBA").tobytes() != image.convert("RGBA").tobytes():
+                        return None
+                elif check.tobytes() != image.tobytes():
+                    return None
+    except OSError, ValueError, SyntaxError, IndexError, struct.error, zlib.error:
+        return None
+    return optimized
+
+
+def _lower_priority(niceness: int) -> None:
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+
+class Recompressor:
+    """Losslessly re-encodes poorly compressed images before they are tagged and saved.
+
+    Encoding runs in `max_workers` worker processes, started with `niceness` added to their priority,
+    so a backlog of large PNGs cannot starve the bot. Results are only kept when smaller.
+    """
+
+    OPTIMIZERS: ClassVar[Mapping[str, Callable[[bytes], bytes | None]]] = {
+        ".png": optimize_png,
+    }
+
+    def __init__(self, *, max_workers: int = 1, niceness: int = 10, min_size: int = 64 * 1024):
+        if Image is None:
+            raise ImportError("Recompression requires Pillow, install snsimagedl-lib[recompress].")
+
+        self.max_workers = max_workers
+        self.niceness = niceness
+        self.min_size = min_size  # smaller files are not worth a round trip to a worker
+        self.process_pool: ProcessPoolExecutor | None = None  # started on the first image
+
+        self.saved: Counter[str] = Counter()  # bytes, by extractor
+        self.recompressed: Counter[str] = Counter()  # files, by extractor
+
+    def supports(self, extension: str) -> bool:
+        return extension.lower() in self.OPTIMIZERS
+
+    async def recompress(self, downloaded: DownloadResult) -> DownloadResult:
+        extension = downloaded.query.metadata.file_extension.lower()
+        if extension not in self.OPTIMIZERS or downloaded.file is not None or len(downloaded.data) < self.min_size:
+            return downloaded
+
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_lower_priority,
+                initargs=(self.niceness,)
+            )
+        optimized = await asyncio.get_running_loop().run_in_executor(
+            self.process_pool,
+            self.OPTIMIZERS[extension],
+            downloaded.data
+        )
+
+        if optimized is None or len(optimized) >= len(downloaded.data):
+            return downloaded
+
+        extractor = downloaded.query.extractor.__class__.__name__
+        self.saved[extractor] += len(downloaded.data) - len(optimized)
+        self.recompressed[extractor] += 1
+        logger.debug(
+            f"Recompressed {downloaded.query.metadata.filename}: {len(downloaded.data)} -> {len(optimized)} bytes"
+        )
+        return replace(downloaded, data=optimized)
+
+    def report(self) -> str:
+        if not self.saved:
+            return "Nothing recompressed yet."
+        return "\n".join(
+            f"{extractor}: {self.saved[extractor] / 2 ** 20:.2f} MiB saved over {self.recompressed[extractor]} files"
+            for extractor, _ in self.saved.most_common()
+        )
+
+    def close(self) -> None:
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
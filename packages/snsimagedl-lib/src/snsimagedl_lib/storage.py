@@ -0,0 +1,111 @@
+import shutil
+from pathlib import Path
+from typing import Protocol, override
+
+from snsimagedl_lib.validators import Validators
+
+__all__ = (
+    "StorageBackend",
+    "LooseFileStorage",
+)
+
+
+class StorageBackend(Protocol):
+    """Where saved media end up. Keys are the formatted output paths, e.g. `media/twitter/123_0.jpg`."""
+
+    def exists(self, key: str) -> bool:
+        raise NotImplemented
+
+    def read(self, key: str) -> bytes:
+        raise NotImplemented
+
+    def size(self, key: str) -> int:
+        raise NotImplemented
+
+    def write(self, key: str, data: bytes, validators: Validators | None = None) -> None:
+        raise NotImplemented
+
+    def write_file(self, key: str, path: Path, validators: Validators | None = None) -> None:
+        """Stores the temporary file at `path`, which may be moved. Reads it whole unless the backend overrides this."""
+        self.write(key, path.read_bytes(), validators)
+
+    def link(self, key: str, target: str) -> None:
+        """Makes `key` refer to the data already saved at `target`, without storing it again."""
+        raise NotImplemented
+
+    def delete(self, key: str) -> bool:
+        raise NotImplemented
+
+    def load_validators(self, key: str) -> Validators | None:
+        raise NotImplemented
+
+    def flush_due(self) -> bool:
+        """Whether enough writes are buffered, or for long enough, that `flush` should be called."""
+        return False
+
+    def flush(self) -> None:
+        """Makes the writes so far durable, for backends that batch them."""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class LooseFileStorage(StorageBackend):
+    """One file per media, at its key. Validators are kept in a sidecar file next to it."""
+
+    @override
+    def exists(self, key: str) -> bool:
+        return Path(key).exists()
+
+    @override
+    def read(self, key: str) -> bytes:
+        return Path(key).read_bytes()
+
+    @override
+    def size(self, key: str) -> int:
+        return Path(key).stat().st_size
+
+    @override
+    def write(self, key: str, data: bytes, validators: Validators | None = None) -> None:
+        path = Path(key)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_bytes(data)
+
+        if validators is not None and not validators.is_empty:
+            validators.size = len(data)
+            validators.save(path)
+
+    @override
+    def write_file(self, key: str, path: Path, validators: Validators | None = None) -> None:
+        target = Path(key)
+        target.parent.mkdir(exist_ok=True, parents=True)
+        shutil.move(path, target)  # a rename, unless the temporary directory is on another file system
+
+        if validators is not None and not validators.is_empty:
+            validators.size = target.stat().st_size
+            validators.save(target)
+
+    @override
+    def link(self, key: str, target: str) -> None:
+        path = Path(key)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.unlink(missing_ok=True)
+        try:
+            path.hardlink_to(target)
+        except OSError:  # across file systems
+            path.symlink_to(Path(target).absolute())
+
+    @override
+    def delete(self, key: str) -> bool:
+        path = Path(key)
+        Validators.sidecar_path(path).unlink(missing_ok=True)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+    @override
+    def load_validators(self, key: str) -> Validators | None:
+        return Validators.load(key)
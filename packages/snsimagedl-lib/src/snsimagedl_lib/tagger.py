@@ -1,4 +1,6 @@
-from typing import Protocol, override
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Collection, Protocol, Self, override
 from datetime import datetime
 
 from pyexiv2 import ImageData
@@ -9,7 +11,8 @@ __all__ = (
     "FileTagger",
     "ExifTagger",
     "XmpTagger",
-    "JpegCommentTagger"
+    "JpegCommentTagger",
+    "PreparedTags",
 )
 
 
@@ -17,10 +20,44 @@ class FileTagger(Protocol):
     def supports(self, extension: str) -> bool:
         raise NotImplemented
 
+    def prepare(self, metadata: Metadata) -> Any:
+        """Builds what is written for a post once, to be reused by every file of it. Must be picklable."""
+        return metadata
+
+    def tag_prepared(self, data: bytes, prepared: Any) -> bytes:
+        return self.tag(data, prepared)
+
+    def tag_file_prepared(self, path: Path, prepared: Any) -> None:
+        """Tags a file in place. Taggers able to tag without reading the whole file in memory override this."""
+        path.write_bytes(self.tag_prepared(path.read_bytes(), prepared))
+
     def tag(self, data: bytes, metadata: Metadata) -> bytes:
         raise NotImplemented
 
 
+@dataclass(slots=True, frozen=True)
+class PreparedTags:
+    """The payloads of every tagger for a post, shared by all its files and sent as-is to worker processes."""
+    taggers: tuple[FileTagger, ...]
+    payloads: tuple[Any, ...]
+
+    @classmethod
+    def prepare(cls, taggers: Collection[FileTagger], metadata: Metadata) -> Self:
+        taggers = tuple(taggers)
+        return cls(taggers, tuple(tagger.prepare(metadata) for tagger in taggers))
+
+    def tag(self, data: bytes, extension: str) -> bytes:
+        for tagger, payload in zip(self.taggers, self.payloads):
+            if tagger.supports(extension):
+                data = tagger.tag_prepared(data, payload)
+        return data
+
+    def tag_file(self, path: Path, extension: str) -> None:
+        for tagger, payload in zip(self.taggers, self.payloads):
+            if tagger.supports(extension):
+                tagger.tag_file_prepared(path, payload)
+
+
 class ExifTagger(FileTagger):
     @override
     def supports(self, extension: str) -> bool:
@@ -35,22 +72,32 @@ class ExifTagger(FileTagger):
         )
 
     @override
-    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+    def prepare(self, metadata: Metadata) -> dict[str, Any]:
+        # prepared for every post, whether it has files this tagger supports or not, `None` removes the tag
+        artist = metadata.artist
+        keywords = ";".join(metadata.keywords) if metadata.keywords else None
+        return {
+            "Exif.Image.DateTime": metadata.created_at,
+            "Exif.Image.Artist": artist.handle if artist else None,
+            "Exif.Image.XPTitle": metadata.title,
+            "Exif.Image.XPComment": metadata.description,
+            "Exif.Image.XPAuthor": artist.display_name if artist else None,
+            "Exif.Image.XPKeywords": keywords,
+            "Exif.Image.XPSubject": keywords,
+            "Exif.Photo.UserComment": metadata.description,
+            "Exif.Photo.DateTimeOriginal": metadata.created_at
+        }
+
+    @override
+    def tag_prepared(self, data: bytes, prepared: dict[str, Any]) -> bytes:
         with ImageData(data) as img:
-            exif = {
-                "Exif.Image.DateTime": metadata.created_at,
-                "Exif.Image.Artist": metadata.artist.handle,
-                "Exif.Image.XPTitle": metadata.title,
-                "Exif.Image.XPComment": metadata.description,
-                "Exif.Image.XPAuthor": metadata.artist.display_name,
-                "Exif.Image.XPKeywords": ";".join(metadata.keywords),
-                "Exif.Image.XPSubject": ";".join(metadata.keywords),
-                "Exif.Photo.UserComment": metadata.description,
-                "Exif.Photo.DateTimeOriginal": metadata.created_at
-            }
-            img.modify_exif(exif)
+            img.modify_exif(prepared)
             return img.get_bytes()
 
+    @override
+    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+        return self.tag_prepared(data, self.prepare(metadata))
+
 
 class XmpTagger(FileTagger):
     @override
@@ -68,22 +115,30 @@ class XmpTagger(FileTagger):
         )
 
     @override
-    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+    def prepare(self, metadata: Metadata) -> dict[str, Any]:
+        artist = metadata.artist
+        return {
+            "Xmp.xmp.CreateDate": datetime.now(),
+            "Xmp.dc.creator": artist.display_name if artist else None,
+            "Xmp.dc.date": metadata.created_at,
+            "Xmp.dc.description": metadata.description,
+            "Xmp.dc.source": metadata.webpage_url,
+            "Xmp.dc.title": metadata.title,
+            "Xmp.dc.subject": metadata.keywords,
+            "Xmp.dc.type": metadata.type,
+            "Xmp.Iptc4xmpCore.CreatorContactInfo": artist.webpage_url if artist else None
+        }
+
+    @override
+    def tag_prepared(self, data: bytes, prepared: dict[str, Any]) -> bytes:
         with ImageData(data) as img:
-            xmp = {
-                "Xmp.xmp.CreateDate": datetime.now(),
-                "Xmp.dc.creator": metadata.artist.display_name,
-                "Xmp.dc.date": metadata.created_at,
-                "Xmp.dc.description": metadata.description,
-                "Xmp.dc.source": metadata.webpage_url,
-                "Xmp.dc.title": metadata.title,
-                "Xmp.dc.subject": metadata.keywords,
-                "Xmp.dc.type": metadata.type,
-                "Xmp.Iptc4xmpCore.CreatorContactInfo": metadata.artist.webpage_url
-            }
-            img.modify_xmp(xmp)
+            img.modify_xmp(prepared)
             return img.get_bytes()
 
+    @override
+    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+        return self.tag_prepared(data, self.prepare(metadata))
+
 
 class JpegCommentTagger(FileTagger):
     @override
@@ -94,7 +149,17 @@ class JpegCommentTagger(FileTagger):
         )
 
     @override
-    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+    def prepare(self, metadata: Metadata) -> str | None:
+        return metadata.description
+
+    @override
+    def tag_prepared(self, data: bytes, prepared: str | None) -> bytes:
+        if prepared is None:
+            return data
         with ImageData(data) as img:
-            img.modify_comment(metadata.description)
+            img.modify_comment(prepared)
             return img.get_bytes()
+
+    @override
+    def tag(self, data: bytes, metadata: Metadata) -> bytes:
+        return self.tag_prepared(data, self.prepare(metadata))
@@ -0,0 +1,62 @@
+import json
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Mapping, Self
+
+__all__ = (
+    "Validators",
+)
+
+
+@dataclass(slots=True)
+class Validators:
+    """The HTTP cache validators of a saved file, used to revalidate it instead of downloading it again.
+
+    Extractors send them as a conditional request, raise `NotModified` on a 304,
+    and otherwise update them in place from the response.
+    """
+    etag: str | None = None
+    last_modified: str | None = None
+    size: int | None = None  # size of the saved file, to tell if it has been changed since
+
+    @staticmethod
+    def sidecar_path(path: Path) -> Path:
+        return path.with_name(f"{path.name}.validators.json")
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self | None:
+        """Reads the validators saved next to `path`, if the file is still the one they were saved for."""
+        if not isinstance(path, Path):
+            path = Path(path)
+
+        try:
+            validators = cls(**json.loads(cls.sidecar_path(path).read_bytes()))
+            size = path.stat().st_size
+        except OSError, ValueError, TypeError:
+            return None
+
+        if validators.size != size:
+            return None
+        return validators
+
+    def save(self, path: str | Path) -> None:
+        if not isinstance(path, Path):
+            path = Path(path)
+
+        self.sidecar_path(path).write_text(json.dumps(asdict(self)))
+
+    @property
+    def is_empty(self) -> bool:
+        return self.etag is None and self.last_modified is None
+
+    def to_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
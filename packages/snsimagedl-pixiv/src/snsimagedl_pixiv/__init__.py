@@ -1 +1,2 @@
-from .extractor import *
\ No newline at end of file
+from .extractor import *
+from .ugoira import *
@@ -2,16 +2,29 @@ import asyncio
 import functools
 import logging
 import re
-from io import BytesIO
-from typing import override, Iterable, Collection
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager, AbstractAsyncContextManager
+from typing import override, Iterable, Collection, ClassVar, Any, AsyncIterator, Callable
 
+import aiohttp
 import msgspec
 from pixivpy3 import AppPixivAPI, PixivError
 from yarl import URL
 
-from snsimagedl_lib import Extractor, Metadata, ArtistMetadata
-from snsimagedl_lib.exceptions import UnsupportedLink
-from snsimagedl_pixiv.models import IllustDetails, MetaSinglePage
+from snsimagedl_lib import Extractor, Metadata, ArtistMetadata, Validators, MediaStream
+from snsimagedl_lib.exceptions import UnsupportedLink, NotModified
+from snsimagedl_pixiv.models import (
+    IllustDetails,
+    IllustDetailResponse,
+    IllustListResponse,
+    MetaSinglePage,
+    SlimIllustDetails,
+    SlimIllustDetailResponse,
+    SlimIllustListResponse,
+    UgoiraDetails,
+    UgoiraMetadataResponse
+)
+from snsimagedl_pixiv.ugoira import UgoiraMetadata, UgoiraFormat, assemble_ugoira
 
 __all__ = (
     "PixivExtractor",
@@ -22,89 +35,279 @@ logger = logging.getLogger(__name__)
 
 class PixivExtractor(Extractor):
     URL_PATTERN: re.Pattern = re.compile(r"https://.*p.?ixiv.net/.*artworks/([0-9]+)")
+    # works of an artist, all or only illustrations / manga, or their public (`?rest=show`) or private bookmarks
+    LISTING_PATTERN: ClassVar[re.Pattern] = re.compile(
+        r"https://.*p.?ixiv.net/(?:[a-z]{2}/)?users/([0-9]+)(?:/(illustrations|manga|artworks|bookmarks/artworks))?/?"
+        r"(?:\?.*)?$"
+    )
+
+    DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(SlimIllustDetailResponse, strict=False)
+    FULL_DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(IllustDetailResponse, strict=False)
+    UGOIRA_DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(UgoiraMetadataResponse, strict=False)
+    LIST_DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(SlimIllustListResponse, strict=False)
+    FULL_LIST_DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(IllustListResponse, strict=False)
+
+    # i.pximg.net refuses requests without a pixiv referer
+    IMAGE_HEADERS: ClassVar[dict[str, str]] = {"Referer": "https://app-api.pixiv.net/"}
 
-    def __init__(self, refresh_token: str):
+    def __init__(
+            self,
+            refresh_token: str,
+            *,
+            full_models: bool = False,
+            max_connections: int = 8,
+            ugoira_format: UgoiraFormat = "webp"
+    ):
         self.refresh_token = refresh_token
         self.loop = asyncio.get_running_loop()
+        self.decoder = self.FULL_DECODER if full_models else self.DECODER
+        self.list_decoder = self.FULL_LIST_DECODER if full_models else self.LIST_DECODER
+        self.ugoira_format = ugoira_format
+        self.process_pool: ProcessPoolExecutor | None = None  # started on the first ugoira
 
         self.session = AppPixivAPI(timeout=3)
         self.session.auth(refresh_token=refresh_token)
 
+        # pooled keep-alive connections to i.pximg.net, so every page of a manga is fetched at once
+        self.image_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=max_connections),
+            headers=self.IMAGE_HEADERS
+        )
+
     def _get_illust_id(self, url: str) -> str:
         res = self.URL_PATTERN.search(url)
         if not res:
             raise UnsupportedLink(f"{url} is not a Pixiv link.")
         return res[1]
 
-    async def _fetch(self, illust_id: str) -> IllustDetails:
+    def _get_listing(self, url: str) -> tuple[str, dict[str, str]]:
+        """The endpoint and parameters of the first page of a listing."""
+        res = self.LISTING_PATTERN.search(url)
+        if not res:
+            raise UnsupportedLink(f"{url} is not a Pixiv user or bookmarks link.")
+
+        user_id, kind = res[1], res[2]
+        match kind:
+            case "bookmarks/artworks":
+                restrict = "private" if URL(url).query.get("rest") == "hide" else "public"
+                return "/v1/user/bookmarks/illust", {"user_id": user_id, "restrict": restrict}
+            case "illustrations":
+                return "/v1/user/illusts", {"user_id": user_id, "type": "illust"}
+            case "manga":
+                return "/v1/user/illusts", {"user_id": user_id, "type": "manga"}
+            case _:
+                return "/v1/user/illusts", {"user_id": user_id}  # both
+
+    async def _request[T](
+            self,
+            url: str,
+            params: dict[str, str] | None,
+            decoder: msgspec.json.Decoder[T]
+    ) -> T | None:
         for i in range(3):
             try:
-                json_result = await self.loop.run_in_executor(
+                # same requests as `AppPixivAPI`, minus parsing the body into python dicts
+                res = await self.loop.run_in_executor(
                     None,
-                    self.session.illust_detail,
-                    illust_id, True
+                    functools.partial(self.session.no_auth_requests_call, "GET", url, params=params)
                 )
             except TimeoutError:
-                logger.exception(f"Timeout when retrieving illustration {illust_id}")
+                logger.exception(f"Timeout when requesting {url}")
             else:
-                if "error" in json_result and "invalid_grant" in json_result["error"]["message"]:
+                try:
+                    response = decoder.decode(res.content)
+                except msgspec.DecodeError as e:
+                    # an HTML or error page, raised like pixivpy's own parsing does
+                    raise PixivError(f"Invalid response from {url}: {e}", header=res.headers, body=res.text) from e
+                if response.error is not None and "invalid_grant" in response.error.message:
                     self.session.auth()
                     continue
-                return msgspec.convert(json_result["illust"], type=IllustDetails, strict=False)
-        raise PixivError(f"Error in retrieving illustration {illust_id}")
+                return response
+        return None
+
+    async def _fetch(self, illust_id: str) -> SlimIllustDetails | IllustDetails:
+        response = await self._request(
+            f"{self.session.hosts}/v1/illust/detail",
+            {"illust_id": illust_id},
+            self.decoder
+        )
+        if response is None or response.illust is None:
+            raise PixivError(f"Error in retrieving illustration {illust_id}")
+        return response.illust
+
+    async def _fetch_ugoira(self, illust_id: str) -> UgoiraDetails:
+        response = await self._request(
+            f"{self.session.hosts}/v1/ugoira/metadata",
+            {"illust_id": illust_id},
+            self.UGOIRA_DECODER
+        )
+        if response is None or response.ugoira_metadata is None:
+            raise PixivError(f"Error in retrieving ugoira metadata {illust_id}")
+        return response.ugoira_metadata
 
     @staticmethod
-    def _get_source_urls(illust: IllustDetails) -> Iterable[str]:
+    def _get_source_urls(illust: SlimIllustDetails | IllustDetails) -> Iterable[str]:
         match illust:  # noqa
-            case IllustDetails(type="illust", meta_single_page=page, meta_pages=[]):
-                yield page.original_image_url
-            case IllustDetails(type="illust", meta_single_page=MetaSinglePage(original_image_url=None),
-                               meta_pages=pages):
+            # hidden and deleted works are listed without any url, and yield nothing
+            case SlimIllustDetails(type="illust" | "manga",
+                                   meta_single_page=MetaSinglePage(original_image_url=str() as url), meta_pages=[]) \
+                 | IllustDetails(type="illust" | "manga",
+                                 meta_single_page=MetaSinglePage(original_image_url=str() as url), meta_pages=[]):
+                yield url
+            case SlimIllustDetails(type="illust" | "manga", meta_single_page=MetaSinglePage(original_image_url=None),
+                                   meta_pages=pages) \
+                 | IllustDetails(type="illust" | "manga", meta_single_page=MetaSinglePage(original_image_url=None),
+                                 meta_pages=pages):
                 for page in pages:
                     yield page.image_urls.original
-            case IllustDetails(type="ugoira"):
-                # TODO: related issues: https://github.com/upbit/pixivpy/issues/164, https://github.com/upbit/pixivpy/issues/253
-                raise NotImplementedError("Ugoira is a bit iffy to make. will do sometime")
             case _:
                 logger.error(f"Unexpected type. Raw dump: {msgspec.json.encode(illust)}")
                 raise NotImplementedError
 
-    @override
-    async def query(self, query: str) -> Collection[Metadata] | None:
-        illust_id = self._get_illust_id(query)
+    @staticmethod
+    def _get_post_metadata(illust: SlimIllustDetails | IllustDetails, webpage_url: str) -> dict[str, Any]:
+        """The metadata shared by every page of the post."""
+        return dict(
+            webpage_url=webpage_url,
+            title=illust.title,
+            description=illust.caption.replace("<br />", "\n"),
+            created_at=illust.create_date,
+            artist=ArtistMetadata(
+                handle=illust.user.account,
+                display_name=illust.user.name,
+                webpage_url=f"https://www.pixiv.net/users/{illust.user.id}"
+            ),
+            keywords=[tag.name for tag in illust.tags]
+        )
+
+    async def _query_ugoira(self, illust: SlimIllustDetails | IllustDetails, webpage_url: str) -> UgoiraMetadata:
+        ugoira = await self._fetch_ugoira(str(illust.id))
+        extension = "png" if self.ugoira_format == "apng" else self.ugoira_format
 
-        illust = await self._fetch(illust_id)
+        return UgoiraMetadata(
+            filename=f"{illust.id}_ugoira.{extension}",
+            source_url=ugoira.zip_urls.medium.replace("ugoira600x600", "ugoira1920x1080"),
+            frames=tuple((frame.file, frame.delay) for frame in ugoira.frames),
+            format=self.ugoira_format,
+            **self._get_post_metadata(illust, webpage_url)
+        )
+
+    async def _get_metadata(self, illust: SlimIllustDetails | IllustDetails, webpage_url: str) -> list[Metadata]:
+        if illust.type == "ugoira":
+            return [await self._query_ugoira(illust, webpage_url)]
+
+        post_metadata = self._get_post_metadata(illust, webpage_url)
         results = []
         for source_url in self._get_source_urls(illust):
             results.append(Metadata(
                 filename=URL(source_url).name,
                 source_url=source_url,
-                webpage_url=query,
-                title=illust.title,
-                description=illust.caption.replace("<br />", "\n"),
-                created_at=illust.create_date,
-                artist=ArtistMetadata(
-                    handle=illust.user.account,
-                    display_name=illust.user.name,
-                    webpage_url=f"https://www.pixiv.net/users/{illust.user.id}"
-                ),
-                keywords=[tag.name for tag in illust.tags]
+                **post_metadata
             ))
         return results
 
     @override
-    async def download(self, media: Metadata) -> bytes:
-        with BytesIO() as f:
+    async def query(self, query: str) -> Collection[Metadata] | None:
+        illust_id = self._get_illust_id(query)
+        return await self._get_metadata(await self._fetch(illust_id), query)
+
+    async def _fetch_page(self, url: str, params: dict[str, str] | None) -> SlimIllustListResponse | IllustListResponse:
+        response = await self._request(url, params, self.list_decoder)
+        if response is None or response.error is not None:
+            raise PixivError(f"Error in retrieving {url}: {response.error.message if response else "no response"}")
+        return response
+
+    async def _crawl(
+            self,
+            endpoint: str,
+            params: dict[str, str],
+            archived: Callable[[Metadata], bool] | None
+    ) -> AsyncIterator[list[Metadata]]:
+        page = await self._fetch_page(f"{self.session.hosts}{endpoint}", params)
+        while True:
+            # the next page loads while the works of this one are queried and downloaded
+            next_page = asyncio.ensure_future(self._fetch_page(page.next_url, None)) if page.next_url else None
             try:
-                await self.loop.run_in_executor(
-                    None,
-                    functools.partial(
-                        self.session.download,
-                        url=media.source_url,
-                        fname=f
-                    )
-                )  # noqa
-                return f.getvalue()
-            except PixivError:
-                logger.exception(f"Download for {media.source_url} failed.")
-                raise
+                for illust in page.illusts:
+                    try:
+                        post = await self._get_metadata(illust, f"https://www.pixiv.net/artworks/{illust.id}")
+                    except NotImplementedError, PixivError:
+                        logger.warning(f"Skipping work {illust.id}, its media could not be listed.")
+                        continue
+
+                    if not post:  # hidden or deleted, listed without any image
+                        continue
+                    if archived is not None and archived(post[0]):
+                        logger.info(f"Reached the already archived work {illust.id}, stopping.")
+                        return
+                    yield post
+
+                if next_page is None:
+                    return
+                page = await next_page
+            finally:
+                if next_page is not None and not next_page.done():
+                    next_page.cancel()
+
+    @override
+    def crawl(
+            self,
+            query: str,
+            *,
+            archived: Callable[[Metadata], bool] | None = None
+    ) -> AsyncIterator[list[Metadata]]:
+        endpoint, params = self._get_listing(query)
+        return self._crawl(endpoint, params, archived)
+
+    @asynccontextmanager
+    async def _open(self, url: str, validators: Validators | None) -> AsyncIterator[aiohttp.ClientResponse]:
+        try:
+            async with self.image_session.get(url, headers=validators.to_headers() if validators else None) as res:
+                if res.status == 304:
+                    raise NotModified
+                res.raise_for_status()
+                if validators is not None:
+                    validators.update(res.headers)
+                yield res
+        except aiohttp.ClientError:
+            logger.exception(f"Download for {url} failed.")
+            raise
+
+    async def _download(self, url: str, validators: Validators | None = None) -> bytes:
+        async with self._open(url, validators) as res:
+            return await res.read()
+
+    async def _download_ugoira(self, media: UgoiraMetadata, validators: Validators | None = None) -> bytes:
+        archive = await self._download(media.source_url, validators)  # revalidates the zip, skipping the assembly
+
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(max_workers=1)
+        # decoding and encoding every frame is cpu bound, keep it off the event loop
+        return await self.loop.run_in_executor(
+            self.process_pool,
+            assemble_ugoira,
+            archive, media.frames, media.format
+        )
+
+    @override
+    async def download(self, media: Metadata, validators: Validators | None = None) -> bytes:
+        if isinstance(media, UgoiraMetadata):
+            return await self._download_ugoira(media, validators)
+        return await self._download(media.source_url, validators)
+
+    @asynccontextmanager
+    async def _stream(self, url: str, validators: Validators | None) -> AsyncIterator[MediaStream]:
+        async with self._open(url, validators) as res:
+            yield MediaStream(res.content_length, res.content.iter_any())
+
+    @override
+    def stream(self, media: Metadata, validators: Validators | None = None) -> AbstractAsyncContextManager[MediaStream]:
+        if isinstance(media, UgoiraMetadata):
+            raise NotImplementedError  # assembled from the frames
+        return self._stream(media.source_url, validators)
+
+    @override
+    async def close(self) -> None:
+        await self.image_session.close()
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
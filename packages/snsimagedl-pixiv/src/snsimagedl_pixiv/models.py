@@ -10,7 +10,18 @@ __all__ = (
     "Series",
     "MetaSinglePage",
     "MetaPage",
-    "IllustDetails"
+    "IllustDetails",
+    "Error",
+    "IllustDetailResponse",
+    "IllustListResponse",
+    "SlimUser",
+    "SlimTag",
+    "SlimIllustDetails",
+    "SlimIllustDetailResponse",
+    "SlimIllustListResponse",
+    "UgoiraFrame",
+    "UgoiraDetails",
+    "UgoiraMetadataResponse",
 )
 
 
@@ -51,7 +62,7 @@ class MetaPage(Struct):
 class IllustDetails(Struct, kw_only=True):
     id: int
     title: str | Literal["無題", "no title"]  # prob more no title literals for other language, kr, zh
-    type: Literal["illust", "ugoira"]
+    type: Literal["illust", "manga", "ugoira"]
     image_urls: ImageUrls
     caption: str  # description
     restrict: int
@@ -76,3 +87,76 @@ class IllustDetails(Struct, kw_only=True):
     illust_book_style: int
     total_comments: int | None = None
     restriction_attributes: list[str] = []
+
+
+class Error(Struct):
+    message: str = ""
+    user_message: str = ""
+    reason: str = ""
+
+
+class IllustDetailResponse(Struct):
+    illust: IllustDetails | None = None
+    error: Error | None = None
+
+
+class IllustListResponse(Struct):
+    """A page of `/v1/user/illusts` or `/v1/user/bookmarks/illust`, newest first."""
+    illusts: list[IllustDetails] = []
+    next_url: str | None = None
+    error: Error | None = None
+
+
+class UgoiraFrame(Struct):
+    file: str  # file name in the zip
+    delay: int  # ms
+
+
+class UgoiraDetails(Struct):
+    class ZipUrls(Struct):
+        medium: str  # 600x600 zip, the original size one is at the same url with "ugoira1920x1080"
+
+    zip_urls: ZipUrls
+    frames: list[UgoiraFrame]
+
+
+class UgoiraMetadataResponse(Struct):
+    ugoira_metadata: UgoiraDetails | None = None
+    error: Error | None = None
+
+
+# Trimmed down variants holding only the fields `PixivExtractor.query` reads.
+# msgspec skips unknown fields without building them, so decoding into these is much cheaper.
+# The full models above are kept for debugging and reference.
+
+class SlimUser(Struct):
+    id: int
+    name: str  # display name
+    account: str  # account handle
+
+
+class SlimTag(Struct):
+    name: str
+
+
+class SlimIllustDetails(Struct, kw_only=True):
+    id: int
+    title: str
+    type: Literal["illust", "manga", "ugoira"]
+    caption: str  # description
+    user: SlimUser
+    tags: list[SlimTag]
+    create_date: datetime  # YYYY-MM-DDTHH:mm:ss+TZ:00
+    meta_single_page: MetaSinglePage
+    meta_pages: list[MetaPage] = []
+
+
+class SlimIllustDetailResponse(Struct):
+    illust: SlimIllustDetails | None = None
+    error: Error | None = None
+
+
+class SlimIllustListResponse(Struct):
+    illusts: list[SlimIllustDetails] = []
+    next_url: str | None = None
+    error: Error | None = None
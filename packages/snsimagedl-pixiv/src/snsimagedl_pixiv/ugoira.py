@@ -0,0 +1,149 @@
+import struct
+import zipfile
+import zlib
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Literal, Iterator, IO
+
+from PIL import Image
+
+from snsimagedl_lib import Metadata
+
+__all__ = (
+    "UgoiraMetadata",
+    "assemble_ugoira",
+)
+
+type Frame = tuple[str, int]  # file name in the archive, delay in ms
+type UgoiraFormat = Literal["webp", "apng"]
+
+
+@dataclass(slots=True, frozen=True)
+class UgoiraMetadata(Metadata):
+    frames: tuple[Frame, ...] = ()
+    format: UgoiraFormat = "webp"
+
+
+def _get_mode(archive: zipfile.ZipFile, frames: tuple[Frame, ...]) -> str:
+    """Picks a single mode for all frames from the first one, as the encoders need every frame to match."""
+    with archive.open(frames[0][0]) as f, Image.open(f) as img:
+        return "RGBA" if img.has_transparency_data else "RGB"
+
+
+def _read_frames(archive: zipfile.ZipFile, frames: tuple[Frame, ...], mode: str) -> Iterator[Image.Image]:
+    """Decodes the frames one at a time, only the current frame is ever held in memory."""
+    for file, _ in frames:
+        with archive.open(file) as f, Image.open(f) as img:
+            yield img.convert(mode)
+
+
+class _LazyFrames(Image.Image):
+    """A multi-frame image decoding its frames from the archive on `seek`.
+
+    Pillow's animated WebP encoder walks frames with `seek`, so this feeds it frame by frame
+    instead of handing it a list of fully decoded images.
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, frames: tuple[Frame, ...]):
+        super().__init__()
+        self.archive = archive
+        self.frames = frames
+        self.frame_mode = _get_mode(archive, frames)
+        self.n_frames = len(frames)
+        self.is_animated = self.n_frames > 1
+        self._frame = -1
+        self.seek(0)
+
+    def seek(self, frame: int) -> None:
+        if frame == self._frame:
+            return
+
+        img = next(_read_frames(self.archive, self.frames[frame:frame + 1], self.frame_mode))
+        self.im = img.im
+        self._size = img.size
+        self._mode = img.mode
+        self._frame = frame
+
+    def tell(self) -> int:
+        return self._frame
+
+
+def _write_webp(archive: zipfile.ZipFile, frames: tuple[Frame, ...], fp: IO[bytes]) -> None:
+    _LazyFrames(archive, frames).save(
+        fp,
+        format="WEBP",
+        save_all=True,
+        duration=[delay for _, delay in frames],
+        loop=0,
+        lossless=True
+    )
+
+
+def _png_chunks(data: bytes) -> Iterator[tuple[bytes, bytes]]:
+    offset = 8  # png signature
+    while offset < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+        yield chunk_type, data[offset + 8:offset + 8 + length]
+        offset += length + 12  # length, type, crc
+
+
+def _write_png_chunk(fp: IO[bytes], chunk_type: bytes, data: bytes) -> None:
+    fp.write(struct.pack(">I", len(data)))
+    fp.write(chunk_type)
+    fp.write(data)
+    fp.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
+def _write_apng(archive: zipfile.ZipFile, frames: tuple[Frame, ...], fp: IO[bytes]) -> None:
+    # Pillow's APNG writer keeps every frame around to diff them, so each frame is encoded as a plain PNG
+    # and its IDAT chunks are written out as APNG frame data straight away.
+    # https://wiki.mozilla.org/APNG_Specification
+    fp.write(b"\x89PNG\r\n\x1a\n")
+
+    sequence = 0
+    mode = _get_mode(archive, frames)
+    for index, ((_, delay), img) in enumerate(zip(frames, _read_frames(archive, frames, mode))):
+        with BytesIO() as buffer:
+            img.save(buffer, format="PNG")
+            chunks = list(_png_chunks(buffer.getvalue()))
+
+        if index == 0:
+            _write_png_chunk(fp, b"IHDR", next(data for chunk_type, data in chunks if chunk_type == b"IHDR"))
+            _write_png_chunk(fp, b"acTL", struct.pack(">II", len(frames), 0))  # loop forever
+
+        _write_png_chunk(fp, b"fcTL", struct.pack(
+            ">IIIIIHHBB",
+            sequence,
+            img.width, img.height,
+            0, 0,  # x, y offset
+            delay, 1000,  # delay in ms
+            0, 0  # dispose none, blend source
+        ))
+        sequence += 1
+
+        for chunk_type, data in chunks:
+            if chunk_type != b"IDAT":
+                continue
+            if index == 0:
+                _write_png_chunk(fp, b"IDAT", data)
+            else:
+                _write_png_chunk(fp, b"fdAT", struct.pack(">I", sequence) + data)
+                sequence += 1
+
+    _write_png_chunk(fp, b"IEND", b"")
+
+
+def assemble_ugoira(archive: bytes, frames: tuple[Frame, ...], format: UgoiraFormat = "webp") -> bytes:
+    """Assembles the frames in an ugoira zip into an animated image, keeping the original delay of each frame.
+
+    Meant to be run in a worker process.
+    """
+    with zipfile.ZipFile(BytesIO(archive)) as zf, BytesIO() as out:
+        match format:
+            case "webp":
+                _write_webp(zf, frames, out)
+            case "apng":
+                _write_apng(zf, frames, out)
+            case _:
+                raise ValueError(f"Unsupported ugoira format {format}")
+        return out.getvalue()
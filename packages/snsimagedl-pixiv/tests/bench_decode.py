@@ -0,0 +1,36 @@
+"""Compares the old `json` -> `msgspec.convert` path against decoding the illust detail fixtures directly.
+
+    uv run python packages/snsimagedl-pixiv/tests/bench_decode.py
+"""
+import json
+import timeit
+from pathlib import Path
+
+import msgspec
+
+from snsimagedl_pixiv.models import IllustDetails, IllustDetailResponse, SlimIllustDetailResponse
+
+FIXTURES = sorted((Path(__file__).parent / "illust").glob("*.json"))
+NUMBER = 20_000
+
+FULL_DECODER = msgspec.json.Decoder(IllustDetailResponse, strict=False)
+SLIM_DECODER = msgspec.json.Decoder(SlimIllustDetailResponse, strict=False)
+
+
+def main() -> None:
+    cases = {
+        "json.loads + convert": lambda data: msgspec.convert(json.loads(data)["illust"], type=IllustDetails, strict=False),
+        "cached Decoder, full": FULL_DECODER.decode,
+        "cached Decoder, slim": SLIM_DECODER.decode,
+    }
+
+    for fixture in FIXTURES:
+        data = fixture.read_bytes()
+        print(f"{fixture.name} ({len(data)} bytes)")
+        for name, decode in cases.items():
+            seconds = min(timeit.repeat(lambda: decode(data), number=NUMBER, repeat=5))
+            print(f"    {name:<28} {seconds / NUMBER * 1e6:8.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,17 @@
+import asyncio
 import logging
 import re
-from typing import override, Collection
+from contextlib import asynccontextmanager, AbstractAsyncContextManager
+from pathlib import PurePosixPath
+from typing import override, Collection, ClassVar, AsyncIterator, Callable
 
 import aiohttp
 import msgspec
 from yarl import URL
 
-from snsimagedl_lib import Extractor, Metadata, ArtistMetadata
-from snsimagedl_lib.exceptions import UnsupportedLink, AgeRestricted, MediaDeleted
+from snsimagedl_lib import Extractor, Metadata, ArtistMetadata, Validators, MediaStream
+from snsimagedl_lib.exceptions import UnsupportedLink, AgeRestricted, MediaDeleted, NotModified
+from snsimagedl_twitter.hls import HlsDownloader
 from snsimagedl_twitter.models import *
 
 __all__ = (
@@ -19,9 +23,59 @@ logger = logging.getLogger(__name__)
 
 class TwitterExtractor(Extractor):
     URL_PATTERN: re.Pattern = re.compile(r"https://.*(?:twitter|x).com/.+/status/([0-9]+)")
+    API_URL: ClassVar[str] = "https://cdn.syndication.twimg.com/tweet-result"  # overridden to point at stubs in tests
+    # the media tab or the profile itself, both crawl every tweet of the account
+    PROFILE_PATTERN: ClassVar[re.Pattern] = re.compile(
+        r"https://(?:www\.|mobile\.)?(?:twitter|x)\.com/(\w{1,15})(?:/media)?/?(?:\?.*)?$"
+    )
+    RESERVED_PATHS: ClassVar[frozenset[str]] = frozenset({
+        "home", "explore", "search", "notifications", "messages", "settings", "compose", "i", "intent", "login"
+    })
+    TIMELINE_URL: ClassVar[str] = "https://syndication.twitter.com/srv/timeline-profile/screen-name/"
+    NEXT_DATA_PATTERN: ClassVar[re.Pattern] = re.compile(
+        r'<script id="__NEXT_DATA__" type="application/json">(.+?)</script>',
+        re.DOTALL
+    )
 
-    def __init__(self, session: aiohttp.ClientSession):
+    DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(
+        SlimTweet | SlimTweetTombstone,
+        strict=False
+    )
+    FULL_DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(
+        Tweet | TweetTombstone,
+        strict=False
+    )
+    TIMELINE_DECODER: ClassVar[msgspec.json.Decoder] = msgspec.json.Decoder(TimelineData, strict=False)
+
+    def __init__(
+            self,
+            session: aiohttp.ClientSession,
+            *,
+            full_models: bool = False,
+            max_video_bitrate: int | None = None,
+            max_video_size: int | None = None,
+            hls_concurrency: int = 8,
+            expand_quotes: bool = False,
+            expand_threads: bool = False,
+            expansion_concurrency: int = 4,
+            max_expanded: int = 20,
+            crawl_concurrency: int = 4
+    ):
         self.session = session
+        self.decoder = self.FULL_DECODER if full_models else self.DECODER
+        self.max_video_bitrate = max_video_bitrate
+        self.max_video_size = max_video_size
+        self.hls = HlsDownloader(
+            session,
+            concurrency=hls_concurrency,
+            max_bandwidth=max_video_bitrate,
+            max_size=max_video_size
+        )
+        self.expand_quotes = expand_quotes
+        self.expand_threads = expand_threads  # the earlier tweets the author replied to, up to the first one
+        self.expansion_concurrency = expansion_concurrency
+        self.max_expanded = max_expanded  # related tweets fetched per query
+        self.crawl_concurrency = crawl_concurrency  # tweets of a profile looked up at once
 
     def _get_tweet_id(self, url: str) -> str:
         """Extracts the tweet id from the url.
@@ -33,7 +87,7 @@ class TwitterExtractor(Extractor):
             raise UnsupportedLink(f"{url} is not a Twitter / X link.")
         return res[1]
 
-    async def _fetch(self, tweet_id: str) -> Tweet:
+    async def _fetch(self, tweet_id: str) -> SlimTweet | Tweet:
         params = {
             "id": tweet_id,
             "token": 0  # any value
@@ -42,19 +96,15 @@ class TwitterExtractor(Extractor):
             "auth_token": ""
         }
         async with self.session.get(
-                "https://cdn.syndication.twimg.com/tweet-result",
+                self.API_URL,
                 params=params,
                 cookies=cookies
         ) as res:
             res.raise_for_status()
 
-            tweet = msgspec.json.decode(
-                await res.content.read(),
-                type=Tweet | TweetTombstone,
-                strict=False
-            )
+            tweet = self.decoder.decode(await res.content.read())
 
-            if isinstance(tweet, TweetTombstone):
+            if isinstance(tweet, SlimTweetTombstone | TweetTombstone):
                 match tweet.tombstone.text.text:  # noqa
                     case TombstoneDetails.AgeRestrictedText:
                         raise AgeRestricted
@@ -65,9 +115,34 @@ class TwitterExtractor(Extractor):
                         raise Exception(f"Failed to retrieve the media. Reason: {reason}")
             return tweet
 
-    @staticmethod
-    def _get_best_source_url(media: MediaDetails) -> str:
-        def get_best_source_image_url(media: PhotoMediaDetails) -> str:
+    def _is_within_caps(self, variant: SlimVideoInfo.VideoVariant | VideoInfo.VideoVariant, duration_millis: int) -> bool:
+        if self.max_video_bitrate is not None and variant.bitrate > self.max_video_bitrate:
+            return False
+        if self.max_video_size is not None and variant.bitrate * duration_millis / 8000 > self.max_video_size:
+            return False
+        return True
+
+    def _get_best_video_url(self, video_info: SlimVideoInfo | VideoInfo) -> str:
+        mp4_variants = [
+            variant for variant in video_info.variants
+            if variant.content_type == "video/mp4" and variant.bitrate is not None
+        ]
+        if mp4_variants:
+            allowed = [variant for variant in mp4_variants if self._is_within_caps(variant, video_info.duration_millis)]
+            if allowed:
+                return max(allowed, key=lambda variant: variant.bitrate).url
+            # nothing fits the caps, the smallest one is the closest
+            return min(mp4_variants, key=lambda variant: variant.bitrate).url
+
+        for variant in video_info.variants:
+            if variant.content_type == "application/x-mpegURL":
+                return variant.url
+
+        logger.error(f"No supported video variant. Raw dump: {msgspec.json.encode(video_info)}")
+        raise NotImplementedError
+
+    def _get_best_source_url(self, media: SlimMediaDetails | MediaDetails) -> str:
+        def get_best_source_image_url(media: SlimPhotoMediaDetails | PhotoMediaDetails) -> str:
             # twitter have weird way of serving image sizes.
             # an image is usually given 4 predefined size, large, medium, small, and thumb.
             # for image that is < 2048 x 2048
@@ -85,26 +160,72 @@ class TwitterExtractor(Extractor):
                 return media.media_url_https + f"?name={n}x{n}"
 
         match media:  # noqa
-            case PhotoMediaDetails():
+            case SlimPhotoMediaDetails() | PhotoMediaDetails():
                 return get_best_source_image_url(media)
-            case VideoMediaDetails() | AnimatedGifMediaDetails():
-                return media.video_info.variants[-1].url
+            case SlimVideoMediaDetails() | SlimAnimatedGifMediaDetails() | VideoMediaDetails() | AnimatedGifMediaDetails():
+                return self._get_best_video_url(media.video_info)
             case _:
                 logger.error(f"Unsupported media type. Raw dump: {msgspec.json.encode(media)}")
                 raise NotImplementedError
 
-    @override
-    async def query(self, query: str) -> Collection[Metadata] | None:
-        tweet_id = self._get_tweet_id(query)  # checks for link supported as well
+    def _get_related_ids(self, tweet: SlimTweet | Tweet) -> list[str]:
+        ids = []
+        if self.expand_quotes and tweet.quoted_tweet is not None:
+            ids.append(tweet.quoted_tweet.id_str)
+        if self.expand_threads and tweet.in_reply_to_status_id_str is not None \
+                and (tweet.in_reply_to_screen_name or "").lower() == tweet.user.screen_name.lower():
+            ids.append(tweet.in_reply_to_status_id_str)
+        return ids
 
-        tweet = await self._fetch(tweet_id)
+    async def _try_fetch(self, tweet_id: str, limit: asyncio.Semaphore) -> SlimTweet | Tweet | None:
+        async with limit:
+            try:
+                return await self._fetch(tweet_id)
+            except MediaDeleted, AgeRestricted:
+                logger.info(f"Skipping tweet {tweet_id}, it is deleted or age restricted.")
+            except Exception:
+                logger.warning(f"Failed to fetch tweet {tweet_id}", exc_info=True)
+            return None
+
+    async def _expand(self, tweet: SlimTweet | Tweet) -> list[SlimTweet | Tweet]:
+        """Fetches the quoted tweets and the self thread of `tweet`, and theirs in turn, `max_expanded` at most.
+
+        Every tweet is fetched once, even when quoted by several, and up to `expansion_concurrency` at a time.
+        """
+        limit = asyncio.Semaphore(self.expansion_concurrency)
+        seen = {tweet.id_str}
+        related: list[SlimTweet | Tweet] = []
+
+        def expand(source: SlimTweet | Tweet) -> None:
+            for tweet_id in self._get_related_ids(source):
+                if tweet_id in seen or len(seen) > self.max_expanded:  # the original tweet is seen too
+                    continue
+                seen.add(tweet_id)
+                tg.create_task(fetch(tweet_id))
+
+        async def fetch(tweet_id: str) -> None:
+            if (fetched := await self._try_fetch(tweet_id, limit)) is not None:
+                related.append(fetched)
+                expand(fetched)
+
+        async with asyncio.TaskGroup() as tg:
+            expand(tweet)
+
+        # fetched in completion order, back to the order they were posted in
+        return [tweet, *sorted(related, key=lambda fetched: int(fetched.id_str))]
+
+    def _get_metadata(self, tweet: SlimTweet | Tweet, webpage_url: str) -> list[Metadata]:
         results = []
         for media in tweet.mediaDetails:
             source_url = self._get_best_source_url(media)
+            filename = URL(source_url).name
+            if self._is_hls(source_url):
+                filename = str(PurePosixPath(filename).with_suffix(".mp4"))  # segments are fMP4, joined into one
+
             results.append(Metadata(
-                filename=URL(source_url).name,
+                filename=filename,
                 description=tweet.text,
-                webpage_url=query,
+                webpage_url=webpage_url,
                 source_url=source_url,
                 created_at=tweet.created_at,
                 artist=ArtistMetadata(
@@ -117,6 +238,141 @@ class TwitterExtractor(Extractor):
         return results
 
     @override
-    async def download(self, media: Metadata) -> bytes:
-        async with self.session.get(media.source_url) as res:
+    async def query(self, query: str) -> Collection[Metadata] | None:
+        tweet_id = self._get_tweet_id(query)  # checks for link supported as well
+
+        tweet = await self._fetch(tweet_id)
+        if not self.expand_quotes and not self.expand_threads:
+            return self._get_metadata(tweet, query)
+
+        results = []
+        for fetched in await self._expand(tweet):
+            if fetched is tweet:
+                webpage_url = query
+            else:
+                webpage_url = f"https://x.com/{fetched.user.screen_name}/status/{fetched.id_str}"
+            results.extend(self._get_metadata(fetched, webpage_url))
+        return results
+
+    def _get_screen_name(self, url: str) -> str:
+        """Extracts the user handle from a profile url.
+
+        https://x.com/<user>  ->  <user>
+        """
+        res = self.PROFILE_PATTERN.match(url)
+        if not res or res[1].lower() in self.RESERVED_PATHS:
+            raise UnsupportedLink(f"{url} is not a Twitter / X profile link.")
+        return res[1]
+
+    async def _fetch_timeline(self, screen_name: str, max_id: int | None) -> list[TimelineTweet]:
+        params = {"max_id": str(max_id)} if max_id is not None else None
+        cookies = {
+            "auth_token": ""
+        }
+        async with self.session.get(self.TIMELINE_URL + screen_name, params=params, cookies=cookies) as res:
+            res.raise_for_status()
+            html = await res.text()
+
+        # the timeline is a rendered page, its tweets are in the data the page is hydrated from
+        data = self.NEXT_DATA_PATTERN.search(html)
+        if data is None:
+            raise Exception(f"No timeline found for {screen_name}, the account may be private or suspended.")
+        return self.TIMELINE_DECODER.decode(data[1]).tweets
+
+    def _is_own_media_tweet(self, tweet: TimelineTweet, screen_name: str) -> bool:
+        return tweet.has_media and tweet.retweeted_status is None \
+            and tweet.user.screen_name.lower() == screen_name.lower()
+
+    async def _crawl(
+            self,
+            screen_name: str,
+            archived: Callable[[Metadata], bool] | None
+    ) -> AsyncIterator[list[Metadata]]:
+        limit = asyncio.Semaphore(self.crawl_concurrency)
+        max_id = None
+        page = await self._fetch_timeline(screen_name, None)
+        while True:
+            # a page repeating the last one means the timeline has nothing older to give
+            page = [tweet for tweet in page if max_id is None or int(tweet.id_str) <= max_id]
+            if not page:
+                return
+            oldest = int(page[-1].id_str)
+            max_id = oldest - 1
+
+            # newest first, a pinned tweet listed at the top whatever its age is left to the page it is on
+            tweets = sorted(
+                (
+                    tweet for tweet in page
+                    if int(tweet.id_str) >= oldest and self._is_own_media_tweet(tweet, screen_name)
+                ),
+                key=lambda tweet: int(tweet.id_str),
+                reverse=True
+            )
+            # the next page and up to `crawl_concurrency` tweets load while the one before is saved
+            next_page = asyncio.ensure_future(self._fetch_timeline(screen_name, max_id))
+            lookups = [asyncio.ensure_future(self._try_fetch(tweet.id_str, limit)) for tweet in tweets]
+            try:
+                for lookup in lookups:
+                    if (tweet := await lookup) is None:
+                        continue
+                    webpage_url = f"https://x.com/{tweet.user.screen_name}/status/{tweet.id_str}"
+                    try:
+                        post = self._get_metadata(tweet, webpage_url)
+                    except NotImplementedError:
+                        logger.warning(f"Skipping tweet {tweet.id_str}, its media could not be listed.")
+                        continue
+
+                    if not post:
+                        continue
+                    if archived is not None and archived(post[0]):
+                        logger.info(f"Reached the already archived tweet {tweet.id_str}, stopping.")
+                        return
+                    yield post
+
+                page = await next_page
+            finally:
+                for task in (next_page, *lookups):
+                    if not task.done():
+                        task.cancel()
+
+    @override
+    def crawl(
+            self,
+            query: str,
+            *,
+            archived: Callable[[Metadata], bool] | None = None
+    ) -> AsyncIterator[list[Metadata]]:
+        return self._crawl(self._get_screen_name(query), archived)
+
+    @staticmethod
+    def _is_hls(url: str) -> bool:
+        return URL(url).path.endswith(".m3u8")
+
+    @asynccontextmanager
+    async def _open(self, url: str, validators: Validators | None) -> AsyncIterator[aiohttp.ClientResponse]:
+        async with self.session.get(url, headers=validators.to_headers() if validators else None) as res:
+            if res.status == 304:
+                raise NotModified
+            res.raise_for_status()
+            if validators is not None:
+                validators.update(res.headers)
+            yield res
+
+    @override
+    async def download(self, media: Metadata, validators: Validators | None = None) -> bytes:
+        if self._is_hls(media.source_url):
+            return await self.hls.download(media.source_url)
+
+        async with self._open(media.source_url, validators) as res:
             return await res.content.read()
+
+    @asynccontextmanager
+    async def _stream(self, url: str, validators: Validators | None) -> AsyncIterator[MediaStream]:
+        async with self._open(url, validators) as res:
+            yield MediaStream(res.content_length, res.content.iter_any())
+
+    @override
+    def stream(self, media: Metadata, validators: Validators | None = None) -> AbstractAsyncContextManager[MediaStream]:
+        if self._is_hls(media.source_url):
+            raise NotImplementedError  # joined from segments, its variant picked under `max_video_size`
+        return self._stream(media.source_url, validators)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import re
+
+import aiohttp
+from yarl import URL
+
+from snsimagedl_lib import mux_fragments
+
+__all__ = (
+    "HlsDownloader",
+)
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def _parse_attributes(line: str) -> dict[str, str]:
+    """`#EXT-X-STREAM-INF:BANDWIDTH=1280000,CODECS="avc1.4d401f"`  ->  `{"BANDWIDTH": "1280000", "CODECS": "avc1.4d401f"}`"""
+    _, _, attributes = line.partition(":")
+    return {key: value.strip('"') for key, value in ATTRIBUTE_PATTERN.findall(attributes)}
+
+
+class HlsDownloader:
+    """Downloads an HLS stream into a single file by fetching its segments concurrently and concatenating them.
+
+    Segments are joined as-is without re-encoding, so the result is in the segments' container,
+    a fragmented MP4 for the fMP4 streams Twitter serves.
+    A separate audio rendition is downloaded alongside and muxed in as a second track, for fMP4 streams only.
+    The variant is picked under `max_bandwidth`, and under `max_size` as estimated from its bandwidth and duration.
+    """
+
+    def __init__(
+            self,
+            session: aiohttp.ClientSession,
+            *,
+            concurrency: int = 8,
+            max_bandwidth: int | None = None,
+            max_size: int | None = None
+    ):
+        self.session = session
+        self.concurrency = concurrency
+        self.max_bandwidth = max_bandwidth
+        self.max_size = max_size  # bytes
+
+    async def _get_playlist(self, url: URL) -> list[str]:
+        async with self.session.get(url) as res:
+            res.raise_for_status()
+            return [line.strip() for line in (await res.text()).splitlines() if line.strip()]
+
+    def _get_variants(self, url: URL, playlist: list[str]) -> list[tuple[int, URL, str | None]]:
+        """Lists the variants of a master playlist under `max_bandwidth`, highest bandwidth first.
+
+        When none is, the lowest bandwidth one is the closest.
+        """
+        variants: list[tuple[int, URL, str | None]] = []
+        for info, uri in zip(playlist, playlist[1:]):
+            if info.startswith("#EXT-X-STREAM-INF"):
+                attributes = _parse_attributes(info)
+                variants.append((int(attributes.get("BANDWIDTH", 0)), url.join(URL(uri)), attributes.get("AUDIO")))
+
+        if not variants:
+            raise ValueError(f"No variants found in {url}")
+
+        allowed = [variant for variant in variants if self.max_bandwidth is None or variant[0] <= self.max_bandwidth]
+        if not allowed:
+            return [min(variants, key=lambda variant: variant[0])]
+        return sorted(allowed, key=lambda variant: variant[0], reverse=True)
+
+    async def _select_variant(self, url: URL, playlist: list[str]) -> tuple[URL, list[str], str | None]:
+        """Picks the highest bandwidth variant within the caps, returns its url, media playlist and audio group."""
+        variants = self._get_variants(url, playlist)
+        for bandwidth, variant_url, group in variants:
+            media = await self._get_playlist(variant_url)
+            # BANDWIDTH is the peak bitrate of the variant with its audio, so this overestimates
+            if self.max_size is None or bandwidth * self._get_duration(media) / 8 <= self.max_size:
+                return variant_url, media, group
+            logger.debug(f"{variant_url} would be larger than {self.max_size} bytes, trying a lower bandwidth")
+
+        # nothing fits the caps, the smallest one is the closest
+        return variant_url, media, group
+
+    @staticmethod
+    def _get_duration(playlist: list[str]) -> float:
+        """Sums the `#EXTINF:<seconds>,<title>` segment durations of a media playlist."""
+        return sum(
+            float(line.partition(":")[2].partition(",")[0])
+            for line in playlist if line.startswith("#EXTINF")
+        )
+
+    @staticmethod
+    def _select_audio(url: URL, playlist: list[str], group: str | None) -> URL | None:
+        """Picks the separate audio rendition of a variant's group from a master playlist, if any."""
+        if group is None:
+            return None
+
+        # renditions without a URI are muxed in the variant already
+        renditions = [
+            attributes for line in playlist if line.startswith("#EXT-X-MEDIA")
+            if (attributes := _parse_attributes(line)).get("TYPE") == "AUDIO"
+            and attributes.get("GROUP-ID") == group and "URI" in attributes
+        ]
+        if not renditions:
+            return None
+        rendition = next((attributes for attributes in renditions if attributes.get("DEFAULT") == "YES"), renditions[0])
+        return url.join(URL(rendition["URI"]))
+
+    @staticmethod
+    def _get_segments(url: URL, playlist: list[str]) -> list[URL]:
+        segments = []
+        for line in playlist:
+            if line.startswith("#EXT-X-KEY") and _parse_attributes(line).get("METHOD", "NONE") != "NONE":
+                raise NotImplementedError("Encrypted HLS streams are not supported")
+            if line.startswith("#EXT-X-MAP"):
+                segments.append(url.join(URL(_parse_attributes(line)["URI"])))  # fMP4 init segment
+            elif not line.startswith("#"):
+                segments.append(url.join(URL(line)))
+        return segments
+
+    async def _download_segment(self, url: URL, limit: asyncio.Semaphore) -> bytes:
+        async with limit:
+            async with self.session.get(url) as res:
+                res.raise_for_status()
+                return await res.read()
+
+    async def _download_segments(self, url: URL, playlist: list[str], limit: asyncio.Semaphore) -> list[bytes]:
+        """Downloads the segments of a media playlist, an fMP4 init segment first."""
+        return await asyncio.gather(*(
+            self._download_segment(segment, limit)
+            for segment in self._get_segments(url, playlist)
+        ))
+
+    async def _download_media(self, url: URL, limit: asyncio.Semaphore) -> list[bytes]:
+        return await self._download_segments(url, await self._get_playlist(url), limit)
+
+    async def download(self, url: str | URL) -> bytes:
+        url = URL(url)
+        playlist = await self._get_playlist(url)
+        limit = asyncio.Semaphore(self.concurrency)
+
+        if not any(line.startswith("#EXT-X-STREAM-INF") for line in playlist):
+            return b"".join(await self._download_segments(url, playlist, limit))
+
+        video_url, video_playlist, group = await self._select_variant(url, playlist)
+        audio_url = self._select_audio(url, playlist, group)
+        if audio_url is None:
+            return b"".join(await self._download_segments(video_url, video_playlist, limit))
+
+        video, audio = await asyncio.gather(
+            self._download_segments(video_url, video_playlist, limit),
+            self._download_media(audio_url, limit)
+        )
+        try:
+            return mux_fragments(video, audio)
+        except ValueError as e:
+            # like MPEG-TS segments, which would need remuxing, failed rather than saved without sound
+            raise NotImplementedError(f"Cannot join the separate audio of {url}: {e}") from e
@@ -1,3 +1,5 @@
 from .base import *
 from .tombstone import *
 from .tweet import *
+from .slim import *
+from .timeline import *
@@ -0,0 +1,101 @@
+##########################
+# Twitter CDN API Schema #
+##########################
+# Trimmed down variants of the full schema, holding only the fields `TwitterExtractor.query` reads.
+# msgspec skips unknown fields without building them, so decoding into these is much cheaper.
+# The full models in `tweet.py` / `tombstone.py` are kept for debugging and reference.
+from datetime import datetime
+
+from msgspec import Struct
+
+from snsimagedl_twitter.models.base import TweetResponse
+
+__all__ = (
+    "SlimTweet",
+    "SlimMediaDetails",
+    "SlimPhotoMediaDetails",
+    "SlimVideoMediaDetails",
+    "SlimAnimatedGifMediaDetails",
+    "SlimVideoInfo",
+    "SlimTweetTombstone",
+    "SlimTweetReference",
+)
+
+
+class SlimEntitiesList(Struct):
+    class HashtagEntity(Struct):
+        text: str
+
+    hashtags: list[HashtagEntity] = []
+
+
+class SlimUser(Struct):
+    name: str  # display name
+    screen_name: str  # user handle
+
+
+class SlimVideoInfo(Struct):
+    class VideoVariant(Struct):
+        content_type: str
+        url: str
+        bitrate: int | None = None  # missing on the HLS playlist variant
+
+    variants: list[VideoVariant]
+    duration_millis: int = 0
+
+
+class SlimMediaDetails(Struct, tag_field="type"):
+    class MediaInfo(Struct):
+        height: int
+        width: int
+
+    class MediaSizes(Struct):
+        class Size(Struct):
+            h: int
+            w: int
+
+        large: Size
+
+    media_url_https: str  # image source url
+    original_info: MediaInfo
+    sizes: MediaSizes
+
+
+class SlimPhotoMediaDetails(SlimMediaDetails, tag="photo"):
+    pass
+
+
+class SlimVideoMediaDetails(SlimMediaDetails, tag="video"):
+    video_info: SlimVideoInfo
+
+
+class SlimAnimatedGifMediaDetails(SlimMediaDetails, tag="animated_gif"):
+    video_info: SlimVideoInfo
+
+
+class SlimTweetReference(Struct):
+    id_str: str
+
+
+class SlimTweet(TweetResponse, tag="Tweet"):
+    created_at: datetime
+    entities: SlimEntitiesList
+    id_str: str  # tweet id
+    text: str  # tweet content
+    user: SlimUser
+    mediaDetails: list[SlimPhotoMediaDetails | SlimVideoMediaDetails | SlimAnimatedGifMediaDetails] = []
+    # read to expand quotes and self threads
+    in_reply_to_status_id_str: str | None = None
+    in_reply_to_screen_name: str | None = None  # user handle
+    quoted_tweet: SlimTweetReference | None = None
+
+
+class SlimTombstone(Struct):
+    class Details(Struct):
+        text: str
+
+    text: Details
+
+
+class SlimTweetTombstone(TweetResponse, tag="TweetTombstone"):
+    tombstone: SlimTombstone
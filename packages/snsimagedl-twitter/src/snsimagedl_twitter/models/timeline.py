@@ -0,0 +1,61 @@
+#######################################
+# Twitter Syndication Timeline Schema #
+#######################################
+# The `__NEXT_DATA__` of the embedded profile timeline, holding only the fields `TwitterExtractor.crawl` reads.
+# Its tweets are in the legacy API format, they are only listed here and looked up again through the CDN API.
+from msgspec import Struct
+
+from snsimagedl_twitter.models.slim import SlimTweetReference
+
+__all__ = (
+    "TimelineTweet",
+    "TimelineData",
+)
+
+
+class TimelineTweet(Struct):
+    class User(Struct):
+        screen_name: str  # user handle
+
+    class Entities(Struct):
+        class MediaEntity(Struct):
+            pass
+
+        media: list[MediaEntity] = []
+
+    id_str: str
+    user: User
+    entities: Entities
+    retweeted_status: SlimTweetReference | None = None
+
+    @property
+    def has_media(self) -> bool:
+        return bool(self.entities.media)
+
+
+class TimelineEntry(Struct):
+    class Content(Struct):
+        tweet: TimelineTweet | None = None
+
+    type: str
+    content: Content
+
+
+class TimelineData(Struct):
+    class Props(Struct):
+        class PageProps(Struct):
+            class Timeline(Struct):
+                entries: list[TimelineEntry] = []
+
+            timeline: Timeline
+
+        pageProps: PageProps
+
+    props: Props
+
+    @property
+    def tweets(self) -> list[TimelineTweet]:
+        return [
+            entry.content.tweet for entry in self.props.pageProps.timeline.entries
+            if entry.type == "tweet" and entry.content.tweet is not None
+        ]
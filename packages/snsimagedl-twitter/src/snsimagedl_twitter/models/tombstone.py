@@ -3,7 +3,7 @@
 ##########################
 from typing import ClassVar
 
-from msgspec import Struct
+from msgspec import Struct, field
 
 from snsimagedl_twitter.models import TweetResponse
 
@@ -17,7 +17,7 @@ __all__ = (
 
 
 class EntityReference(Struct):
-    __typename: str
+    typename: str = field(name="__typename")
     url: str
     url_type: str
 
@@ -13,7 +13,9 @@ __all__ = (
     "MediaDetails",
     "PhotoMediaDetails",
     "VideoMediaDetails",
-    "AnimatedGifMediaDetails"
+    "AnimatedGifMediaDetails",
+    "VideoInfo",
+    "TweetReference"
 )
 
 type Range = tuple[int, int]
@@ -74,9 +76,9 @@ class EditControl(Struct):
 
 class VideoInfo(Struct):
     class VideoVariant(Struct):
-        bitrate: int
         content_type: str  # MIME types https://developer.mozilla.org/en-US/docs/Web/HTTP/Guides/MIME_types/Common_types
         url: str
+        bitrate: int | None = None  # missing on the HLS playlist variant
 
     aspect_ratio: tuple[int, int]
     duration_millis: int
@@ -155,6 +157,11 @@ class Video(Struct):
     viewCount: int
 
 
+class TweetReference(Struct):
+    """A related tweet embedded in a response, like the quoted one."""
+    id_str: str
+
+
 class Tweet(TweetResponse):
     lang: str
     favorite_count: int  # like count
@@ -173,3 +180,6 @@ class Tweet(TweetResponse):
     isEdited: bool
     isStaleEdit: bool
     videos: Video | None = None
+    in_reply_to_status_id_str: str | None = None
+    in_reply_to_screen_name: str | None = None  # user handle
+    quoted_tweet: TweetReference | None = None
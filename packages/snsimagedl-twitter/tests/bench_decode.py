@@ -0,0 +1,35 @@
+"""Compares decoding the syndication API fixtures into the full and the slim models.
+
+    uv run python packages/snsimagedl-twitter/tests/bench_decode.py
+"""
+import timeit
+from pathlib import Path
+
+import msgspec
+
+from snsimagedl_twitter.models import Tweet, TweetTombstone, SlimTweet, SlimTweetTombstone
+
+FIXTURES = sorted(Path(__file__).parent.glob("*.json"))
+NUMBER = 20_000
+
+FULL_DECODER = msgspec.json.Decoder(Tweet | TweetTombstone, strict=False)
+SLIM_DECODER = msgspec.json.Decoder(SlimTweet | SlimTweetTombstone, strict=False)
+
+
+def main() -> None:
+    cases = {
+        "decode(type=...) per call": lambda data: msgspec.json.decode(data, type=Tweet | TweetTombstone, strict=False),
+        "cached Decoder, full": FULL_DECODER.decode,
+        "cached Decoder, slim": SLIM_DECODER.decode,
+    }
+
+    for fixture in FIXTURES:
+        data = fixture.read_bytes()
+        print(f"{fixture.name} ({len(data)} bytes)")
+        for name, decode in cases.items():
+            seconds = min(timeit.repeat(lambda: decode(data), number=NUMBER, repeat=5))
+            print(f"    {name:<28} {seconds / NUMBER * 1e6:8.2f} us")
+
+
+if __name__ == '__main__':
+    main()